@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Load benchmark of server.py: concurrent keep-alive clients send requests of
+surfaces to a local server, without micro-batching (batch size 1) and with
+micro-batching. Reports requests per second and the mean batch size.
+
+Usage: python benchmarks/server.py [clients] [requests per client]
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import Server
+
+requests = [
+    {'element': 'roof', 'area': 120, 'p': 750, 'etp': 550, 'sp': 0.3},
+    {'element': 'green_roof', 'area': 300, 'p': 900, 'etp': 600, 'h': 100},
+    {'element': 'gravel_cover', 'area': 80, 'p': 650, 'etp': 520},
+    {'element': 'permeable_surface', 'area': 200, 'fa': 3, 'kf': 30},
+    ]
+
+
+async def client(port, n, offset):
+    ''' sends n requests over one connection'''
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    for i in range(n):
+        body = json.dumps(requests[(i + offset) % len(requests)]).encode()
+        writer.write(b"POST /surface HTTP/1.1\r\nHost: localhost\r\n"
+                     b"Content-Type: application/json\r\n"
+                     + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await writer.drain()
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            if line.lower().startswith(b'content-length:'):
+                length = int(line.split(b':')[1])
+        await reader.readexactly(length)
+    writer.close()
+
+
+async def measure(batch_size, clients, n, latency=0.002):
+    server = Server(batch_size, latency)
+    port = await server.start(port=0)
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, n, i) for i in range(clients)))
+    elapsed = time.perf_counter() - start
+    await server.close()
+    batcher = server.batcher
+    return clients*n/elapsed, batcher.items/max(batcher.batches, 1)
+
+
+def main(clients=64, n=50):
+    print(f"{clients} clients, {n} requests each")
+    for batch_size in (1, 16, 256):
+        rps, mean = asyncio.run(measure(batch_size, clients, n))
+        print(f"batch size {batch_size:>4}: {rps:>8.0f} requests/s"
+              f" (mean batch {mean:.1f})")
+
+
+if __name__ == '__main__':
+    main(*(int(x) for x in sys.argv[1:3]))
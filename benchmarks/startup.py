@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Startup benchmark: time of a fresh interpreter to import dwa_a102 and
+calculate a roof, with the lazy record path (records=True, neither pandas
+nor NumPy are imported) and with the DataFrame path (pandas is imported on
+first use). The eager import of pandas and NumPy, which every cold start
+paid before, is measured as reference.
+
+Usage: python benchmarks/startup.py [runs]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+cases = {
+    'import dwa_a102':
+        "import dwa_a102",
+    'scalar roof, records=True':
+        "import dwa_a102; dwa_a102.StudyArea(800, 500, records=True).roof(100)",
+    'scalar roof, DataFrame':
+        "import dwa_a102; dwa_a102.StudyArea(800, 500).roof(100)",
+    'eager import numpy, pandas (before)':
+        "import numpy, pandas",
+    }
+
+child = '''
+import sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+# a lazy module that has not been used yet is not in sys.modules
+print(elapsed, type(sys.modules.get('pandas')).__name__ == 'module')
+'''
+
+
+def measure(code, runs=10):
+    ''' median time (s) of the code in a fresh interpreter'''
+    times = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', child.format(root=root, code=code)],
+                             capture_output=True, text=True, check=True).stdout.split()
+        times.append(float(out[0]))
+    return statistics.median(times), out[1] == 'True'
+
+
+def main(runs=10):
+    results = {name: measure(code, runs) for name, code in cases.items()}
+    print(f"{'case':<40}{'median (ms)':>12}  pandas loaded")
+    for name, (time, pandas) in results.items():
+        print(f"{name:<40}{time*1000:>12.1f}  {pandas}")
+    lazy = results['scalar roof, records=True'][0]
+    eager = results['eager import numpy, pandas (before)'][0] + results['import dwa_a102'][0]
+    print(f"\nCold start of a scalar calculation: {lazy*1000:.1f} ms instead of"
+          f" at least {eager*1000:.1f} ms ({eager/lazy:.0f}x faster)")
+    return results
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed cache of partitioning factors, persisted in SQLite.
+
+The key of a result is a hash of the element type, P, ETp and the parameters
+of the element (missing values replaced by their standard values) together
+with a hash of the registry, so results computed with other regression
+equations are never reused. Every key stores a, g, v and e. The cache holds
+at most max_entries results; the least recently used ones are evicted.
+
+    cache = Cache('nightly.sqlite')
+    results = study_area.surface_table(parcels, cache=cache)
+    results = evaluate_scenarios(climates, design, cache=cache)
+"""
+
+import hashlib
+import sqlite3
+import numpy as np
+import pandas as pd
+import formulas
+
+# results of an older registry are not reused
+registry_version = hashlib.blake2b(repr(sorted(formulas.registry.items())).encode(),
+                                   digest_size=8).digest()
+
+
+def _digests(element, p, etp, **params):
+    '''
+    Hashes of the results of an element: two 64 bit hashes per row (one
+    row per result, in the order of the flattened inputs) and the broadcast
+    shape of the inputs
+    '''
+    spec = formulas.registry[element]
+    unknown = set(params) - set(spec['params'])
+    if unknown:
+        raise Exception(f"Unknown parameters of {element}: {', '.join(sorted(unknown))}")
+    values = [p, etp]
+    for name, standard in spec['params'].items():
+        value = params.get(name)
+        if standard is None:
+            values.append(np.nan if value is None else value)
+        else:
+            values.append(formulas._fill(value, standard))
+    values = np.broadcast_arrays(*(np.asarray(x, dtype=np.float64) for x in values))
+    shape = values[0].shape
+    # one row per result; NaN and -0.0 are normalized before hashing
+    rows = np.stack([x.ravel() for x in values], axis=1) + 0.0
+    rows[np.isnan(rows)] = np.nan
+    rows = pd.DataFrame(rows)
+    # vectorized hashes (as in delta.py), keyed by the registry version and
+    # the element
+    prefix = registry_version + element.encode()
+    digests = np.stack([pd.util.hash_pandas_object(
+        rows, index=False,
+        hash_key=hashlib.blake2b(prefix + salt, digest_size=8).hexdigest()).to_numpy()
+        for salt in (b'0', b'1')], axis=1)
+    return digests.astype('<u8'), shape
+
+
+def _keys(digests):
+    ''' 16 byte keys of rows of digests'''
+    buffer = np.ascontiguousarray(digests).tobytes()
+    return [buffer[i:i + 16] for i in range(0, len(buffer), 16)]
+
+
+def _distinct(digests):
+    '''
+    Distinct rows of digests
+
+    Returns
+    -------
+    codes : array
+          number of the distinct row of every row
+
+    first : array
+          first row of every distinct row
+    '''
+    codes, uniques = pd.factorize(digests[:, 0])
+    first = np.empty(len(uniques), dtype=np.int64)
+    first[codes[::-1]] = np.arange(len(codes))[::-1]
+    if (digests[first[codes], 1] != digests[:, 1]).any():
+        # rows with the same first hash but different second ones
+        _, first, codes = np.unique(np.ascontiguousarray(digests).view('V16').ravel(),
+                                    return_index=True, return_inverse=True)
+    return codes, first
+
+
+def keys(element, p, etp, **params):
+    '''
+    Keys of the results of an element, broadcast over the inputs as in
+    formulas.evaluate()
+
+    Returns
+    -------
+    keys : list of bytes
+         16 byte digests (two vectorized 64 bit hashes of the inputs), in
+         the order of the flattened inputs
+
+    shape : tuple
+          broadcast shape of the inputs
+    '''
+    digests, shape = _digests(element, p, etp, **params)
+    return _keys(digests), shape
+
+
+class Cache(object):
+    '''
+    Cache of a, g, v and e in the SQLite database at path (':memory:' for a
+    cache that is not persisted)
+
+    Parameters
+    ----------
+    path : string
+         file of the database, created if it does not exist
+
+    max_entries : int
+                maximum number of results, the least recently used results
+                are evicted beyond it
+    '''
+    chunk = 900     # keys per SQL statement (SQLite limits the variables)
+
+    def __init__(self, path='dwa_a102_cache.sqlite', max_entries=1000000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results (key BLOB PRIMARY KEY, a REAL,"
+            " g REAL, v REAL, e REAL, used INTEGER) WITHOUT ROWID")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+        self.connection.commit()
+        self.size, clock = self.connection.execute(
+            "SELECT COUNT(*), MAX(used) FROM results").fetchone()
+        self.clock = (clock or 0) + 1
+        self._evict()
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __str__(self):
+        return (f"Cache {self.path}: {self.size} of {self.max_entries} results,"
+                f" {self.hits} hits and {self.misses} misses")
+
+    def close(self):
+        self.connection.close()
+
+    def clear(self):
+        self.connection.execute("DELETE FROM results")
+        self.connection.commit()
+        self.size = 0
+
+    def get(self, keys):
+        ''' cached results {key: (a, g, v, e)} of the keys found in the cache'''
+        found = {}
+        for i in range(0, len(keys), self.chunk):
+            chunk = keys[i:i + self.chunk]
+            marks = ', '.join('?'*len(chunk))
+            found.update((row[0], row[1:]) for row in self.connection.execute(
+                f"SELECT key, a, g, v, e FROM results WHERE key IN ({marks})", chunk))
+            self.connection.execute(
+                f"UPDATE results SET used = ? WHERE key IN ({marks})",
+                [self.clock, *chunk])
+        self.clock += 1
+        self.connection.commit()
+        return found
+
+    def put(self, keys, results):
+        ''' stores the results (a, g, v, e) of the keys and evicts old results'''
+        cursor = self.connection.executemany(
+            "INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+            [(key, *map(float, result), self.clock)
+             for key, result in zip(keys, results)])
+        self.size += cursor.rowcount
+        self.clock += 1
+        self._evict()
+
+    def _evict(self):
+        ''' deletes the least recently used results beyond max_entries'''
+        if self.size > self.max_entries:
+            self.connection.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results"
+                " ORDER BY used LIMIT ?)", (self.size - self.max_entries,))
+            self.size = self.max_entries
+        self.connection.commit()
+
+    def evaluate(self, element, p, etp, engine=None, **params):
+        '''
+        formulas.evaluate() (or engine) through the cache: only the distinct
+        results that are not cached are evaluated, in one call, and stored
+
+        Returns
+        -------
+        a, g, v, e : arrays
+                   broadcast to the common shape of the inputs
+        '''
+        engine = engine or formulas.evaluate
+        digests, shape = _digests(element, p, etp, **params)
+        n = len(digests)
+        codes, first = _distinct(digests)
+        keys_ = _keys(digests[first])
+        found = self.get(keys_)
+        results = np.full((4, len(keys_)), np.nan)
+        missing = []
+        for j, key in enumerate(keys_):
+            if key in found:
+                results[:, j] = found[key]
+            else:
+                missing.append(j)
+        # hits and misses are counted in rows
+        misses = int(np.bincount(codes, minlength=len(keys_))[missing].sum())
+        self.hits += n - misses
+        self.misses += misses
+
+        if missing:
+            # the inputs of the first row of every missing key
+            rows = first[missing]
+            inputs = {name: np.broadcast_to(np.asarray(value, dtype=float),
+                                            shape).reshape(n)[rows]
+                      for name, value in (('p', p), ('etp', etp), *params.items())
+                      if value is not None}
+            computed = engine(element, inputs.pop('p'), inputs.pop('etp'), **inputs)
+            computed = np.array([np.broadcast_to(x, (len(rows),))
+                                 for x in computed], dtype=float)
+            results[:, missing] = computed
+            self.put([keys_[j] for j in missing], computed.T)
+        return tuple(x[codes].reshape(shape) for x in results)
+
+    def engine(self, engine=None):
+        '''
+        Evaluation function with the arguments of formulas.evaluate() that
+        uses the cache, e.g. for formulas.evaluate_groups(engine=...)
+        '''
+        def evaluate(element, p, etp, **params):
+            return self.evaluate(element, p, etp, engine=engine, **params)
+        return evaluate
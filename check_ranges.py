@@ -5,6 +5,10 @@ Created on Fri Feb 19 10:12:05 2021
 @author: Edwin Echeverri Salazar
 """
 
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+
 param_rages = {
     'P': [500, 1700, 'Precipitation', 'mm/a'], 
     'ETp' :[450, 700, 'Evapotranspiration', 'mm/a'], 
@@ -40,6 +44,7 @@ param_rages = {
     'a_2_pod_system': [0.0, 1.0, 'Proportion of area 2 (a_2)', ''],
     'a_3_pod_system': [0.0, 1.0, 'Proportion of area 3 (a_3)', ''],
     'a_4_pod_system': [0.0, 1.0, 'Proportion of area 4 (a_4)', ''],
+    'a_i_pod_system': [0.0, 1.0, 'Proportion of contributing area (a_i)', ''],
     }
 
 
@@ -49,4 +54,17 @@ def validRange(val, param):
     if ( (val < param_rages[param][0]) or (val > param_rages[param][1]) ): 
         raise Exception(f"{param_rages[param][2]} is not valid."
                         f" Acceptable range: {param_rages[param][0]} - {param_rages[param][1]}"
-                        f" {param_rages[param][3]}")
\ No newline at end of file
+                        f" {param_rages[param][3]}")
+
+
+def validRanges(vals, param):
+    ''' vectorized version of validRange, reports all the invalid values'''
+
+    vals = np.asarray(vals, dtype=float)
+    invalid = (vals < param_rages[param][0]) | (vals > param_rages[param][1])
+    if invalid.any():
+        raise Exception(f"{param_rages[param][2]} is not valid for"
+                        f" {invalid.sum()} of {vals.size} values"
+                        f" (e.g. {', '.join(str(x) for x in vals[invalid][:5])})."
+                        f" Acceptable range: {param_rages[param][0]} - {param_rages[param][1]}"
+                        f" {''.join(param_rages[param][3:])}")
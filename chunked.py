@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+Out-of-core water balance of tables of surfaces larger than memory, e.g. the
+parcels of a national run (> 20 million rows).
+
+The table is read from CSV or Parquet in blocks of chunk_size rows, every
+block is evaluated with the vectorized surface_table() and its results are
+written as one part of the output (out/part-000000.csv, ...), so the peak
+memory is set by chunk_size and not by the size of the table. The sums of
+the areas and volumes (the row System of watbal) are carried from block to
+block.
+
+Every finished block is recorded with its sums in out/manifest.json, which
+is replaced atomically. A run that stops (crash, kill) is continued with
+resume=True: finished blocks are skipped and the parts and totals are the
+same as those of an uninterrupted run.
+
+    totals = balance_table(StudyArea(location='Berlin'), 'parcels.csv', 'balance',
+                           chunk_size=500000, resume=True)
+    delta.system(totals)        # row System of watbal
+
+Distributions of the results (e.g. quantiles of a per district) are
+collected block by block in streaming sketches (sketches.Sketches).
+
+Parts are written as CSV, Parquet or compact NumPy archives (format='npz',
+see compact.py). Parquet requires pyarrow (optional dependency). The element
+column is read as a categorical, so it does not take one Python string per
+row.
+"""
+
+import json
+import os
+import re
+import pandas as pd
+import formulas
+from compact import compact
+from delta import totals as _totals
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+
+def _format(path):
+    ''' format of a file from its extension: csv or parquet'''
+    extension = os.path.splitext(str(path))[1].lower()
+    if extension in ('.parquet', '.pq'):
+        if not HAVE_PYARROW:
+            raise Exception("Parquet files require the optional dependency pyarrow"
+                            " (pip install pyarrow)")
+        return 'parquet'
+    return 'csv'
+
+
+def read_chunks(path, chunk_size=100000, element='element', columns=None, start=0):
+    '''
+    Reads a table of surfaces in blocks of rows
+
+    Parameters
+    ----------
+    path : string
+         CSV or Parquet (.parquet, .pq) file
+
+    chunk_size : int
+               number of rows per block
+
+    element : string
+            column of the types of surface, read as a categorical
+
+    columns : list of strings
+            columns to read (default: all)
+
+    start : int
+          number of the first block (the blocks before are skipped)
+
+    Returns
+    -------
+    chunks : generator of DataFrames
+           blocks with a RangeIndex continuing from block to block
+    '''
+    row = start*chunk_size
+    if _format(path) == 'parquet':
+        batches = pyarrow.parquet.ParquetFile(path).iter_batches(chunk_size,
+                                                                 columns=columns)
+        for number, batch in enumerate(batches):
+            if number < start:
+                continue
+            chunk = batch.to_pandas()
+            chunk.index = pd.RangeIndex(row, row + len(chunk))
+            chunk[element] = chunk[element].astype('category')
+            row += len(chunk)
+            yield chunk
+    else:
+        # skipped rows are not parsed
+        for chunk in pd.read_csv(path, chunksize=chunk_size, usecols=columns,
+                                 dtype={element: 'category'},
+                                 skiprows=range(1, row + 1)):
+            chunk.index = chunk.index + row
+            yield chunk
+
+
+def _write(results, path):
+    ''' writes a part of the output (atomically: complete or not at all)'''
+    temporary = path + '.tmp'
+    if path.endswith('.parquet'):
+        results.to_parquet(temporary, index=True)
+    elif path.endswith('.npz'):
+        with open(temporary, 'wb') as file:
+            compact(results).save(file)
+    else:
+        results.to_csv(temporary, index=True, index_label='row')
+    os.replace(temporary, path)
+
+#%% Checkpoints
+
+def _write_manifest(manifest, out):
+    ''' replaces the manifest of out atomically'''
+    path = os.path.join(out, 'manifest.json')
+    temporary = path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=1)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+def read_manifest(out):
+    ''' manifest of an output directory, None if there is none'''
+    path = os.path.join(out, 'manifest.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def _signature(path):
+    ''' size and modification time of the input'''
+    status = os.stat(path)
+    return {'size': status.st_size, 'mtime_ns': status.st_mtime_ns}
+
+
+def evaluate_chunk(study_area, chunk, element='element', area='area', location=None,
+                   keep=None, cache=None):
+    '''
+    Results of a block of surfaces (surface_table)
+
+    Parameters
+    ----------
+    study_area : StudyArea or Climate
+               climate of the surfaces without location
+
+    location : string
+             column of the locations of the surfaces (climate.climate_dict);
+             the surfaces of every location are evaluated with its climate
+             (dwa_a102.context())
+
+    keep : list of strings
+         columns of the table copied to the results (e.g. an identifier)
+    '''
+    from dwa_a102 import context
+
+    chunk = chunk.assign(**{element: chunk[element].astype(object)})
+    if location is None:
+        results = study_area.surface_table(chunk, element=element, area=area,
+                                           cache=cache)
+    else:
+        missing = chunk[location].isna()
+        if missing.any():
+            raise Exception(f"{missing.sum()} surfaces without location, e.g. row"
+                            f" {chunk.index[missing.argmax()]}")
+        parts = [context(location=name).surface_table(rows, element=element, area=area,
+                                                      cache=cache)
+                 for name, rows in chunk.groupby(location, sort=False, observed=True)]
+        results = pd.concat(parts).reindex(chunk.index)
+    if keep:
+        results = pd.concat([chunk[keep], results], axis=1)
+    return results
+
+
+def balance_table(study_area, path, out, chunk_size=100000, element='element',
+                  area='area', location=None, keep=None, format=None, cache=None,
+                  resume=False, sketches=None):
+    '''
+    Calculates the water balance of a table of surfaces block by block
+
+    Parameters
+    ----------
+    study_area : StudyArea or Climate
+               climate of the surfaces (not used with location)
+
+    path : string
+         CSV or Parquet file of the surfaces (input of surface_table)
+
+    out : string
+        directory of the output, one file per block (part-000000.csv, ...)
+
+    chunk_size : int
+               number of rows read, evaluated and written at a time
+
+    element, area, cache :
+                         as in surface_table()
+
+    location, keep :
+                   column of the locations and columns copied to the
+                   output, see evaluate_chunk()
+
+    format : string
+           format of the parts, 'csv', 'parquet' or 'npz' (compact.Compact,
+           read with compact.load(part).to_frame()); default: that of path
+
+    resume : bool
+           continue the run recorded in out/manifest.json: its finished
+           blocks are skipped. The input and the settings must be those of
+           the recorded run. Without resume the run starts over.
+
+    sketches : sketches.Sketches
+             sketches filled with the results of every block (its column
+             by may be a column of the table); recorded in the manifest
+             with the totals, and restored when a run is resumed
+
+    Notes
+    ------
+    The parts keep the row numbers of the table (column row of CSV parts,
+    index of Parquet parts). Results are not rounded. The surfaces are
+    evaluated with the methods of Surface; measures that collect the runoff
+    of the surfaces are evaluated afterwards (e.g. cascade() on the parts
+    that drain into them).
+
+    Returns
+    -------
+    totals : Series
+           sums of the area and volumes of the table, see delta.system()
+           for the row System of watbal
+    '''
+    format = format or _format(path)
+    if format == 'parquet':
+        _format('part.parquet')     # requires pyarrow
+    settings = {'path': os.path.abspath(path), 'input': _signature(path),
+                'chunk_size': chunk_size, 'element': element, 'area': area,
+                'location': location, 'keep': list(keep) if keep else None,
+                'format': format, 'p': None if location else float(study_area.p),
+                'etp': None if location else float(study_area.etp),
+                'sketches': None if sketches is None else
+                [sketches.columns, sketches.by, sketches.k]}
+    os.makedirs(out, exist_ok=True)
+    manifest = read_manifest(out) if resume else None
+    if manifest is None:
+        for name in os.listdir(out):
+            if re.fullmatch(r'part-\d{6}\.(csv|parquet|npz)(\.tmp)?', name):
+                os.remove(os.path.join(out, name))
+        manifest = {'settings': settings, 'parts': [], 'totals': None, 'sketches': None,
+                    'complete': False}
+        _write_manifest(manifest, out)
+    elif manifest['settings'] != settings:
+        changed = [key for key in settings
+                   if manifest['settings'].get(key) != settings[key]]
+        raise Exception(f"Cannot resume {out}: the input or the settings changed"
+                        f" ({', '.join(changed)})")
+
+    parts = manifest['parts']
+    if sketches is not None and manifest['sketches'] is not None:
+        sketches.load(manifest['sketches'])
+    if not manifest['complete']:
+        for chunk in read_chunks(path, chunk_size, element, start=len(parts)):
+            number = len(parts)
+            unknown = set(chunk[element].cat.categories) - set(formulas.surfaces)
+            if unknown:
+                raise Exception(f"Unknown surfaces in rows {chunk.index[0]} -"
+                                f" {chunk.index[-1]}:"
+                                f" {', '.join(sorted(map(str, unknown)))}")
+            results = evaluate_chunk(study_area, chunk, element, area, location, keep,
+                                     cache)
+            file = f"part-{number:06d}.{format}"
+            _write(results, os.path.join(out, file))
+            chunk_totals = _totals(results)
+            running = pd.Series(manifest['totals']) if number else 0
+            parts.append({'file': file, 'rows': len(results),
+                          'totals': chunk_totals.to_dict()})
+            manifest['totals'] = (running + chunk_totals).to_dict()
+            if sketches is not None:
+                by = sketches.by
+                if by is not None and by not in results:
+                    results = results.assign(**{by: chunk[by]})
+                manifest['sketches'] = sketches.update(results).to_dict()
+            _write_manifest(manifest, out)
+        manifest['complete'] = True
+        _write_manifest(manifest, out)
+    if not parts:
+        raise Exception(f"The table {path} has no rows")
+    return pd.Series(manifest['totals'])
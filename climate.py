@@ -5,6 +5,11 @@ Created on Mon Feb 22 13:02:41 2021
 @author: Edwin Echeverri Salazar
 """
 
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
 #  Source: HAD, 2003
 climate_dict = {
     'Augsburg' : ['(800 - 900)', '(550 - 575)', 900, 575],
@@ -70,4 +75,38 @@ climate_dict = {
 def climate(place):
     p = climate_dict[place][2]
     etp = climate_dict[place][3]
-    return p, etp
\ No newline at end of file
+    return p, etp
+
+
+def climates(places):
+    '''
+    P and ETp of many locations at once, e.g. the column of the locations of
+    a table of parcels
+
+    Parameters
+    ----------
+    places : list, array or Series of strings
+           names of the locations (keys of climate_dict)
+
+    Notes
+    ------
+    Every distinct name is looked up once (pandas.factorize); unknown
+    names raise an Exception.
+
+    Returns
+    -------
+    p, etp : arrays
+           precipitation and potential evapotranspiration (mm/a), with the
+           shape of places
+    '''
+    places = np.asarray(places, dtype=object)
+    index, names = pd.factorize(places.ravel())
+    unknown = [str(name) for name in names if name not in climate_dict]
+    if (index < 0).any():
+        unknown.append('None')
+    if unknown:
+        raise Exception(f"Unknown locations: {', '.join(unknown[:10])}")
+    table = np.array([climate_dict[name][2:4] for name in names],
+                     dtype=float).reshape(len(names), 2)
+    index = index.reshape(places.shape)
+    return table[index, 0], table[index, 1]
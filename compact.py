@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Compact storage of results (the DataFrames of the methods of StudyArea,
+surface_table, watbal, ...) as a NumPy structured array, with lossless
+conversion back to the DataFrame.
+
+    stored = compact(study_area.surface_table(parcels))
+    stored.nbytes           # ~3-4 times less than the DataFrame
+    stored.to_frame()       # the same DataFrame (values, dtypes, index)
+    stored.save('balance.npz'); load('balance.npz')
+
+Columns are stored as follows, each one only if the DataFrame is rebuilt
+exactly:
+  - Element (and other columns of labels) as an int8 code of its label,
+    the labels are stored once,
+  - columns with the same value in every row (P and Etp of a study area, e
+    of surfaces) once, not per row,
+  - the columns computed from others (Au = Area*a, Vp = Area*P/1000,
+    Va = Vp*a, ...) not at all, they are recomputed,
+  - the other numeric columns as float32 if all their values are float32
+    numbers (e.g. rounded results of the methods), otherwise as float64.
+"""
+
+import json
+import numpy as np
+import pandas as pd
+
+# columns that are recomputed from others, in the order of recomputation
+derived = {'Au': lambda c: c['Area']*c['a'],
+           'Vp': lambda c: c['Area']*c['P']/1000,
+           'Va': lambda c: c['Vp']*c['a'],
+           'Vg': lambda c: c['Vp']*c['g'],
+           'Vv': lambda c: c['Vp']*c['v'],
+           'Ve': lambda c: c['Vp']*c['e']}
+
+
+def _same(x, y):
+    ''' True if two arrays are bitwise equal, NaN included'''
+    x, y = np.asarray(x), np.asarray(y)
+    return x.dtype == y.dtype and x.shape == y.shape and (
+        (x == y) | (pd.isna(x) & pd.isna(y))).all()
+
+
+def _narrow(values):
+    ''' values as float32 if they are float32 numbers, otherwise unchanged'''
+    if values.dtype.kind == 'f' and values.dtype.itemsize > 4:
+        narrow = values.astype(np.float32)
+        if _same(narrow.astype(values.dtype), values):
+            return narrow
+    if values.dtype.kind in 'iu':
+        for dtype in (np.int8, np.int16, np.int32):
+            if values.size == 0 or (np.iinfo(dtype).min <= values.min()
+                                    and values.max() <= np.iinfo(dtype).max):
+                return values.astype(dtype)
+    return values
+
+
+class Compact:
+    '''
+    Results stored compactly, see compact()
+
+    Attributes
+    ----------
+    data : structured array
+         one record per row with the stored columns
+
+    meta : dict
+         labels of the elements, constant and derived columns, dtypes,
+         order of the columns and index
+    '''
+    def __init__(self, data, meta):
+        self.data = data
+        self.meta = meta
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def nbytes(self):
+        ''' size of the stored records (the metadata is of constant size)'''
+        return self.data.nbytes
+
+    def to_frame(self):
+        ''' the DataFrame that was stored'''
+        meta = self.meta
+        n = len(self.data)
+        columns = {}
+        for name, (dtype, kind, value) in meta['columns'].items():
+            if kind == 'stored':
+                columns[name] = self.data[name].astype(dtype)
+            elif kind == 'constant':
+                columns[name] = np.full(n, value, dtype=dtype)
+            elif kind == 'labels':
+                labels = np.array(value, dtype=object)
+                columns[name] = labels[self.data[name]]
+        for name in derived:
+            if meta['columns'].get(name, (None, None))[1] == 'derived':
+                columns[name] = derived[name](columns).astype(meta['columns'][name][0])
+        index = meta['index']
+        if index[0] == 'range':
+            index = pd.RangeIndex(*index[1:])
+        else:
+            index = pd.Index(self.data['__index__'].astype(index[1]), name=index[2])
+        frame = pd.DataFrame({name: columns[name] for name in meta['order']}, index=index)
+        if meta['index'][0] == 'range':
+            frame.index.name = meta['index'][4]
+        return frame
+
+    def save(self, file):
+        ''' writes the results to file (path or open binary file, .npz)'''
+        np.savez_compressed(file, data=self.data, meta=np.array(json.dumps(self.meta)))
+
+
+def load(file):
+    ''' results written by Compact.save()'''
+    with np.load(file) as stored:
+        return Compact(stored['data'], json.loads(str(stored['meta'])))
+
+
+def compact(results):
+    '''
+    Stores results compactly
+
+    Parameters
+    ----------
+    results : DataFrame
+            results of the methods of StudyArea (or of surface_table,
+            watbal, ...): a column Element of labels and numeric columns
+
+    Notes
+    ------
+    Every choice (constant, derived, float32) is checked on the values, so
+    to_frame() returns the same DataFrame as results, bit for bit. Columns
+    of objects (Element, the columns of watbal) are stored as codes of
+    their values, which must be strings or numbers.
+
+    Returns
+    -------
+    compact : Compact
+    '''
+    n = len(results)
+    meta = {'order': list(results.columns), 'columns': {}}
+    arrays, rebuilt = {}, {}
+    for name in results.columns:
+        values = results[name].to_numpy()
+        if values.dtype == object:
+            codes, labels = pd.factorize(values)
+            if (codes < 0).any():
+                raise Exception(f"Column {name} has missing labels")
+            arrays[name] = _narrow(codes)
+            meta['columns'][name] = ('object', 'labels',
+                                     [label.item() if isinstance(label, np.generic)
+                                      else label for label in labels])
+            rebuilt[name] = values
+            continue
+        if values.dtype.kind not in 'fiub':
+            raise Exception(f"Column {name} of type {values.dtype} cannot be stored")
+        dtype = values.dtype.str
+        rebuilt[name] = values
+        if n and _same(np.full(n, values[0], dtype=values.dtype), values):
+            meta['columns'][name] = (dtype, 'constant', values[0].item())
+        else:
+            meta['columns'][name] = (dtype, 'stored', None)
+            arrays[name] = _narrow(values)
+
+    # columns that are recomputed exactly from the others
+    for name, formula in derived.items():
+        if meta['columns'].get(name, (None, None))[1] != 'stored':
+            continue
+        try:
+            value = formula(rebuilt).astype(rebuilt[name].dtype)
+        except KeyError:
+            continue
+        if _same(value, rebuilt[name]):
+            meta['columns'][name] = (meta['columns'][name][0], 'derived', None)
+            del arrays[name]
+
+    index = results.index
+    if isinstance(index, pd.RangeIndex):
+        meta['index'] = ('range', index.start, index.stop, index.step, index.name)
+    else:
+        if index.dtype.kind not in 'fiub':
+            raise Exception(f"Index of type {index.dtype} cannot be stored")
+        meta['index'] = ('stored', index.dtype.str, index.name)
+        arrays['__index__'] = _narrow(index.to_numpy())
+
+    fields = [(name, array.dtype) for name, array in arrays.items()]
+    data = np.empty(n, dtype=fields)
+    for name, array in arrays.items():
+        data[name] = array
+    return Compact(data, meta)
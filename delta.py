@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental recomputation of a table of surfaces (e.g. the parcels of a
+cadastral feed) between two versions of the table.
+
+Rows are matched by their index label and compared by a hash of their
+values: only added and changed rows are evaluated (surface_table), removed
+and changed rows are dropped from the previous results, and the totals of
+the water balance (watbal) are updated by subtracting the volumes of the
+old rows and adding those of the new ones.
+
+    results, totals, report = update(study_area, previous, results, current,
+                                     totals)
+    system(totals)      # row System of watbal
+"""
+
+import numpy as np
+import pandas as pd
+
+volumes = ['Area', 'Vp', 'Va', 'Vg', 'Vv', 'Ve']
+
+
+def hashes(table, columns=None):
+    ''' hash (uint64) of the values of every row of a table, by index label'''
+    columns = list(table.columns) if columns is None else columns
+    return pd.util.hash_pandas_object(table.reindex(columns=columns), index=False)
+
+
+def changes(previous, current):
+    '''
+    Rows that were added, removed or changed between two versions of a table
+
+    Returns
+    -------
+    added, removed, changed : Index
+                            index labels of the rows (in the order of
+                            current, removed in the order of previous)
+    '''
+    for table in (previous, current):
+        if not table.index.is_unique:
+            raise Exception("Index labels of the tables must be unique")
+    columns = sorted(set(previous.columns) | set(current.columns), key=str)
+    added = current.index.difference(previous.index, sort=False)
+    removed = previous.index.difference(current.index, sort=False)
+    common = current.index.intersection(previous.index, sort=False)
+    old = hashes(previous.loc[common], columns).to_numpy()
+    new = hashes(current.loc[common], columns).to_numpy()
+    changed = common[old != new]
+    return added, removed, changed
+
+
+def totals(*results):
+    ''' sums of the area and volumes of results (see watbal)'''
+    return pd.Series({column: float(sum(df[column].sum() for df in results))
+                      for column in volumes})
+
+
+def system(totals):
+    ''' row System of watbal for the given totals (not rounded)'''
+    return {'Element' : 'System', 'Area' : totals['Area'],
+            'a' : totals['Va']/totals['Vp'], 'g' : totals['Vg']/totals['Vp'],
+            'v' : totals['Vv']/totals['Vp'], 'e' : totals['Ve']/totals['Vp'],
+            **{column: totals[column] for column in volumes[1:]}}
+
+
+def update(study_area, previous, results, current, previous_totals=None,
+           element='element', area='area', cache=None):
+    '''
+    Updates the results of a table of surfaces for a new version of the
+    table
+
+    Parameters
+    ----------
+    study_area : StudyArea
+               climate of the surfaces, as used for the previous results
+
+    previous : DataFrame
+             previous version of the table (input of surface_table)
+
+    results : DataFrame
+            results of the previous version (output of surface_table or of
+            a previous update), with the index of previous
+
+    current : DataFrame
+            new version of the table
+
+    previous_totals : Series
+                    totals of the previous results (see totals()),
+                    computed from results if not given
+
+    element, area, cache :
+            as in surface_table()
+
+    Notes
+    ------
+    Only the added and changed rows are evaluated. The totals are updated
+    incrementally, in O(changed rows); rounding errors of the subtractions
+    stay at the order of 1e-12 of the totals, totals(results) recomputes
+    them exactly. Only surfaces are updated: measures that receive the
+    runoff of the surfaces must be re-evaluated by the caller, with
+    cascade() on the updated results (O(measures + edges)).
+
+    Returns
+    -------
+    results : DataFrame
+            results of current, in the order and with the index of current
+
+    totals : Series
+           updated totals of the area and volumes, see system() for the
+           corresponding row of watbal
+
+    report : dict
+           index labels of the added, removed and changed rows
+    '''
+    added, removed, changed = changes(previous, current)
+    if previous_totals is None:
+        previous_totals = totals(results)
+    stale = removed.append(changed)
+    recompute = current.index.isin(added.append(changed))
+
+    new = study_area.surface_table(current[recompute], element=element, area=area,
+                                   cache=cache)
+    updated_totals = previous_totals - totals(results.loc[stale]) + totals(new)
+
+    kept = results.drop(index=stale)
+    updated = pd.concat([kept, new]) if len(new) else kept
+    updated = updated.reindex(current.index)
+    report = {'added': added, 'removed': removed, 'changed': changed}
+    return updated, updated_totals, report
+
+
+def verify(results, updated_totals, rtol=1e-9):
+    ''' True if incrementally updated totals match those of the results'''
+    exact = totals(results)
+    return bool(np.allclose(updated_totals.to_numpy(), exact.to_numpy(), rtol=rtol,
+                            atol=0))
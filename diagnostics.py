@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Diagnostics of the partitioning factors of batch results: conservation of
+mass (a + g + v + e = 1), non-negativity, upper bound (<= 1) and inputs not
+covered by any regression equation (NaN).
+
+Several elements close the balance with max(1 - (a + v), 0) (e.g. porous
+surfaces, gravel covers, infiltration swales), so a + g + v can exceed 1 for
+some inputs. The checks run vectorized over whole batches; for the rows
+that fail a check, diagnose() reports the region of the inputs (bounding
+box and histograms of P, ETp and the parameters) per element.
+
+surface_table() and cascade() call record() after every evaluation: it
+costs one vectorized pass over the results and only builds a report when a
+check fails. Reports are kept in `reports`; set enabled = False to skip the
+checks.
+"""
+
+import collections
+import numpy as np
+import pandas as pd
+import formulas
+from check_ranges import param_rages
+
+enabled = True
+# last reports of record(): (source, report)
+reports = collections.deque(maxlen=100)
+
+checks = ('conservation', 'negative', 'range', 'undefined')
+
+
+def violations(a, g, v, e, atol=1e-9):
+    '''
+    Rows that fail each check
+
+    Returns
+    -------
+    masks : dict
+          check and boolean array
+    '''
+    a, g, v, e = (np.asarray(x, dtype=float) for x in (a, g, v, e))
+    total = a + g + v + e
+    factors = np.stack([a, g, v, e])
+    undefined = np.isnan(factors).any(axis=0)
+    with np.errstate(invalid='ignore'):
+        return {'conservation': ~undefined & (np.abs(total - 1) > atol),
+                'negative': ~undefined & (factors.min(axis=0) < -atol),
+                'range': ~undefined & (factors.max(axis=0) > 1 + atol),
+                'undefined': undefined}
+
+
+def _extent(name, element, values):
+    ''' range of the histograms of an input: its range of validity, if any'''
+    key = formulas.range_key(element, name)
+    if key is not None:
+        return tuple(param_rages[key][:2])
+    finite = values[np.isfinite(values)]
+    return (finite.min(), finite.max()) if finite.size else (0, 1)
+
+
+def diagnose(elements, p, etp, params, results=None, atol=1e-9, bins=10):
+    '''
+    Checks the results of a batch and reports the regions of the inputs in
+    which the checks fail
+
+    Parameters
+    ----------
+    elements, p, etp, params :
+                             inputs of the batch, as for
+                             formulas.evaluate_groups()
+
+    results : tuple of arrays
+            a, g, v and e of the batch (evaluated if not given)
+
+    atol : float
+         tolerance of the checks
+
+    bins : int
+         number of bins of the histograms
+
+    Returns
+    -------
+    report : DataFrame
+           one row per element and failed check: number and share of the
+           rows, worst violation, bounding box {input: (min, max)} of the
+           failing rows and histograms {input: (counts of the failing rows,
+           counts of all the rows of the element, bin edges)}
+    '''
+    elements = np.asarray(elements)
+    n = len(elements)
+    p = np.broadcast_to(np.asarray(p, dtype=float), (n,))
+    etp = np.broadcast_to(np.asarray(etp, dtype=float), (n,))
+    if results is None:
+        results = formulas.evaluate_groups(elements, p, etp, params)
+    a, g, v, e = (np.asarray(x, dtype=float) for x in results)
+    masks = violations(a, g, v, e, atol)
+    factors = np.stack([a, g, v, e])
+    with np.errstate(invalid='ignore'):
+        worst = {'conservation': np.abs(a + g + v + e - 1),
+                 'negative': -factors.min(axis=0),
+                 'range': factors.max(axis=0) - 1,
+                 'undefined': np.ones(n)}
+
+    rows = []
+    for element, group in formulas._groups(elements):
+        inputs = {'p': p[group], 'etp': etp[group],
+                  **formulas._group_params(element, params, group)}
+        for check in checks:
+            failing = masks[check][group]
+            if not failing.any():
+                continue
+            bounds, histograms = {}, {}
+            for name, values in inputs.items():
+                values = np.broadcast_to(values, group.shape)
+                bad = values[failing]
+                if np.isnan(bad).all():
+                    bounds[name] = (np.nan, np.nan)
+                    continue
+                bounds[name] = (np.nanmin(bad), np.nanmax(bad))
+                edges = np.histogram_bin_edges(values[np.isfinite(values)], bins,
+                                               _extent(name, element, values))
+                histograms[name] = (np.histogram(bad, edges)[0],
+                                    np.histogram(values, edges)[0], edges)
+            rows.append({'element': element, 'check': check,
+                         'count': int(failing.sum()), 'share': failing.mean(),
+                         'worst': float(np.nanmax(worst[check][group][failing])),
+                         'bounds': bounds, 'histograms': histograms})
+    return pd.DataFrame(rows, columns=['element', 'check', 'count', 'share', 'worst',
+                                       'bounds', 'histograms'])
+
+
+def record(elements, p, etp, params, results, source='', atol=1e-9):
+    '''
+    Checks the results of a batch (if enabled) and stores a report in
+    reports when a check fails
+
+    Returns
+    -------
+    report : DataFrame or None
+    '''
+    if not enabled:
+        return None
+    masks = violations(*results, atol=atol)
+    if not any(mask.any() for mask in masks.values()):
+        return None
+    report = diagnose(elements, p, etp, params, results, atol)
+    reports.append((source, report))
+    return report
+
+
+def summary():
+    ''' number of failing rows per source, element and check of the reports'''
+    if not reports:
+        return pd.DataFrame(columns=['source', 'element', 'check', 'count'])
+    frames = [report.assign(source=source)[['source', 'element', 'check', 'count']]
+              for source, report in reports]
+    return pd.concat(frames).groupby(['source', 'element', 'check'],
+                                     as_index=False)['count'].sum()
@@ -5,15 +5,49 @@ Created on Sun Feb 21 16:42:52 2021
 @author: Edwin Echeverri Salazar
 """
 
-import numpy as np
-import pandas as pd
+import collections
+import functools
+import math
+from lazy import lazy_import
 from check_ranges import validRange
-from climate import climate
+from climate import climate, climates
+import formulas
+
+# pandas and NumPy are only imported when a DataFrame (or an array) is used,
+# the scalar methods with records=True need neither of them
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+
+def _as_records(results):
+    ''' results of a method as a list of dicts (one per row)'''
+    if isinstance(results, list):
+        return results
+    return results.to_dict('records')
+
+
+def _as_frame(results):
+    ''' results of a method as a DataFrame'''
+    if isinstance(results, list):
+        return pd.DataFrame(results)
+    return results
+
+
+def _uncovered(kinds, index, a):
+    ''' Exception for the rows of a batch that no regression equation covers'''
+    missing = np.isnan(a)
+    if missing.any():
+        rows = ', '.join(f"{label} ({kind})" for label, kind in
+                         zip(index[missing][:10], kinds[missing][:10]))
+        more = f" and {missing.sum() - 10} more" if missing.sum() > 10 else ""
+        raise Exception(f"No regression equation covers the given parameters of"
+                        f" the rows {rows}{more}")
 
 #%% Starting class Surface
 
 class Surface(object):
-               
+    __slots__ = ()
+
     def __str__(self):
         return (
             "Class that contain the methods: garden(), roof(), flat_area(), "
@@ -21,6 +55,32 @@ class Surface(object):
             "paver_stonegrid(), and gravel_cover()"
             )
 
+    def _surface(self, element, area, **params):
+        '''
+        Checks the parameters of a surface, evaluates its regression
+        equations (see formulas.py) and builds the DataFrame of results (a
+        list with one dict if records=True)
+        '''
+        formulas.check(element, self.p, self.etp, **params)
+        a, g, v, e = formulas.evaluate_scalar(element, self.p, self.etp, **params)
+        if math.isnan(a):
+            raise Exception(f"No regression equation of {element} covers the"
+                            f" given parameters")
+        results = [{'Element' : formulas.registry[element]['label'],
+                    'Area' : round(area, 3),
+                    'Au' : round(area*a), 'P': self.p, 'Etp' : self.etp,
+                    'a' : round(a, 3), 'g' : round(g, 3), 'v' : round(v, 3),
+                    'e' : round(e, 3), 'Vp': round(area*self.p/1000),
+                    'Va' : round(area*self.p*a/1000),
+                    'Vg' : round(area*self.p*g/1000),
+                    'Vv' : round(area*self.p*v/1000),
+                    'Ve' : round(area*self.p*e/1000)}]
+
+        if self.records:
+            return(results)
+        results = pd.DataFrame(results)
+        return(results)
+
 #%% Berechnungsansatz: Grünflächen, Garten 
 #### unpaved or green areas or gardends
 
@@ -58,19 +118,7 @@ class Surface(object):
         -------
         results : DataFrame    
         '''    
-
-        e = 0
-        results = [{'Element' : 'Garden / green area', 'Area' : round(area, 3),
-                    'Au' : round(area*a), 'P': self.p, 'Etp' : self.etp,
-                    'a' : round(a, 3), 'g' : round(g, 3), 'v' : round(v, 3),
-                    'e' : round(e, 3), 'Vp': round(area*self.p/1000),
-                    'Va' : round(area*self.p*a/1000),
-                    'Vg' : round(area*self.p*g/1000),
-                    'Vv' : round(area*self.p*v/1000),
-                    'Ve' : round(area*self.p*e/1000)}]
-        
-        results = pd.DataFrame(results)
-        return(results)
+        return self._surface('garden', area, a=a, g=g, v=v)
 
 #%% Berechnungsansatz A.2: Steildach Steildächer (alle Materialien), 
 #### Flachdach (glatte Materialien) 
@@ -101,24 +149,7 @@ class Surface(object):
         -------
         results : DataFrame    
         '''    
-        validRange(sp, 'Sp_roof')
-        
-        a = (0.9115 + 0.00007063*self.p - 0.000007498*self.etp
-             - 0.2063*np.log(sp + 1))
-        g = 0
-        v = 1-a-g
-        e = 0
-        results = [{'Element' : 'Roof', 'Area' : round(area, 3),
-                    'Au' : round(area*a), 'P': self.p, 'Etp' : self.etp,
-                    'a' : round(a, 3), 'g' : round(g, 3), 'v' : round(v, 3),
-                    'e' : round(e, 3), 'Vp': round(area*self.p/1000),
-                    'Va' : round(area*self.p*a/1000),
-                    'Vg' : round(area*self.p*g/1000),
-                    'Vv' : round(area*self.p*v/1000),
-                    'Ve' : round(area*self.p*e/1000)}]
-        
-        results = pd.DataFrame(results)
-        return(results)
+        return self._surface('roof', area, sp=sp)
     
     #%% Berechnungsansatz A.3: Flachdächer (raue Materialien, Kies), Asphalt,
     #### fugenloser Beton,Pflaster mit dichten Fugen
@@ -153,26 +184,7 @@ class Surface(object):
         -------
         results : DataFrame   
         '''    
-        validRange(self.p, 'P')
-        validRange(self.etp, 'ETp')
-        validRange(sp, 'Sp_flat_area') 
-        
-        a = (0.8658 + 0.0001659*self.p - 0.00009945*self.etp
-             - 0.1542*np.log(sp + 1))
-        g = 0
-        v = 1-a-g
-        e = 0
-        results = [{'Element' : 'Flat area', 'Area' : round(area, 3),
-                    'Au' : round(area*a), 'P': self.p, 'Etp' : self.etp,
-                    'a' : round(a, 3), 'g' : round(g, 3), 'v' : round(v, 3),
-                    'e' : round(e, 3), 'Vp': round(area*self.p/1000),
-                    'Va' : round(area*self.p*a/1000),
-                    'Vg' : round(area*self.p*g/1000),
-                    'Vv' : round(area*self.p*v/1000),
-                    'Ve' : round(area*self.p*e/1000)}]
-        
-        results = pd.DataFrame(results)
-        return(results)
+        return self._surface('flat_area', area, sp=sp)
     
     #%% Berechnungsansatz A.4: Gründächer    
     def green_roof(self, area, h, kf=70, wkmax_wp=0.5):
@@ -208,26 +220,7 @@ class Surface(object):
         -------
         results : DataFrame 
         '''       
-        validRange(h, 'h_green_roof')
-        validRange(kf, 'kf_green_roof')
-        validRange(wkmax_wp, 'WKmax_WP_green_roof')
-        
-        a = (-2.182 + 0.4293*np.log(self.p) - 0.0001092*self.p
-             + (236.1/self.etp) + 0.0001142*h + 0.0002297*kf
-             + 0.01628*np.log(wkmax_wp) - 0.1214*np.log(wkmax_wp*h))
-        g = 0
-        v = 1-a-g
-        e = 0
-        results = [{'Element' : 'Green foof', 'Area' : round(area, 3),
-                    'Au' : round(area*a), 'P': self.p, 'Etp' : self.etp,
-                    'a' : round(a, 3), 'g' : round(g, 3), 'v' : round(v, 3),
-                    'e' : round(e, 3), 'Vp': round(area*self.p/1000),
-                    'Va' : round(area*self.p*a/1000),
-                    'Vg' : round(area*self.p*g/1000),
-                    'Vv' : round(area*self.p*v/1000),
-                    'Ve' : round(area*self.p*e/1000)}] 
-        results = pd.DataFrame(results)
-        return(results)
+        return self._surface('green_roof', area, h=h, kf=kf, wkmax_wp=wkmax_wp)
     
     #%% Berechnungsansatz A.5: Einstaudächer
     def storage_roof(self, area, sp=5):
@@ -254,22 +247,7 @@ class Surface(object):
         -------
         results : DataFrame 
         '''
-        validRange(sp, 'Sp_storage_roof') 
-        
-        a = 0.9231 + 0.000254*self.p - 0.0003226*self.etp - 0.1472*np.log(sp+1)
-        g = 0
-        v = 1-a-g 
-        e = 0
-        results = [{'Element' : 'Storage roof', 'Area' : round(area, 3),
-                    'Au' : round(area*a), 'P': self.p, 'Etp' : self.etp,
-                    'a' : round(a, 3), 'g' : round(g, 3), 'v' : round(v, 3),
-                    'e' : round(e, 3), 'Vp': round(area*self.p/1000),
-                    'Va' : round(area*self.p*a/1000),
-                    'Vg' : round(area*self.p*g/1000),
-                    'Vv' : round(area*self.p*v/1000),
-                    'Ve' : round(area*self.p*e/1000)}]    
-        results = pd.DataFrame(results)
-        return(results)
+        return self._surface('storage_roof', area, sp=sp)
         
     #%% Berechnungsansatz A.6 & A.7: Teildurchlässige Flächenbeläge
     ### (Fugenanteil 2 % bis 10 %)
@@ -313,47 +291,8 @@ class Surface(object):
         -------
         results : DataFrame 
         '''
-        
-    ### Berechnungsansatz A.6: Teildurchlässige Flächenbeläge
-    ### (Fugenanteil 2 % bis 5 %)
-    # Partially permeable surfaces (Joint ratio 2 % to 5 %)   
-        if (fa >= 2 and fa <= 5):
-            a = (0.0800734*np.log(self.p) - 0.0582828*fa - 0.0501693*sp
-                  - 0.385767*wkmax_wp + (8.7040284/(11.9086896 + kf)))
-            # DWA-a-102 2020 equation:
-            # g = (-0.2006 - 0.000253*self.etp + 0.05615*fa - 0.0636*np.log(1 + sp)
-            #      + 0.1596*np.log(1 + kf) + 0.2778*(wkmax_wp))
-            v = (0.8529 - 0.1248*np.log(self.p) + 0.00005057*self.etp + 0.002372*fa
-                  + 0.1583*np.log(1 + sp))
-            # To fullfill the conservation mass (a+g+v=1). My decision is to apply:
-            g = 1-a-v
-    
-    ### Berechnungsansatz A.7: Teildurchlässige Flächenbeläge
-    ### (Fugenanteil 6 % bis 10 %)
-    # Partially permeable surfaces (Joint ratio 6 % to 10 %)
-    # This funtion can be joint with the previous one and add the param "slope"     
-        if (fa >= 6 and fa <= 10):
-            a = (0.05912*np.log(self.p) - 0.02749*fa - 0.03671*sp
-                  - 0.30514*wkmax_wp + (4.97687/(4.7975 + kf)))
-            # DWA-a-102 2020 equation:
-            # g = (0.00004941*P - 0.0002817*self.etp + 0.02566*fa - 0.03823*sp
-            #      + 0.691*np.exp(-6.465/kf))
-            v = (0.9012 - 0.1325*np.log(self.p) + 0.00006661*self.etp + 0.002302*fa
-                  + 0.1489*np.log(1 + sp))
-            g = 1 - (a + v)
-     
-        e = 0
-
-        results = [{'Element' : 'Permeable surface', 'Area' : round(area, 3),
-                    'Au' : round(area*a), 'P': self.p, 'Etp' : self.etp,
-                    'a' : round(a, 3), 'g' : round(g, 3), 'v' : round(v, 3),
-                    'e' : round(e, 3), 'Vp': round(area*self.p/1000),
-                    'Va' : round(area*self.p*a/1000),
-                    'Vg' : round(area*self.p*g/1000),
-                    'Vv' : round(area*self.p*v/1000),
-                    'Ve' : round(area*self.p*e/1000)}]     
-        results = pd.DataFrame(results)
-        return(results)
+        return self._surface('permeable_surface', area, fa=fa, kf=kf, sp=sp,
+                             wkmax_wp=wkmax_wp)
         
     #%% Berechnungsansatz A.8: Teildurchlässige Flächenbeläge 
     #### (Poren- und Sickersteine, Schotterrasen, Kies)
@@ -395,29 +334,7 @@ class Surface(object):
         -------
         results : DataFrame 
         '''
-    
-        validRange(sp, 'Sp_porous_surface')
-        validRange(h, 'h_porous_surface')
-        validRange(kf, 'kf_porous_surface')
-    
-        a = (0.000001969*self.p - 0.005116*np.log(sp) - 0.0001051*h
-              + 0.01753*np.exp(4.576/kf))
-        # g = (0.2468883*np.log(self.p) - 0.0003938*self.etp + 0.0017083*sp
-        #      - 0.0015998*h - 0.6703502*np.exp(0.1122885/kf))
-        v = (0.2111 - 0.2544*np.log(self.p) + 0.2073*np.log(self.etp)
-              + 0.0006249*sp + 0.123*np.log(h) - 0.000002806*kf)
-        g = max((1 - (a + v)), 0.0) 
-        e = 0
-        results = [{'Element' : 'Porous surface', 'Area' : round(area, 3),
-                    'Au' : round(area*a), 'P': self.p, 'Etp' : self.etp,
-                    'a' : round(a, 3), 'g' : round(g, 3), 'v' : round(v, 3),
-                    'e' : round(e, 3), 'Vp': round(area*self.p/1000),
-                    'Va' : round(area*self.p*a/1000),
-                    'Vg' : round(area*self.p*g/1000),
-                    'Vv' : round(area*self.p*v/1000),
-                    'Ve' : round(area*self.p*e/1000)}]     
-        results = pd.DataFrame(results)
-        return(results)
+        return self._surface('porous_surface', area, sp=sp, h=h, kf=kf)
         
     #%% Berechnungsansatz A.9: Rasengittersteine
     # Paver stone grids / Grass pavers
@@ -456,30 +373,8 @@ class Surface(object):
         -------
         results : DataFrame 
         '''    
-     
-        validRange(fa, 'FA_paver_stonegrid')
-        validRange(sp, 'Sp_paver_stonegrid')
-        validRange(wkmax_wp, 'WKmax_WP_paver_stonegrid') 
-    
-        a = (0.145704 - 0.059177*np.log(fa) - 0.007354*sp
-              - 0.050531*np.log(wkmax_wp))
-        # g = (- 0.02927 + 0.1483*np.log(self.p) - 0.000269*self.etp
-        #      - 0.09913*np.log(1 + sp) + 0.05222*(wkmax_wp))
-        v = (1.106 - 0.1625*np.log(self.p) + 0.0001282*self.etp
-              + 0.1131*np.log(1 + sp) + 0.2848*wkmax_wp)
-        g = max((1 - (a + v)), 0.0)
-
-        e = 0
-        results = [{'Element' : 'Paver stone-grid', 'Area' : round(area, 3),
-                    'Au' : round(area*a), 'P': self.p, 'Etp' : self.etp,
-                    'a' : round(a, 3), 'g' : round(g, 3), 'v' : round(v, 3),
-                    'e' : round(e, 3), 'Vp': round(area*self.p/1000),
-                    'Va' : round(area*self.p*a/1000),
-                    'Vg' : round(area*self.p*g/1000),
-                    'Vv' : round(area*self.p*v/1000),
-                    'Ve' : round(area*self.p*e/1000)}]       
-        results = pd.DataFrame(results)
-        return(results)
+        return self._surface('paver_stonegrid', area, fa=fa, sp=sp,
+                             wkmax_wp=wkmax_wp)
         
     #%% Berechnungsansatz A.10: Deckschichten ohne Bindemittel (wassergebundene Decke) 
     # Wassergebundene Decke, offiziell Deckschicht ohne Bindemittel (Kürzel: DoB)
@@ -519,33 +414,77 @@ class Surface(object):
         -------
         results : DataFrame 
         '''      
-        validRange(self.p, 'P')
-        validRange(self.etp, 'ETp')
-        validRange(h, 'h_gravel_cover')
-        validRange(sp, 'Sp_gravel_cover')
-        validRange(kf, 'kf_gravel_cover')     
-        
-        a = 0.00004517*self.p - 0.03454*np.log(sp) + (0.1958/(0.2873 + kf))
-        # g = (0.19761*np.log(self.p) - 0.000506*self.etp + 0.016372*sp - 0.001618*h
-        #      - 0.327742*np.exp(0.346808/kf))
-        v = (0.2111 - 0.2544*np.log(self.p) + 0.2073*np.log(self.etp)
-              + 0.0006249*sp + 0.123*np.log(h) - 0.000002806*kf)
-        g = max((1 - (a + v)), 0.0)
-        e = 0
-        # pfractions = (a, g, v)
-        results = [{'Element' : 'Gravel cover', 'Area' : round(area, 3),
-                    'Au' : round(area*a), 'P': self.p, 'Etp' : self.etp,
-                    'a' : round(a, 3), 'g' : round(g, 3), 'v' : round(v, 3),
-                    'e' : round(e, 3), 'Vp': round(area*self.p/1000),
-                    'Va' : round(area*self.p*a/1000),
-                    'Vg' : round(area*self.p*g/1000),
-                    'Vv' : round(area*self.p*v/1000),
-                    'Ve' : round(area*self.p*e/1000)}]       
-        results = pd.DataFrame(results)
+        return self._surface('gravel_cover', area, h=h, sp=sp, kf=kf)
+
+    #%% Batch evaluation of a table of surfaces of different types
+
+    def surface_table(self, table, element='element', area='area', cache=None):
+        '''
+        Calculates water balance components for a table of surfaces of
+        different types, e.g. the parcels of a study area
+
+        Parameters
+        ----------
+        table : DataFrame
+              one row per surface, with the columns given by element (name
+              of the method, e.g. "roof", "green_roof", "gravel_cover") and
+              area (m2), and the parameters of the methods as columns
+              (e.g. "sp", "h", "kf")
+
+        cache : Cache
+              optional cache of results (cache.py), only the surfaces that
+              are not cached are evaluated
+
+        Notes
+        ------
+        The rows of each type of surface are checked and evaluated together
+        with the vectorized regression equations (formulas.py, or the fused
+        kernels of kernels.py if numba is installed). Missing parameters
+        (NaN) take the standard values of the method, parameters that a type
+        of surface does not use are ignored. Rows that no regression equation
+        covers (e.g. a joint ratio fa of 5.5 % for permeable_surface) raise
+        an Exception. Results are not rounded.
+
+        By default every call also checks the results for conservation of
+        mass and ranges of the factors (diagnostics.record(), one vectorized
+        pass) and keeps a report of the failing rows in diagnostics.reports;
+        set diagnostics.enabled = False to skip the checks.
+
+        Returns
+        -------
+        results : DataFrame
+                one row per surface, in the order and with the index of table
+        '''
+        import kernels
+        import diagnostics
+
+        kinds = table[element].to_numpy()
+        unknown = set(kinds) - set(formulas.surfaces)
+        if unknown:
+            raise Exception(f"Unknown surfaces: {', '.join(sorted(map(str, unknown)))}")
+        engine = kernels.evaluate
+        if cache is not None:
+            engine = cache.engine(engine)
+        a, g, v, e = formulas.evaluate_groups(kinds, self.p, self.etp, table,
+                                              checked=True, engine=engine)
+        _uncovered(kinds, table.index, a)
+        diagnostics.record(kinds, self.p, self.etp, table, (a, g, v, e),
+                           source='surface_table')
+        area = table[area].to_numpy(dtype=float)
+        vp = area*self.p/1000
+        labels = {name: formulas.registry[name]['label'] for name in formulas.surfaces}
+        results = pd.DataFrame({'Element' : [labels[kind] for kind in kinds],
+                                'Area' : area, 'Au' : area*a,
+                                'P' : self.p, 'Etp' : self.etp,
+                                'a' : a, 'g' : g, 'v' : v, 'e' : e, 'Vp' : vp,
+                                'Va' : vp*a, 'Vg' : vp*g, 'Vv' : vp*v, 'Ve' : vp*e},
+                               index=table.index)
         return(results)
         
     #%% New class Measure
 class Measure(object):      
+    __slots__ = ()
+
     def __str__(self):
         return (
             "Measure to reduce runoff from the given surfaces."
@@ -553,6 +492,65 @@ class Measure(object):
             "surf_infiltration(), infilt_swale(), swale_trench(), "
             "swale_trench_system(), rainwater_usage(), and pod_system()"
     )
+
+    def _measure(self, element, surfaces, rounded=True, **params):
+        '''
+        Checks the parameters of a measure, evaluates its regression
+        equations (see formulas.py) and joins its results to the results of
+        the surfaces that drain into it. With rounded=False the volumes are
+        not rounded (drainage). With records=True the results are a list of
+        dicts and pandas is not used.
+        '''
+        formulas.check(element, self.p, self.etp, **params)
+        a, g, v, e = formulas.evaluate_scalar(element, self.p, self.etp, **params)
+        if self.records:
+            surfaces = [_as_records(df) for df in surfaces]
+        else:
+            surfaces = [_as_frame(df) for df in surfaces]
+
+        # calculating the area that produces runoff and volume of runoff
+        au = 0
+        va = 0
+        for df in surfaces:
+            if self.records:
+                au += float(df[-1]['Au'])
+                va += float(df[-1]['Va'])
+            else:
+                au += float(df['Au'].iloc[-1])
+                va += float(df['Va'].iloc[-1])
+
+        area = au*float(formulas.area_share(element, self.p, self.etp, **params))
+
+        volume = round if rounded else float
+        results = [{'Element' : formulas.registry[element]['label'],
+                    'Area' : round(area),
+                    'Au' : volume(au), 'P': self.p, 'Etp' : self.etp,
+                    'a' : round(a, 3), 'g' : round(g, 3), 'v' : round(v, 3),
+                    'e' : round(e, 3), 'Vp': volume(area*self.p/1000),
+                    'Va' : volume((area*self.p/1000 + va)*a),
+                    'Vg' : volume((area*self.p/1000 + va)*g),
+                    'Vv' : volume((area*self.p/1000 + va)*v),
+                    'Ve' : volume((area*self.p/1000 + va)*e)}]
+
+        if self.records:
+            # Runoff volume are passed to measure, Va = 0
+            return [dict(row, Va=0) for df in surfaces for row in df] + results
+
+        # A df with the previous results is required
+        previous_results = pd.DataFrame(columns = ['Element', 'Area', 'Au',
+                                                   'P', 'Etp','a', 'g', 'v',
+                                                   'e', 'Vp', 'Va', 'Vg',
+                                                   'Vv', 'Ve'])
+
+        # Joinning previous dfs of results
+        for df in surfaces:
+            previous_results = pd.concat([previous_results, df])
+
+        # Runoff volume are passed to measure, Va = 0
+        previous_results.Va = 0
+
+        results = pd.DataFrame(results)
+        return(pd.concat([previous_results, results], ignore_index=True))
     #%% Aufteilungswerte und Berechnungsansätze für Anlagen
     # Ableitung: Rohr, Rinne, steiler Graben
     # Drainage: pipe, channel, steep ditch
@@ -563,68 +561,23 @@ class Measure(object):
         
         Parameters
         ----------
-        drainage_type : string
+        drainage_type : string or DrainageType
                        "pipe", "rohr", "channel", "rinne", "steep ditch",
                        "steiler graben", "ditch with vegetation",
-                       "gräben mit bewuchs"
+                       "gräben mit bewuchs" (any capitalization)
+
+        Notes
+        ------
+        An Exception is raised for unknown types of drainage.
                                       
         Returns
         -------
         results : DataFrame 
         '''    
      
-        drainages = ("pipe", "Pipe", "PIPE", "Rohr", "rohr", "ROHR",
-                     "channel", "Channel", "CHANNEL", "Rinne", "rinne",
-                     "RINNE", "steep ditch", "Steep Ditch", "STEEP DITCH",
-                     "steiler graben", "steiler Graben", "STEILER GRABEN")
-        veg_drainage = ("Shallow ditches with vegetation",
-                        "Ditch with vegetation", "ditch with vegetation",
-                        "Flache Gräben mit Bewuchs", "Gräben mit Bewuchs")
-       
-        if ((drainage_type in drainages) or
-            (drainage_type in veg_drainage))  == False:
-            return ("Wrong input as drinage-type")
-        if (drainage_type in drainages) == True:   
-            a = 1
-            g = 0
-            v = 0
-        if (drainage_type in veg_drainage) == True:
-            a = 0.7
-            g = 0.1
-            v = 0.2
-
-        area = 0
-        e = 0
-        # calculating the area that produces runoff and volume of runoff
-        au = 0
-        va = 0
-        for df in surfaces:
-            au += float(df[-1:]['Au'])
-            va += float(df[-1:]['Va'])
-            
-        # A df with the previous results is required
-        previous_results = pd.DataFrame(columns = ['Element', 'Area', 'Au',
-                                                   'P', 'Etp','a', 'g', 'v', 
-                                                   'e', 'Vp', 'Va', 'Vg',
-                                                   'Vv', 'Ve'])
-                
-        # Joinning previous dfs of results
-        for df in surfaces:
-            previous_results = pd.concat([previous_results, df])
-            
-        # Runoff volume are passed to measure so, Va = 0
-        previous_results.Va = 0                      
-
-        results = [{'Element' : 'Drainage', 'Area' : round(area),
-                    'Au' : au, 'P': self.p, 'Etp' : self.etp,
-                    'a' : round(a, 3), 'g' : round(g, 3), 'v' : round(v, 3),
-                    'e' : round(e, 3), 'Vp': area*self.p/1000,
-                    'Va' : (area*self.p/1000 + va)*a,
-                    'Vg' : (area*self.p/1000 + va)*g,
-                    'Vv' : (area*self.p/1000 + va)*v,
-                    'Ve' : (area*self.p/1000 + va)*e}]      
-        results = pd.DataFrame(results)
-        return(pd.concat([previous_results, results], ignore_index=True))
+        kind = formulas.drainage_type(drainage_type)
+        return self._measure('drainage', surfaces, rounded=False,
+                             vegetated=int(kind))
     
     #%% Berechnungsansatz B.2: Flächenversickerung
     # Surface infiltration
@@ -653,52 +606,9 @@ class Measure(object):
         -------
         results : DataFrame 
         '''
-        
-        validRange(kf, 'kf_surf_infiltration') 
-        
         if (fasf == "fasf_standard"):
-            fasf = 94741*kf**(-1.195)
-            fasf = 94741*kf**(-1.195)
-            
-        a = 0.004264 + 0.001121*np.log(self.p) - 0.002757*np.log(fasf)
-        # g = (0.6207904 + 0.0899322*np.log(self.p) - 0.0001152*self.etp
-        #      - 0.0719723*np.log(self.fasf))
-        v = 0.3999 - 0.09317*np.log(self.p) + 0.00009746*self.etp + 0.07474*np.log(fasf)
-        g = max((1 - (a + v)), 0.0)              
-        e = 0
-        
-        # calculating the area that produces runoff and volume of runoff
-        au = 0
-        va = 0
-        for df in surfaces:
-            au += float(df[-1:]['Au'])
-            va += float(df[-1:]['Va'])
-            
-        # A df with the previous results is required
-        previous_results = pd.DataFrame(columns = ['Element', 'Area', 'Au',
-                                                   'P', 'Etp','a', 'g', 'v', 
-                                                   'e', 'Vp', 'Va', 'Vg',
-                                                   'Vv', 'Ve'])
-                
-        # Joinning previous dfs of results
-        for df in surfaces:
-            previous_results = pd.concat([previous_results, df])
-            
-        # Runoff volume are passed to measure, Va = 0
-        previous_results.Va = 0                      
-
-        area = au*(fasf/100)
-
-        results = [{'Element' : 'Surface infilt.', 'Area' : round(area),
-                    'Au' : round(au), 'P': self.p, 'Etp' : self.etp,
-                    'a' : round(a, 3), 'g' : round(g, 3), 'v' : round(v, 3),
-                    'e' : round(e, 3), 'Vp': round(area*self.p/1000),
-                    'Va' : round((area*self.p/1000 + va)*a),
-                    'Vg' : round((area*self.p/1000 + va)*g),
-                    'Vv' : round((area*self.p/1000 + va)*v),
-                    'Ve' : round((area*self.p/1000 + va)*e)}]        
-        results = pd.DataFrame(results)
-        return(pd.concat([previous_results, results], ignore_index=True))
+            fasf = None
+        return self._measure('surf_infiltration', surfaces, kf=kf, fasf=fasf)
        
     #%% Berechnungsansatz B.3: Versickerungsmulden
     # Infiltration swale
@@ -727,51 +637,9 @@ class Measure(object):
         -------
         results : DataFrame 
         '''  
-    
-        validRange(kf, 'kf_infilt_swale') 
-        
         if (fasm == "fasm_standard"):
-            fasm = 42.323*kf**(-0.314)       
-        
-        g = (0.8608 + 0.02385*np.log(self.p) - 0.00005331*self.etp - 0.002827*fasm
-              - 0.000002493*kf + 0.0009514*np.log(kf/fasm))
-        v = 0.000008562*self.etp + (2.611/(self.p-64.35))*fasm**0.9425 - 0.000001211*kf
-        # To force positive values or zero
-        a = max((1 - (g + v)), 0.0)
-        e = 0
-        
-        # calculating the area that produces runoff and volume of runoff
-        au = 0
-        va = 0
-        for df in surfaces:
-            au += float(df[-1:]['Au'])
-            va += float(df[-1:]['Va'])
-            
-        # A df with the previous results is required
-        previous_results = pd.DataFrame(columns = ['Element', 'Area', 'Au',
-                                                   'P', 'Etp','a', 'g', 'v', 
-                                                   'e', 'Vp', 'Va', 'Vg',
-                                                   'Vv', 'Ve'])
-                
-        # Joinning previous dfs of results
-        for df in surfaces:
-            previous_results = pd.concat([previous_results, df])
-            
-        # Runoff volume are passed to measure, Va = 0
-        previous_results.Va = 0                      
-
-        area = au*(fasm/100)
-
-        results = [{'Element' : 'Infilt. swale', 'Area' : round(area),
-                    'Au' : round(au), 'P': self.p, 'Etp' : self.etp,
-                    'a' : round(a, 3), 'g' : round(g, 3), 'v' : round(v, 3),
-                    'e' : round(e, 3), 'Vp': round(area*self.p/1000),
-                    'Va' : round((area*self.p/1000 + va)*a),
-                    'Vg' : round((area*self.p/1000 + va)*g),
-                    'Vv' : round((area*self.p/1000 + va)*v),
-                    'Ve' : round((area*self.p/1000 + va)*e)}]        
-        results = pd.DataFrame(results)
-        return(pd.concat([previous_results, results], ignore_index=True))
+            fasm = None
+        return self._measure('infilt_swale', surfaces, kf=kf, fasm=fasm)
     #%% Berechnungsansatz B.4: Mulden-Rigolen-Elemente
     # Swale-trench element
     def swale_trench(self, kf, *surfaces, fasm="fasm_standard"):
@@ -799,52 +667,9 @@ class Measure(object):
         -------
         results : DataFrame 
         ''' 
-    
-        validRange(kf, 'kf_swale_trench')
-        
         if (fasm == "fasm_standard"):
-            fasm = 21.86*kf**(-0.348)
-            
-        a = (-0.03867 + 0.007684*np.log(self.p) + 0.000003201*fasm + 0.0002564*kf
-             - 0.0001187*fasm*kf + 0.004161*np.log(kf/fasm))
-        # g = (0.8803 + 0.01866*np.log(self.p) - 0.00004867*self.etp
-        #      - 0.001997*fasm + 0.0002365*kf)
-        v = 0.000008879*self.etp + (2.528/(self.p-81.65))*fasm**0.9496 - 0.00007768*kf
-        g = max((1 - (a + v)), 0.0)
-        e = 0
-        
-        # calculating the area that produces runoff and volume of runoff
-        au = 0
-        va = 0
-        for df in surfaces:
-            au += float(df[-1:]['Au'])
-            va += float(df[-1:]['Va'])
-            
-        # A df with the previous results is required
-        previous_results = pd.DataFrame(columns = ['Element', 'Area', 'Au',
-                                                   'P', 'Etp','a', 'g', 'v', 
-                                                   'e', 'Vp', 'Va', 'Vg',
-                                                   'Vv', 'Ve'])
-                
-        # Joinning previous dfs of results
-        for df in surfaces:
-            previous_results = pd.concat([previous_results, df])
-            
-        # Runoff volume are passed to measure, Va = 0
-        previous_results.Va = 0                      
-
-        area = au*(fasm/100)
-
-        results = [{'Element' : 'Swale trench', 'Area' : round(area),
-                    'Au' : round(au), 'P': self.p, 'Etp' : self.etp,
-                    'a' : round(a, 3), 'g' : round(g, 3), 'v' : round(v, 3),
-                    'e' : round(e, 3), 'Vp': round(area*self.p/1000),
-                    'Va' : round((area*self.p/1000 + va)*a),
-                    'Vg' : round((area*self.p/1000 + va)*g),
-                    'Vv' : round((area*self.p/1000 + va)*v),
-                    'Ve' : round((area*self.p/1000 + va)*e)}]   
-        results = pd.DataFrame(results)
-        return(pd.concat([previous_results, results], ignore_index=True))
+            fasm = None
+        return self._measure('swale_trench', surfaces, kf=kf, fasm=fasm)
     
     #%% Berechnungsansatz B.5: Mulden-Rigolen-Systeme
     # Swale-trench system
@@ -877,55 +702,10 @@ class Measure(object):
         -------
         results : DataFrame 
         ''' 
-
-        validRange(qdr, 'qDr_swale_trench_system')
-        validRange(kf, 'kf_swale_trench_system')
-        
-        
         if (fasm == "fasm_standard"):
-            fasm = 11.79 - 3.14*np.log(qdr) - 0.18594*kf
-            
-        a = (0.8112 + 0.0003473*self.p - 0.00001845*self.etp - 0.04793*fasm
-              + 0.0007481*qdr - 0.4389*np.log(kf + 1))
-        # g = (1.669 - 0.3005*np.log(self.p) - 0.00006933*self.etp
-        #       + 0.3044*np.log(fasm) + 0.4581*np.log(kf + 1))
-        v = (0.1428 - 0.02661*np.log(self.p) + 0.00005668*self.etp + 0.0288*np.log(fasm)
-              - 0.0001825*qdr - 0.01823*np.log(kf + 1))
-        g = max((1 - (a + v)), 0.0)
-        e = 0
-        
-        # calculating the area that produces runoff and volume of runoff
-        au = 0
-        va = 0
-        for df in surfaces:
-            au += float(df[-1:]['Au'])
-            va += float(df[-1:]['Va'])
-            
-        # A df with the previous results is required
-        previous_results = pd.DataFrame(columns = ['Element', 'Area', 'Au',
-                                                   'P', 'Etp','a', 'g', 'v', 
-                                                   'e', 'Vp', 'Va', 'Vg',
-                                                   'Vv', 'Ve'])
-                
-        # Joinning previous dfs of results
-        for df in surfaces:
-            previous_results = pd.concat([previous_results, df])
-            
-        # Runoff volume are passed to measure, Va = 0
-        previous_results.Va = 0                      
-
-        area = au*(fasm/100)
-
-        results = [{'Element' : 'Swale trench system', 'Area' : round(area),
-                    'Au' : round(au), 'P': self.p, 'Etp' : self.etp,
-                    'a' : round(a, 3), 'g' : round(g, 3), 'v' : round(v, 3),
-                    'e' : round(e, 3), 'Vp': round(area*self.p/1000),
-                    'Va' : round((area*self.p/1000 + va)*a),
-                    'Vg' : round((area*self.p/1000 + va)*g),
-                    'Vv' : round((area*self.p/1000 + va)*v),
-                    'Ve' : round((area*self.p/1000 + va)*e)}]
-        results = pd.DataFrame(results)
-        return(pd.concat([previous_results, results], ignore_index=True))
+            fasm = None
+        return self._measure('swale_trench_system', surfaces, qdr=qdr, kf=kf,
+                             fasm=fasm)
     
     #%% Berechnungsansatz B.6: Anlagen zur Niederschlagswassernutzung
     # Rainwater usage
@@ -965,61 +745,8 @@ class Measure(object):
         -------
         results : DataFrame 
         '''     
-        
-        validRange(vsp, 'VSp_rainwater_usage')
-        validRange(vbr, 'VBr_rainwater_usage')
-        validRange(fabw, 'FAbw_rainwater_usage')
-        validRange(qbw, 'qBw_rainwater_usage')
-        
-        
-        VBw = fabw*qbw
-        Vnmin = min(self.p, 365*vbr + VBw)
-        if VBw == 0:
-            v = 0
-        else:
-            v = (- 0.0001927*self.p + 0.0001831*self.etp + 0.0006083*VBw
-                 - 0.0000003127*VBw**2 - 0.3092*np.exp(3.269/vsp)
-                 + (1.424/(2.782 + vbr)) + 0.0001885*Vnmin)
-        if vbr == 0:
-            e = 0
-        else:
-            e = (0.4451 - 0.0003529*self.p - 0.00007728*self.etp + 0.06821*np.log10(vsp)
-                 - 0.0002507*VBw + 0.2349*np.log10(vbr) + 0.0001738*Vnmin)
-        a = max((1 - (v + e)), 0.0)
-        g = 0.0
-        
-        # calculating the area that produces runoff and volume of runoff
-        au = 0
-        va = 0
-        for df in surfaces:
-            au += float(df[-1:]['Au'])
-            va += float(df[-1:]['Va'])
-            
-        # A df with the previous results is required
-        previous_results = pd.DataFrame(columns = ['Element', 'Area', 'Au',
-                                                   'P', 'Etp','a', 'g', 'v', 
-                                                   'e', 'Vp', 'Va', 'Vg',
-                                                   'Vv', 'Ve'])
-                
-        # Joinning previous dfs of results
-        for df in surfaces:
-            previous_results = pd.concat([previous_results, df])
-            
-        # Runoff volume are passed to measure, Va = 0
-        previous_results.Va = 0                      
-
-        area = 0
-
-        results = [{'Element' : 'Rainwater usage', 'Area' : round(area),
-                    'Au' : round(au), 'P': self.p, 'Etp' : self.etp,
-                    'a' : round(a, 3), 'g' : round(g, 3), 'v' : round(v, 3),
-                    'e' : round(e, 3), 'Vp': round(area*self.p/1000),
-                    'Va' : round((area*self.p/1000 + va)*a),
-                    'Vg' : round((area*self.p/1000 + va)*g),
-                    'Vv' : round((area*self.p/1000 + va)*v),
-                    'Ve' : round((area*self.p/1000 + va)*e)}]
-        results = pd.DataFrame(results)
-        return(pd.concat([previous_results, results], ignore_index=True))
+        return self._measure('rainwater_usage', surfaces, vsp=vsp, vbr=vbr,
+                             fabw=fabw, qbw=qbw)
     
     #%% Berechnungsansatz B.7: Wasserfläche mit Dauerstau
     #### Water surface with permanent storage  
@@ -1041,6 +768,9 @@ class Measure(object):
         a_i, ... , a_n : float
                        proportion of area i (0.0-1.0), which directs its
                        runoff to the pond (-) 
+
+        A_1 and a_1 can also be lists or arrays with any number of
+        contributing areas and their proportions.
                             
         Notes    
         ------
@@ -1048,60 +778,285 @@ class Measure(object):
           P : 500 - 1700 mm/a
           ETp : 450 - 700 mm/a
           a_i : 0 - 1
+
+        v = ETp*Aw / (P*(Aw + sum(A_i*a_i)))
                    
         Returns
         -------
         results : DataFrame 
         '''
-        
-        validRange(a_1, 'a_1_pod_system')
-        validRange(a_2, 'a_2_pod_system')
-        validRange(a_3, 'a_1_pod_system')
-        validRange(a_4, 'a_1_pod_system')
-        
-        v = ((self.etp*aw)/(self.p*(aw + A_1*a_1 + A_2*a_2
-                                    + A_3*a_3 + A_4*a_4)))
-        a = 1 - v
-        g = 0
-        e = 0
+        # Python numbers do not need NumPy; NumPy scalars (e.g. the values of
+        # a row of a DataFrame) are scalars too
+        if all(isinstance(x, (int, float)) or np.ndim(x) == 0 for x in (A_1, a_1)):
+            return self._measure('pod_system', surfaces, aw=aw, A_1=float(A_1),
+                                 a_1=float(a_1), A_2=A_2, a_2=a_2, A_3=A_3, a_3=a_3,
+                                 A_4=A_4, a_4=a_4)
+
+        # any number of contributing areas: their weighted sum is passed as
+        # a single area with proportion 1
+        if np.ndim(A_1) == 0 or np.ndim(a_1) == 0:
+            raise Exception("A_1 and a_1 must both be numbers or both be lists")
+        if len(A_1) != len(a_1):
+            raise Exception(f"{len(A_1)} contributing areas (A_1) but"
+                            f" {len(a_1)} proportions (a_1)")
+        areas = [*A_1, A_2, A_3, A_4]
+        proportions = [*a_1, a_2, a_3, a_4]
+        for proportion in proportions:
+            validRange(proportion, 'a_i_pod_system')
+        weighted = float(sum(area*proportion
+                             for area, proportion in zip(areas, proportions)))
+        return self._measure('pod_system', surfaces, aw=aw, A_1=weighted, a_1=1.0)
+
+    def pod_systems(self, ponds, areas, pond='pond', area='A', proportion='a'):
+        '''
+        Calculates the partitioning factors of many pod systems at once, each
+        with any number of contributing areas
+
+        Parameters
+        ----------
+        ponds : DataFrame
+              one row per pond, with the column aw (pod surface, m2)
+
+        areas : DataFrame
+              one row per contributing area, with the index label of its
+              pond (column pond), the area (m2, column area) and the
+              proportion of the area that drains into the pond (0.0-1.0,
+              column proportion)
+
+        Notes
+        ------
+        The weighted sums of the contributing areas of all the ponds are
+        computed in one pass (np.bincount) and v = ETp*Aw/(P*(Aw + sum(A_i*a_i)))
+        is evaluated vectorized. The results can be used as table of measures
+        of cascade() (columns element, aw, A_1 and a_1).
+
+        Returns
+        -------
+        results : DataFrame
+                element, aw, A_1 (weighted sum of the contributing areas),
+                a_1 (= 1), a, g, v and e, in the order and with the index of
+                ponds
+        '''
+        from check_ranges import validRanges
+
+        index = ponds.index.get_indexer(areas[pond])
+        if (index < 0).any():
+            raise Exception(f"{(index < 0).sum()} contributing areas of unknown ponds")
+        validRanges(areas[proportion].to_numpy(dtype=float), 'a_i_pod_system')
+        weighted = np.bincount(index, minlength=len(ponds),
+                               weights=areas[area].to_numpy(dtype=float)
+                               *areas[proportion].to_numpy(dtype=float))
+        aw = ponds['aw'].to_numpy(dtype=float)
+        formulas.check('pod_system', self.p, self.etp)
+        a, g, v, e = formulas.evaluate('pod_system', self.p, self.etp, aw=aw,
+                                       A_1=weighted, a_1=1.0)
+        return pd.DataFrame({'element' : 'pod_system', 'aw' : aw, 'A_1' : weighted,
+                             'a_1' : 1.0, 'a' : a, 'g' : g, 'v' : v, 'e' : e},
+                            index=ponds.index)
+
+    #%% Batch routing of surfaces into measures
+
+    def _measure_params(self, measures, element='element'):
+        '''
+        Parameters of a table of measures as used by the registry, with the
+        column drainage_type translated into the parameter vegetated
+        '''
+        params = dict(measures.items())
+        if 'drainage_type' in measures:
+            drainages = ((measures[element] == 'drainage')
+                         & measures['drainage_type'].notna()).to_numpy()
+            vegetated = np.full(len(measures), np.nan)
+            vegetated[drainages] = formulas.drainage_types(
+                measures['drainage_type'].to_numpy()[drainages])
+            if 'vegetated' in measures:
+                vegetated = np.where(np.isnan(vegetated), measures['vegetated'],
+                                     vegetated)
+            params['vegetated'] = vegetated
+        return params
+
+    def route(self, surfaces, measures, edges, element='element',
+              source='surface', target='measure', cache=None):
+        '''
+        Calculates water balance components for a table of measures that
+        receive the runoff of a table of surfaces
+
+        Parameters
+        ----------
+        surfaces : DataFrame
+                 results of surfaces (e.g. of surface_table()), with the
+                 columns Au and Va
+
+        measures : DataFrame
+                 one row per measure, with the column given by element (name
+                 of the method, e.g. "infilt_swale") and the parameters of the
+                 methods as columns (e.g. "kf", "fasm", "drainage_type")
+
+        edges : DataFrame
+              connectivity table, one row per surface that drains into a
+              measure, with the index labels of the surface (column source)
+              and of the measure (column target)
+
+        cache : Cache
+              optional cache of results of the measures (cache.py)
+
+        Notes
+        ------
+        Au and Va of the surfaces are summed per measure in a single pass
+        (np.bincount) and the measures of each type are evaluated together
+        with the vectorized regression equations. As in the methods of
+        Measure, the runoff volume Va of the routed surfaces is passed to
+        the measures and set to 0. Results are not rounded.
+
+        Returns
+        -------
+        surfaces : DataFrame
+                 surfaces with Va = 0 for the routed surfaces
+
+        results : DataFrame
+                results of the measures, in the order and with the index of
+                measures
+        '''
+        if not edges[source].isin(surfaces.index).all():
+            raise Exception("Edges of route() must start at surfaces,"
+                            " use cascade() for chains of measures")
+        return self.cascade(surfaces, measures, edges, element=element,
+                            source=source, target=target, cache=cache)
+
+    def cascade(self, surfaces, measures, edges, element='element',
+                source='surface', target='measure', cache=None):
+        '''
+        Calculates water balance components for a network of measures in
+        which surfaces and measures drain into measures, e.g. roof ->
+        rainwater usage (overflow) -> infiltration swale -> drainage
+
+        Parameters
+        ----------
+        surfaces : DataFrame
+                 results of surfaces (e.g. of surface_table()), with the
+                 columns Au and Va
+
+        measures : DataFrame
+                 one row per measure, with the column given by element (name
+                 of the method, e.g. "infilt_swale") and the parameters of the
+                 methods as columns (e.g. "kf", "fasm", "drainage_type")
+
+        edges : DataFrame
+              connectivity table, one row per surface or measure that drains
+              into a measure, with the index label of the surface or measure
+              (column source) and of the receiving measure (column target).
+              Index labels of surfaces and measures must be unique.
+
+        cache : Cache
+              optional cache of results of the measures (cache.py)
+
+        Notes
+        ------
+        The measures of each type are evaluated together, then the runoff
+        is passed downstream level by level in topological order: every
+        measure receives Au and the overflow volume Va of its upstream
+        surfaces and measures (np.bincount over the edges), so the whole
+        network is evaluated in O(elements + edges). As in the methods of
+        Measure, Va of every element that drains into a measure is set to 0.
+        Results are not rounded. As in surface_table(), the results are
+        checked by diagnostics.record() unless diagnostics.enabled = False.
+
+        Returns
+        -------
+        surfaces : DataFrame
+                 surfaces with Va = 0 for the routed surfaces
+
+        results : DataFrame
+                results of the measures, in the order and with the index of
+                measures
+        '''
+        import kernels
+        import diagnostics
+
+        kinds = measures[element].to_numpy()
+        unknown = set(kinds) - set(formulas.measures)
+        if unknown:
+            raise Exception(f"Unknown measures: {', '.join(sorted(map(str, unknown)))}")
+        if surfaces.index.isin(measures.index).any():
+            raise Exception("Index labels of surfaces and measures must be unique")
+        n = len(measures)
+        from_surface = surfaces.index.get_indexer(edges[source])
+        from_measure = measures.index.get_indexer(edges[source])
+        to_measure = measures.index.get_indexer(edges[target])
+        if ((from_surface < 0) & (from_measure < 0)).any() or (to_measure < 0).any():
+            raise Exception(f"{((from_surface < 0) & (from_measure < 0)).sum()} edges"
+                            f" with unknown sources and {(to_measure < 0).sum()}"
+                            f" edges with unknown measures")
+        sources = edges[source].to_numpy()
+        if len(pd.unique(sources)) < len(sources):
+            raise Exception("Every surface or measure can only drain into one measure")
+
         # calculating the area that produces runoff and volume of runoff
-        au = 0
-        va = 0
-        for df in surfaces:
-            au += float(df[-1:]['Au'])
-            va += float(df[-1:]['Va'])
-            
-        # A df with the previous results is required
-        previous_results = pd.DataFrame(columns = ['Element', 'Area', 'Au',
-                                                   'P', 'Etp','a', 'g', 'v', 
-                                                   'e', 'Vp', 'Va', 'Vg',
-                                                   'Vv', 'Ve'])
-                
-        # Joinning previous dfs of results
-        for df in surfaces:
-            previous_results = pd.concat([previous_results, df])
-            
-        # Runoff volume are passed to measure, Va = 0
-        previous_results.Va = 0                      
+        # of the surfaces
+        surface_edges = from_surface >= 0
+        au = np.bincount(to_measure[surface_edges], minlength=n,
+                         weights=surfaces['Au'].to_numpy(dtype=float)[
+                             from_surface[surface_edges]])
+        va = np.bincount(to_measure[surface_edges], minlength=n,
+                         weights=surfaces['Va'].to_numpy(dtype=float)[
+                             from_surface[surface_edges]])
 
-        area = 0
+        params = self._measure_params(measures, element)
+        engine = kernels.evaluate
+        if cache is not None:
+            engine = cache.engine(engine)
+        a, g, v, e = formulas.evaluate_groups(kinds, self.p, self.etp, params,
+                                              checked=True, engine=engine)
+        _uncovered(kinds, measures.index, a)
+        diagnostics.record(kinds, self.p, self.etp, params, (a, g, v, e),
+                           source='cascade')
+        share = formulas.area_shares(kinds, self.p, self.etp, params)
 
-        results = [{'Element' : 'Rainwater usage', 'Area' : round(area),
-                    'Au' : round(au), 'P': self.p, 'Etp' : self.etp,
-                    'a' : round(a, 3), 'g' : round(g, 3), 'v' : round(v, 3),
-                    'e' : round(e, 3), 'Vp': round(area*self.p/1000),
-                    'Va' : round((area*self.p/1000 + va)*a),
-                    'Vg' : round((area*self.p/1000 + va)*g),
-                    'Vv' : round((area*self.p/1000 + va)*v),
-                    'Ve' : round((area*self.p/1000 + va)*e)}]
-        
-        results = pd.DataFrame(results)
-        return(pd.concat([previous_results, results], ignore_index=True))
+        # measures that drain into another measure
+        downstream = np.full(n, -1)
+        downstream[from_measure[~surface_edges]] = to_measure[~surface_edges]
+        upstream = np.bincount(downstream[downstream >= 0], minlength=n)
+
+        area, vp, volumes = np.zeros(n), np.zeros(n), np.zeros((4, n))
+        level = np.flatnonzero(upstream == 0)
+        evaluated = 0
+        while level.size:
+            evaluated += level.size
+            area[level] = au[level]*share[level]
+            vp[level] = area[level]*self.p/1000
+            inflow = vp[level] + va[level]
+            volumes[:, level] = inflow*a[level], inflow*g[level], inflow*v[level], inflow*e[level]
+            # passing Au and the overflow volume Va to the next measures
+            draining = level[downstream[level] >= 0]
+            receiving = downstream[draining]
+            np.add.at(au, receiving, au[draining])
+            np.add.at(va, receiving, volumes[0, draining])
+            np.subtract.at(upstream, receiving, 1)
+            receiving = np.unique(receiving)
+            level = receiving[upstream[receiving] == 0]
+        if evaluated < n:
+            raise Exception(f"{n - evaluated} measures are part of a cycle")
+
+        # Runoff volume are passed to measures, Va = 0
+        volumes[0, downstream >= 0] = 0
+        labels = {name: formulas.registry[name]['label'] for name in formulas.measures}
+        results = pd.DataFrame({'Element' : [labels[kind] for kind in kinds],
+                                'Area' : area, 'Au' : au,
+                                'P' : self.p, 'Etp' : self.etp,
+                                'a' : a, 'g' : g, 'v' : v, 'e' : e, 'Vp' : vp,
+                                'Va' : volumes[0], 'Vg' : volumes[1],
+                                'Vv' : volumes[2], 'Ve' : volumes[3]},
+                               index=measures.index)
+        surfaces = surfaces.copy()
+        surfaces.iloc[from_surface[surface_edges], surfaces.columns.get_loc('Va')] = 0
+        return surfaces, results
 
 
 #%% Starting class Surface
 class StudyArea(Surface, Measure):
-    def __init__(self, p=800, etp=500, location=None):
+    def __init__(self, p=800, etp=500, location=None, records=False):
+        # records=True: the methods return lists of dicts instead of
+        # DataFrames, so pandas is never imported
+        self.records = records
         self.location = location        
         if self.location:
             p, etp = climate(self.location)
@@ -1120,6 +1075,74 @@ class StudyArea(Surface, Measure):
             f" and potential evapotranspiration of {self.etp} mm/a"
             )
 
+class Climate(collections.namedtuple('Climate', ['p', 'etp', 'location', 'records']),
+              Surface, Measure):
+    '''
+    Immutable and hashable climate context with the methods of Surface and
+    Measure, for concurrent evaluation: p, etp, location and records are
+    fixed when it is created (as in StudyArea) and cannot be changed, so
+    one context can be shared by all the threads of a pool without locks.
+    The methods do not modify it. Contexts compare and hash as tuples and
+    can be used as keys of dicts or caches.
+
+        berlin = Climate(location='Berlin')
+        berlin.green_roof(100, h=120)       # or functional.green_roof(berlin, ...)
+    '''
+    __slots__ = ()
+
+    def __new__(cls, p=800, etp=500, location=None, records=False):
+        if location:
+            p, etp = climate(location)
+        validRange(p, 'P')
+        validRange(etp, 'ETp')
+        return super().__new__(cls, p, etp, location, records)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Climate is immutable, create a new one")
+
+    def __delattr__(self, name):
+        raise AttributeError("Climate is immutable, create a new one")
+
+    def _replace(self, **changes):
+        ''' new Climate with the given fields changed (validated)'''
+        values = {**self._asdict(), **changes}
+        if 'location' not in changes and ({'p', 'etp'} & set(changes)):
+            values['location'] = None
+        return Climate(**values)
+
+    def __str__(self):
+        return StudyArea.__str__(self)
+
+
+@functools.lru_cache(maxsize=None)
+def _context(p, etp, location, records):
+    return Climate(p, etp, location, records)
+
+
+def context(p=800, etp=500, location=None, records=False):
+    '''
+    Interned Climate of a location or of a pair (p, etp): the same object is
+    returned for every call with the same climate, so code that needs a
+    context per parcel neither builds nor validates one per parcel and
+    keeps one object per distinct climate.
+    '''
+    if location:
+        p, etp = climate(location)
+    return _context(p, etp, location or None, records)
+
+
+def contexts(locations, records=False):
+    '''
+    Interned Climates of many locations (e.g. a column of a table of
+    parcels), one per row; every distinct location is resolved once.
+    Use climates() for the arrays of P and ETp.
+    '''
+    index, distinct = pd.factorize(np.asarray(locations, dtype=object).ravel())
+    climates(np.append(distinct, None) if (index < 0).any() else distinct)
+    interned = [context(location=name, records=records) for name in distinct]
+    return [interned[i] for i in index]
+
+
 def watbal(*study_areas):
         '''
         Calculates water balance for a system compund of the ouputs from
@@ -1130,10 +1153,18 @@ def watbal(*study_areas):
         args : DataFrame 
              outputs of methods from StudyArea (Surfaces, Measures)  
                           
+        Notes
+        ------
+        If all the outputs are lists of dicts (StudyArea with records=True)
+        the results are a list of dicts as well and pandas is not used.
+
         Returns
         -------
         results : DataFrame 
         '''
+        if all(isinstance(df, list) for df in study_areas):
+            return _watbal_records(study_areas)
+
         df_layout = pd.DataFrame(columns = ['Element', 'Area','a', 'g', 'v', 
                                                    'e', 'Vp', 'Va', 'Vg',
                                                    'Vv', 'Ve'])
@@ -1168,4 +1199,25 @@ def watbal(*study_areas):
             sys_results = sys_results.drop(columns = ["e"])
             sys_results = sys_results.drop(columns = ["Ve"])
                     
-        return(sys_results)
\ No newline at end of file
+        return(sys_results)
+
+
+def _watbal_records(study_areas):
+    ''' watbal() for outputs given as lists of dicts'''
+    columns = ['Element', 'Area', 'a', 'g', 'v', 'e', 'Vp', 'Va', 'Vg', 'Vv', 'Ve']
+    rows = [{column: row[column] for column in columns}
+            for df in study_areas for row in df]
+
+    area, vp, va, vg, vv, ve = (float(sum(row[column] for row in rows))
+                                for column in ['Area', 'Vp', 'Va', 'Vg', 'Vv', 'Ve'])
+    rows.append({'Element' : 'System', 'Area' : round(area),
+                 'a' : round(va/vp, 3), 'g' : round(vg/vp, 3),
+                 'v' : round(vv/vp, 3), 'e' : round(ve/vp, 3), 'Vp': round(vp),
+                 'Va' : round(va),'Vg' : round(vg),'Vv' : round(vv),
+                 'Ve' : round(ve)})
+
+    # delete column e and ve if all column is zero
+    if all(row['e'] == 0 for row in rows):
+        for row in rows:
+            del row['e'], row['Ve']
+    return rows
@@ -0,0 +1,801 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of the regression equations of the DWA-A102 guideline.
+
+Every element (surface or measure) is described as data in `registry`: its
+parameters with their standard values, the ranges checked with validRange,
+and the formulas for the partitioning factors a, g, v and e. A formula is a
+tuple (intercept, terms), a term a tuple (coefficient, factor, ...) and
+every factor one of the following term types:
+
+  ('linear', x)          x
+  ('log', x, c)          ln(x + c)
+  ('log10', x, c)        log10(x + c)
+  ('exp', x, k)          exp(k/x)
+  ('reciprocal', x, c)   1/(x + c)
+  ('power', x, k)        x**k
+
+where x is 'p', 'etp', a parameter or a derived variable of the element.
+A single kernel evaluates any formula over NumPy arrays; it is compiled with
+numba when numba is installed (see kernels.py). Climate (p, etp) and
+parameters broadcast against each other, so a parameter given as a scalar
+(or as an array of shape (k, 1)) is evaluated only once while the climate
+dependent terms are evaluated for every value of p and etp.
+
+Scalar inputs are evaluated by evaluate_scalar() with the math module only.
+NumPy is imported lazily and numba only on the first compiled evaluation, so
+the scalar methods of dwa_a102.py do not need to import either of them.
+"""
+
+from enum import IntEnum
+import importlib.util
+import math
+from lazy import lazy_import
+from check_ranges import param_rages, validRange, validRanges
+
+np = lazy_import('numpy')
+
+HAVE_NUMBA = importlib.util.find_spec('numba') is not None
+
+#%% Registry of the elements
+
+registry = {
+    # Grünflächen, Garten
+    'garden': {
+        'label': 'Garden / green area',
+        'kind': 'surface',
+        'params': {'a': 0.2, 'g': 0.2, 'v': 0.6},
+        'a': (0, [(1, ('linear', 'a'))]),
+        'g': (0, [(1, ('linear', 'g'))]),
+        'v': (0, [(1, ('linear', 'v'))]),
+        },
+    # A.2: Steildächer, Flachdächer (glatte Materialien)
+    'roof': {
+        'label': 'Roof',
+        'kind': 'surface',
+        'params': {'sp': 0.3},
+        'checks': {'sp': 'Sp_roof'},
+        'a': (0.9115, [(0.00007063, ('linear', 'p')),
+                       (-0.000007498, ('linear', 'etp')),
+                       (-0.2063, ('log', 'sp', 1))]),
+        'closure': ('v', False),
+        },
+    # A.3: Flachdächer (raue Materialien, Kies), Asphalt, fugenloser Beton
+    'flat_area': {
+        'label': 'Flat area',
+        'kind': 'surface',
+        'params': {'sp': 1},
+        'checks': {'p': 'P', 'etp': 'ETp', 'sp': 'Sp_flat_area'},
+        'a': (0.8658, [(0.0001659, ('linear', 'p')),
+                       (-0.00009945, ('linear', 'etp')),
+                       (-0.1542, ('log', 'sp', 1))]),
+        'closure': ('v', False),
+        },
+    # A.4: Gründächer
+    'green_roof': {
+        'label': 'Green roof',
+        'kind': 'surface',
+        'params': {'h': None, 'kf': 70, 'wkmax_wp': 0.5},
+        'checks': {'h': 'h_green_roof', 'kf': 'kf_green_roof',
+                   'wkmax_wp': 'WKmax_WP_green_roof'},
+        # ln(wkmax_wp*h) = ln(wkmax_wp) + ln(h)
+        'a': (-2.182, [(0.4293, ('log', 'p', 0)),
+                       (-0.0001092, ('linear', 'p')),
+                       (236.1, ('reciprocal', 'etp', 0)),
+                       (0.0001142, ('linear', 'h')),
+                       (0.0002297, ('linear', 'kf')),
+                       (0.01628, ('log', 'wkmax_wp', 0)),
+                       (-0.1214, ('log', 'wkmax_wp', 0)),
+                       (-0.1214, ('log', 'h', 0))]),
+        'closure': ('v', False),
+        },
+    # A.5: Einstaudächer
+    'storage_roof': {
+        'label': 'Storage roof',
+        'kind': 'surface',
+        'params': {'sp': 5},
+        'checks': {'sp': 'Sp_storage_roof'},
+        'a': (0.9231, [(0.000254, ('linear', 'p')),
+                       (-0.0003226, ('linear', 'etp')),
+                       (-0.1472, ('log', 'sp', 1))]),
+        'closure': ('v', False),
+        },
+    # A.6 & A.7: Teildurchlässige Flächenbeläge (Fugenanteil 2 % bis 10 %)
+    'permeable_surface': {
+        'label': 'Permeable surface',
+        'kind': 'surface',
+        'params': {'fa': None, 'kf': None, 'sp': 1, 'wkmax_wp': 0.15},
+        'cases': [
+            # A.6: Fugenanteil 2 % bis 5 %
+            (('fa', 2, 5), {
+                'a': (0, [(0.0800734, ('log', 'p', 0)),
+                          (-0.0582828, ('linear', 'fa')),
+                          (-0.0501693, ('linear', 'sp')),
+                          (-0.385767, ('linear', 'wkmax_wp')),
+                          (8.7040284, ('reciprocal', 'kf', 11.9086896))]),
+                'v': (0.8529, [(-0.1248, ('log', 'p', 0)),
+                               (0.00005057, ('linear', 'etp')),
+                               (0.002372, ('linear', 'fa')),
+                               (0.1583, ('log', 'sp', 1))]),
+                }),
+            # A.7: Fugenanteil 6 % bis 10 %
+            (('fa', 6, 10), {
+                'a': (0, [(0.05912, ('log', 'p', 0)),
+                          (-0.02749, ('linear', 'fa')),
+                          (-0.03671, ('linear', 'sp')),
+                          (-0.30514, ('linear', 'wkmax_wp')),
+                          (4.97687, ('reciprocal', 'kf', 4.7975))]),
+                'v': (0.9012, [(-0.1325, ('log', 'p', 0)),
+                               (0.00006661, ('linear', 'etp')),
+                               (0.002302, ('linear', 'fa')),
+                               (0.1489, ('log', 'sp', 1))]),
+                }),
+            ],
+        # To fullfill the conservation mass (a+g+v=1)
+        'closure': ('g', False),
+        },
+    # A.8: Poren- und Sickersteine, Schotterrasen, Kies
+    'porous_surface': {
+        'label': 'Porous surface',
+        'kind': 'surface',
+        'params': {'sp': 3.5, 'h': 100, 'kf': 180},
+        'checks': {'sp': 'Sp_porous_surface', 'h': 'h_porous_surface',
+                   'kf': 'kf_porous_surface'},
+        'a': (0, [(0.000001969, ('linear', 'p')),
+                  (-0.005116, ('log', 'sp', 0)),
+                  (-0.0001051, ('linear', 'h')),
+                  (0.01753, ('exp', 'kf', 4.576))]),
+        'v': (0.2111, [(-0.2544, ('log', 'p', 0)),
+                       (0.2073, ('log', 'etp', 0)),
+                       (0.0006249, ('linear', 'sp')),
+                       (0.123, ('log', 'h', 0)),
+                       (-0.000002806, ('linear', 'kf'))]),
+        'closure': ('g', True),
+        },
+    # A.9: Rasengittersteine
+    'paver_stonegrid': {
+        'label': 'Paver stone-grid',
+        'kind': 'surface',
+        'params': {'fa': 25, 'sp': 1, 'wkmax_wp': 0.15},
+        'checks': {'fa': 'FA_paver_stonegrid', 'sp': 'Sp_paver_stonegrid',
+                   'wkmax_wp': 'WKmax_WP_paver_stonegrid'},
+        'a': (0.145704, [(-0.059177, ('log', 'fa', 0)),
+                         (-0.007354, ('linear', 'sp')),
+                         (-0.050531, ('log', 'wkmax_wp', 0))]),
+        'v': (1.106, [(-0.1625, ('log', 'p', 0)),
+                      (0.0001282, ('linear', 'etp')),
+                      (0.1131, ('log', 'sp', 1)),
+                      (0.2848, ('linear', 'wkmax_wp'))]),
+        'closure': ('g', True),
+        },
+    # A.10: Deckschichten ohne Bindemittel (wassergebundene Decke)
+    'gravel_cover': {
+        'label': 'Gravel cover',
+        'kind': 'surface',
+        'params': {'h': 100, 'sp': 3.5, 'kf': 1.8},
+        'checks': {'p': 'P', 'etp': 'ETp', 'h': 'h_gravel_cover',
+                   'sp': 'Sp_gravel_cover', 'kf': 'kf_gravel_cover'},
+        'a': (0, [(0.00004517, ('linear', 'p')),
+                  (-0.03454, ('log', 'sp', 0)),
+                  (0.1958, ('reciprocal', 'kf', 0.2873))]),
+        'v': (0.2111, [(-0.2544, ('log', 'p', 0)),
+                       (0.2073, ('log', 'etp', 0)),
+                       (0.0006249, ('linear', 'sp')),
+                       (0.123, ('log', 'h', 0)),
+                       (-0.000002806, ('linear', 'kf'))]),
+        'closure': ('g', True),
+        },
+    # Ableitung: Rohr, Rinne, steiler Graben (vegetated = 0) or
+    # Gräben mit Bewuchs (vegetated = 1), see DrainageType
+    'drainage': {
+        'label': 'Drainage',
+        'kind': 'measure',
+        'params': {'vegetated': 0},
+        'a': (1, [(-0.3, ('linear', 'vegetated'))]),
+        'g': (0, [(0.1, ('linear', 'vegetated'))]),
+        'v': (0, [(0.2, ('linear', 'vegetated'))]),
+        },
+    # B.2: Flächenversickerung
+    'surf_infiltration': {
+        'label': 'Surface infilt.',
+        'kind': 'measure',
+        'params': {'kf': None, 'fasf': None},
+        'checks': {'kf': 'kf_surf_infiltration'},
+        'derived': [('fasf', (0, [(94741, ('power', 'kf', -1.195))]), 'standard')],
+        'share': 'fasf',
+        'a': (0.004264, [(0.001121, ('log', 'p', 0)),
+                         (-0.002757, ('log', 'fasf', 0))]),
+        'v': (0.3999, [(-0.09317, ('log', 'p', 0)),
+                       (0.00009746, ('linear', 'etp')),
+                       (0.07474, ('log', 'fasf', 0))]),
+        'closure': ('g', True),
+        },
+    # B.3: Versickerungsmulden
+    'infilt_swale': {
+        'label': 'Infilt. swale',
+        'kind': 'measure',
+        'params': {'kf': None, 'fasm': None},
+        'checks': {'kf': 'kf_infilt_swale'},
+        'derived': [('fasm', (0, [(42.323, ('power', 'kf', -0.314))]), 'standard')],
+        'share': 'fasm',
+        # ln(kf/fasm) = ln(kf) - ln(fasm)
+        'g': (0.8608, [(0.02385, ('log', 'p', 0)),
+                       (-0.00005331, ('linear', 'etp')),
+                       (-0.002827, ('linear', 'fasm')),
+                       (-0.000002493, ('linear', 'kf')),
+                       (0.0009514, ('log', 'kf', 0)),
+                       (-0.0009514, ('log', 'fasm', 0))]),
+        'v': (0, [(0.000008562, ('linear', 'etp')),
+                  (2.611, ('reciprocal', 'p', -64.35), ('power', 'fasm', 0.9425)),
+                  (-0.000001211, ('linear', 'kf'))]),
+        # To force positive values or zero
+        'closure': ('a', True),
+        },
+    # B.4: Mulden-Rigolen-Elemente
+    'swale_trench': {
+        'label': 'Swale trench',
+        'kind': 'measure',
+        'params': {'kf': None, 'fasm': None},
+        'checks': {'kf': 'kf_swale_trench'},
+        'derived': [('fasm', (0, [(21.86, ('power', 'kf', -0.348))]), 'standard')],
+        'share': 'fasm',
+        'a': (-0.03867, [(0.007684, ('log', 'p', 0)),
+                         (0.000003201, ('linear', 'fasm')),
+                         (0.0002564, ('linear', 'kf')),
+                         (-0.0001187, ('linear', 'fasm'), ('linear', 'kf')),
+                         (0.004161, ('log', 'kf', 0)),
+                         (-0.004161, ('log', 'fasm', 0))]),
+        'v': (0, [(0.000008879, ('linear', 'etp')),
+                  (2.528, ('reciprocal', 'p', -81.65), ('power', 'fasm', 0.9496)),
+                  (-0.00007768, ('linear', 'kf'))]),
+        'closure': ('g', True),
+        },
+    # B.5: Mulden-Rigolen-Systeme
+    'swale_trench_system': {
+        'label': 'Swale trench system',
+        'kind': 'measure',
+        'params': {'qdr': None, 'kf': None, 'fasm': None},
+        'checks': {'qdr': 'qDr_swale_trench_system',
+                   'kf': 'kf_swale_trench_system'},
+        'derived': [('fasm', (11.79, [(-3.14, ('log', 'qdr', 0)),
+                                      (-0.18594, ('linear', 'kf'))]), 'standard')],
+        'share': 'fasm',
+        'a': (0.8112, [(0.0003473, ('linear', 'p')),
+                       (-0.00001845, ('linear', 'etp')),
+                       (-0.04793, ('linear', 'fasm')),
+                       (0.0007481, ('linear', 'qdr')),
+                       (-0.4389, ('log', 'kf', 1))]),
+        'v': (0.1428, [(-0.02661, ('log', 'p', 0)),
+                       (0.00005668, ('linear', 'etp')),
+                       (0.0288, ('log', 'fasm', 0)),
+                       (-0.0001825, ('linear', 'qdr')),
+                       (-0.01823, ('log', 'kf', 1))]),
+        'closure': ('g', True),
+        },
+    # B.6: Anlagen zur Niederschlagswassernutzung
+    'rainwater_usage': {
+        'label': 'Rainwater usage',
+        'kind': 'measure',
+        'params': {'vsp': None, 'vbr': None, 'fabw': 2, 'qbw': 60},
+        'checks': {'vsp': 'VSp_rainwater_usage', 'vbr': 'VBr_rainwater_usage',
+                   'fabw': 'FAbw_rainwater_usage', 'qbw': 'qBw_rainwater_usage'},
+        # VBw = FAbw*qBw, Vnmin = min(P, 365*VBr + VBw)
+        'derived': [('vbw', (0, [(1, ('linear', 'fabw'), ('linear', 'qbw'))]), None),
+                    ('vnmin', (0, [(365, ('linear', 'vbr')),
+                                   (1, ('linear', 'vbw'))]), 'min_p')],
+        'v': (0, [(-0.0001927, ('linear', 'p')),
+                  (0.0001831, ('linear', 'etp')),
+                  (0.0006083, ('linear', 'vbw')),
+                  (-0.0000003127, ('power', 'vbw', 2)),
+                  (-0.3092, ('exp', 'vsp', 3.269)),
+                  (1.424, ('reciprocal', 'vbr', 2.782)),
+                  (0.0001885, ('linear', 'vnmin'))]),
+        'e': (0.4451, [(-0.0003529, ('linear', 'p')),
+                       (-0.00007728, ('linear', 'etp')),
+                       (0.06821, ('log10', 'vsp', 0)),
+                       (-0.0002507, ('linear', 'vbw')),
+                       (0.2349, ('log10', 'vbr', 0)),
+                       (0.0001738, ('linear', 'vnmin'))]),
+        'zero_if': {'v': 'vbw', 'e': 'vbr'},
+        'closure': ('a', True),
+        },
+    # B.7: Wasserfläche mit Dauerstau
+    'pod_system': {
+        'label': 'Pod system',
+        'kind': 'measure',
+        'params': {'aw': None, 'A_1': None, 'a_1': None, 'A_2': 0, 'a_2': 0.0,
+                   'A_3': 0, 'a_3': 0.0, 'A_4': 0, 'a_4': 0.0},
+        'checks': {'a_1': 'a_1_pod_system', 'a_2': 'a_2_pod_system',
+                   'a_3': 'a_3_pod_system', 'a_4': 'a_4_pod_system'},
+        'derived': [('aw_total', (0, [(1, ('linear', 'aw')),
+                                      (1, ('linear', 'A_1'), ('linear', 'a_1')),
+                                      (1, ('linear', 'A_2'), ('linear', 'a_2')),
+                                      (1, ('linear', 'A_3'), ('linear', 'a_3')),
+                                      (1, ('linear', 'A_4'), ('linear', 'a_4'))]),
+                     None)],
+        'v': (0, [(1, ('linear', 'etp'), ('linear', 'aw'),
+                   ('reciprocal', 'p', 0), ('reciprocal', 'aw_total', 0))]),
+        'closure': ('a', False),
+        },
+    }
+
+class DrainageType(IntEnum):
+    ''' types of drainage, the value is the parameter vegetated of the registry'''
+    PIPE = 0                # Rohr, Rinne, steiler Graben: a = 1
+    VEGETATED_DITCH = 1     # Gräben mit Bewuchs: a = 0.7, g = 0.1, v = 0.2
+
+
+# normalized names (lower case, single spaces) of the types of drainage
+drainage_names = {
+    'pipe': DrainageType.PIPE,
+    'rohr': DrainageType.PIPE,
+    'channel': DrainageType.PIPE,
+    'rinne': DrainageType.PIPE,
+    'steep ditch': DrainageType.PIPE,
+    'steiler graben': DrainageType.PIPE,
+    'shallow ditches with vegetation': DrainageType.VEGETATED_DITCH,
+    'ditch with vegetation': DrainageType.VEGETATED_DITCH,
+    'flache gräben mit bewuchs': DrainageType.VEGETATED_DITCH,
+    'gräben mit bewuchs': DrainageType.VEGETATED_DITCH,
+    }
+
+
+def drainage_type(name):
+    ''' DrainageType of a name (any capitalization) or of a DrainageType'''
+    if isinstance(name, DrainageType):
+        return name
+    kind = drainage_names.get(' '.join(str(name).split()).casefold())
+    if kind is None:
+        raise Exception(f"Wrong input as drainage-type: {name}. Valid types:"
+                        f" {', '.join(drainage_names)}")
+    return kind
+
+
+def drainage_types(names):
+    '''
+    Vectorized version of drainage_type(): every distinct name is looked up
+    once and all the invalid names are reported together
+
+    Returns
+    -------
+    codes : array of int8
+          values of DrainageType (parameter vegetated)
+    '''
+    names = np.asarray(names, dtype=object)
+    distinct, inverse = np.unique(names.astype(str), return_inverse=True)
+    codes = np.empty(len(distinct), dtype=np.int8)
+    invalid = []
+    for i, name in enumerate(distinct):
+        kind = drainage_names.get(' '.join(name.split()).casefold())
+        if kind is None:
+            invalid.append(f"{name} ({(inverse == i).sum()}x)")
+        else:
+            codes[i] = kind
+    if invalid:
+        raise Exception(f"Wrong input as drainage-type for {len(invalid)} names:"
+                        f" {', '.join(invalid)}. Valid types: {', '.join(drainage_names)}")
+    return codes[inverse].reshape(names.shape)
+
+
+surfaces = tuple(name for name, spec in registry.items() if spec['kind'] == 'surface')
+measures = tuple(name for name, spec in registry.items() if spec['kind'] == 'measure')
+
+components = ('a', 'g', 'v', 'e')
+
+#%% Evaluation kernel
+
+term_types = {'linear': 0, 'log': 1, 'log10': 2, 'exp': 3, 'reciprocal': 4,
+              'power': 5}
+
+
+def _factor(kind, x, c):
+    ''' NumPy evaluation of a single factor of a term'''
+    if kind == 'linear':
+        return x
+    if kind == 'log':
+        return np.log(x + c)
+    if kind == 'log10':
+        return np.log10(x + c)
+    if kind == 'exp':
+        return np.exp(c/x)
+    if kind == 'reciprocal':
+        return 1/(x + c)
+    return x**c
+
+
+def _numpy_kernel(formula, variables):
+    ''' evaluates a formula with broadcasting NumPy operations'''
+    intercept, terms = formula
+    result = intercept
+    for coefficient, *factors in terms:
+        term = coefficient
+        for kind, name, *c in factors:
+            term = term*_factor(kind, variables[name], *(c or [0]))
+        result = result + term
+    return result
+
+
+def _scalar_factor(kind, x, c):
+    '''
+    Pure Python evaluation of a single factor of a term. Results outside
+    the domain of the math module are those of NumPy: ln(0) = -inf, NaN for
+    the logarithm or a fractional power of a negative value, and divisions
+    by zero or overflows are evaluated with NumPy itself.
+    '''
+    try:
+        if kind == 'linear':
+            return x
+        if kind == 'log':
+            return math.log(x + c)
+        if kind == 'log10':
+            return math.log10(x + c)
+        if kind == 'exp':
+            return math.exp(c/x)
+        if kind == 'reciprocal':
+            return 1/(x + c)
+        value = x**c
+        return math.nan if isinstance(value, complex) else value
+    except ValueError:
+        return -math.inf if x + c == 0 else math.nan
+    except (ZeroDivisionError, OverflowError):
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            return float(_factor(kind, np.float64(x), c))
+
+
+def _scalar_kernel(formula, variables):
+    ''' evaluates a formula for scalar variables'''
+    intercept, terms = formula
+    result = intercept
+    for coefficient, *factors in terms:
+        term = coefficient
+        for kind, name, *c in factors:
+            term = term*_scalar_factor(kind, variables[name], *(c or [0]))
+        result = result + term
+    return result
+
+
+def compile_formula(formula, names):
+    '''
+    Translates a formula into the arrays read by the compiled kernel:
+    intercept, coefficients (terms), and the type, variable index (into
+    names) and constant of every factor (terms, factors). Unused factor
+    slots are linear factors of the constant variable 1 (index -1).
+    '''
+    intercept, terms = formula
+    width = max([len(term) - 1 for term in terms] + [1])
+    coefficients = np.array([term[0] for term in terms], dtype=np.float64)
+    kinds = np.zeros((len(terms), width), dtype=np.int64)
+    index = np.full((len(terms), width), -1, dtype=np.int64)
+    constants = np.zeros((len(terms), width), dtype=np.float64)
+    for t, (_, *factors) in enumerate(terms):
+        for f, (kind, name, *c) in enumerate(factors):
+            kinds[t, f] = term_types[kind]
+            index[t, f] = names.index(name)
+            constants[t, f] = c[0] if c else 0
+    return float(intercept), coefficients, kinds, index, constants
+
+
+# compiled formulas of the registry, filled on first use
+_compiled = {}
+
+
+def _kernel(element, component, formula, variables, shape):
+    '''
+    Evaluates a formula of an element. With numba installed all the
+    variables are broadcast to the common shape and the compiled kernel
+    (kernels.formula_kernel) runs over them in parallel, otherwise the NumPy
+    kernel is used.
+    '''
+    if not HAVE_NUMBA or len(shape) == 0:
+        return np.broadcast_to(_numpy_kernel(formula, variables), shape)
+    from kernels import formula_kernel
+
+    names = list(variables)
+    key = (element, component, id(formula))
+    if key not in _compiled:
+        _compiled[key] = compile_formula(formula, names)
+    x = np.stack([np.broadcast_to(np.asarray(variables[name], dtype=np.float64),
+                                  shape).ravel() for name in names])
+    out = np.empty(x.shape[1])
+    formula_kernel(*_compiled[key], x, out)
+    return out.reshape(shape)
+
+#%% Evaluation of the elements
+
+def range_key(element, name):
+    '''
+    Key of param_rages of an input of an element ('p', 'etp' or a
+    parameter): its check or, for parameters without check, the key
+    <name>_<element> (e.g. FA_permeable_surface). None if it has no range.
+    '''
+    if name in ('p', 'etp'):
+        return {'p': 'P', 'etp': 'ETp'}[name]
+    key = registry[element].get('checks', {}).get(name)
+    if key is None:
+        keys = {key.lower(): key for key in param_rages}
+        key = keys.get(f"{name}_{element}".lower())
+    return key
+
+
+def defaults(element):
+    ''' standard values of the parameters of an element (None if required)'''
+    return dict(registry[element]['params'])
+
+
+def _derived(element, name):
+    ''' True if a parameter has a standard formula (e.g. FAsm)'''
+    return any(name == derived and rule == 'standard'
+               for derived, _, rule in registry[element].get('derived', ()))
+
+
+def _fill(value, standard):
+    ''' replaces missing values (None or NaN) by the standard value'''
+    if value is None:
+        return standard
+    value = np.asarray(value, dtype=float)
+    return np.where(np.isnan(value), standard, value)
+
+
+def variables(element, p, etp, **params):
+    '''
+    Variables of the formulas of an element: p, etp, the parameters (missing
+    ones replaced by their standard values) and the derived variables.
+    '''
+    spec = registry[element]
+    unknown = set(params) - set(spec['params'])
+    if unknown:
+        raise Exception(f"Unknown parameters of {element}: {', '.join(sorted(unknown))}")
+    values = {'p': np.asarray(p, dtype=float), 'etp': np.asarray(etp, dtype=float)}
+    for name, standard in spec['params'].items():
+        value = params.get(name)
+        if standard is None:
+            values[name] = np.asarray(np.nan if value is None else value, dtype=float)
+        else:
+            values[name] = np.asarray(_fill(value, standard), dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for name, formula, rule in spec.get('derived', ()):
+            value = _numpy_kernel(formula, values)
+            if rule == 'standard':
+                value = _fill(params.get(name), value)
+            elif rule == 'min_p':
+                value = np.minimum(values['p'], value)
+            values[name] = np.asarray(value, dtype=float)
+    return values
+
+
+def check(element, p=None, etp=None, **params):
+    '''
+    Checks the parameters of an element with validRange (scalars) or
+    validRanges (arrays), as the methods of dwa_a102.py do
+    '''
+    values = {**defaults(element), 'p': p, 'etp': etp, **params}
+    for name, key in registry[element].get('checks', {}).items():
+        value = values[name]
+        if value is None:
+            continue
+        if isinstance(value, (int, float)) or np.ndim(value) == 0:
+            validRange(value, key)
+        else:
+            validRanges(value, key)
+
+
+def evaluate(element, p, etp, **params):
+    '''
+    Evaluates the partitioning factors of an element
+
+    Parameters
+    ----------
+    element : string
+            name of the element in the registry (method of StudyArea)
+
+    p, etp : float or array
+           precipitation and potential evapotranspiration (mm/a)
+
+    params : float or array
+           parameters of the element. Missing values (None or NaN) are
+           replaced by the standard values.
+
+    Notes
+    ------
+    Parameters are not checked (see check()). Combinations of parameters
+    that are not covered by any case of the element (e.g. a joint ratio of
+    5.5 % for permeable surfaces) result in NaN.
+
+    Returns
+    -------
+    a, g, v, e : arrays
+               broadcast to the common shape of the inputs
+    '''
+    spec = registry[element]
+    values = variables(element, p, etp, **params)
+    shape = np.broadcast_shapes(*(np.shape(x) for x in values.values()))
+
+    results = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if 'cases' in spec:
+            for component in components:
+                results[component] = np.full(shape, np.nan)
+            for (name, low, high), formulas in spec['cases']:
+                where = np.broadcast_to((values[name] >= low) & (values[name] <= high),
+                                        shape)
+                for component in components:
+                    if component in formulas:
+                        value = _kernel(element, component, formulas[component],
+                                        values, shape)
+                    else:
+                        value = 0.0
+                    results[component] = np.where(where, value, results[component])
+        else:
+            for component in components:
+                if component in spec:
+                    results[component] = _kernel(element, component, spec[component],
+                                                 values, shape)
+                else:
+                    results[component] = np.zeros(shape)
+
+        for component, name in spec.get('zero_if', {}).items():
+            results[component] = np.where(values[name] == 0, 0.0, results[component])
+
+    if 'closure' in spec:
+        component, clip = spec['closure']
+        rest = sum(results[other] for other in components if other != component)
+        results[component] = np.maximum(1 - rest, 0.0) if clip else 1 - rest
+    return tuple(np.asarray(results[component], dtype=float) for component in components)
+
+
+def _missing(value):
+    ''' True for a missing scalar value (None or NaN)'''
+    return value is None or value != value
+
+
+def scalar_variables(element, p, etp, **params):
+    ''' variables() for scalar inputs, without NumPy'''
+    spec = registry[element]
+    unknown = set(params) - set(spec['params'])
+    if unknown:
+        raise Exception(f"Unknown parameters of {element}: {', '.join(sorted(unknown))}")
+    values = {'p': float(p), 'etp': float(etp)}
+    for name, standard in spec['params'].items():
+        value = params.get(name)
+        if _missing(value):
+            value = math.nan if standard is None else standard
+        values[name] = float(value)
+    for name, formula, rule in spec.get('derived', ()):
+        value = _scalar_kernel(formula, values)
+        if rule == 'standard' and not _missing(params.get(name)):
+            value = params[name]
+        elif rule == 'min_p' and not math.isnan(value):
+            value = min(values['p'], value)
+        values[name] = float(value)
+    return values
+
+
+def evaluate_scalar(element, p, etp, **params):
+    '''
+    Evaluates the partitioning factors of an element for scalar inputs with
+    the math module, as evaluate() does with NumPy. Used by the methods of
+    dwa_a102.py.
+
+    Returns
+    -------
+    a, g, v, e : floats
+    '''
+    spec = registry[element]
+    values = scalar_variables(element, p, etp, **params)
+
+    formulas = spec
+    if 'cases' in spec:
+        formulas = None
+        for (name, low, high), case in spec['cases']:
+            if low <= values[name] <= high:
+                formulas = case
+        if formulas is None:
+            return (math.nan,)*len(components)
+    results = {component: _scalar_kernel(formulas[component], values)
+               if component in formulas else 0.0 for component in components}
+
+    for component, name in spec.get('zero_if', {}).items():
+        if values[name] == 0:
+            results[component] = 0.0
+
+    if 'closure' in spec:
+        component, clip = spec['closure']
+        rest = sum(results[other] for other in components if other != component)
+        results[component] = max(1 - rest, 0.0) if clip else 1 - rest
+    return tuple(float(results[component]) for component in components)
+
+
+def area_share(element, p=800, etp=500, **params):
+    '''
+    Area of a measure as a fraction of the connected, effective runoff
+    area Au (FAsf/100 or FAsm/100). Elements without an infiltration area
+    return 0.
+    '''
+    share = registry[element].get('share')
+    if share is None:
+        return 0.0
+    if all(value is None or isinstance(value, (int, float))
+           for value in (p, etp, *params.values())):
+        return scalar_variables(element, p, etp, **params)[share]/100
+    return variables(element, p, etp, **params)[share]/100
+
+
+def _groups(elements):
+    ''' yields every element type with the positions of its rows'''
+    types, inverse = np.unique(elements, return_inverse=True)
+    for i, element in enumerate(types):
+        if element not in registry:
+            raise Exception(f"Unknown element type: {element}")
+        yield element, np.flatnonzero(inverse == i)
+
+
+def _group_params(element, params, rows):
+    ''' parameters of an element type taken from the rows of a table'''
+    return {name: np.asarray(params[name], dtype=float)[rows]
+            for name in registry[element]['params'] if name in params}
+
+
+def area_shares(elements, p, etp, params):
+    '''
+    Grouped version of area_share() for elements of mixed types, with the
+    arguments of evaluate_groups()
+    '''
+    elements = np.asarray(elements)
+    n = len(elements)
+    p = np.broadcast_to(np.asarray(p, dtype=float), (n,))
+    etp = np.broadcast_to(np.asarray(etp, dtype=float), (n,))
+    shares = np.zeros(n)
+    for element, rows in _groups(elements):
+        shares[rows] = area_share(element, p[rows], etp[rows],
+                                  **_group_params(element, params, rows))
+    return shares
+
+
+def evaluate_groups(elements, p, etp, params, checked=False, engine=None):
+    '''
+    Evaluates elements of mixed types in one grouped pass: the rows of each
+    element type are evaluated together and the results are returned in
+    input order.
+
+    Parameters
+    ----------
+    elements : array of strings
+             element type (name in the registry) of every row
+
+    p, etp : float or array
+           precipitation and potential evapotranspiration (mm/a), one value
+           for all the rows or one per row
+
+    params : DataFrame or dict of arrays
+           parameters of the rows. Parameters that are not used by the type
+           of a row and missing values (NaN) are ignored, missing values are
+           replaced by the standard values.
+
+    checked : bool
+            checks the parameters of every group with check() and raises an
+            Exception if a required parameter is missing
+
+    engine : function
+           evaluation function with the arguments of evaluate() (default),
+           e.g. kernels.evaluate
+
+    Returns
+    -------
+    a, g, v, e : arrays
+    '''
+    engine = engine or evaluate
+    elements = np.asarray(elements)
+    n = len(elements)
+    p = np.broadcast_to(np.asarray(p, dtype=float), (n,))
+    etp = np.broadcast_to(np.asarray(etp, dtype=float), (n,))
+    results = np.full((4, n), np.nan)
+    for element, rows in _groups(elements):
+        group = _group_params(element, params, rows)
+        if checked:
+            for name, standard in registry[element]['params'].items():
+                if standard is None and not _derived(element, name) and (
+                        name not in group or np.isnan(group[name]).any()):
+                    raise Exception(f"Parameter {name} is required for {element}")
+            check(element, p[rows], etp[rows], **group)
+        results[:, rows] = engine(element, p[rows], etp[rows], **group)
+    return tuple(results)
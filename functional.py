@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Stateless functions of the elements: the methods of Surface and Measure as
+functions of an immutable climate context (dwa_a102.Climate) and their
+arguments. Nothing is stored between calls, so one context can be shared by
+all the threads of a pool serving concurrent requests.
+
+    berlin = Climate(location='Berlin')
+    roof_ = roof(berlin, 100, sp=0.3)
+    swale = infilt_swale(berlin, 20, roof_)
+    watbal(swale)
+
+Arguments and results are those of the methods of StudyArea; results are
+lists of dicts for contexts with records=True.
+"""
+
+import functools
+from dwa_a102 import Climate, watbal
+
+
+def _function(name):
+    ''' function of a method of Climate with the context as first argument'''
+    method = getattr(Climate, name)
+
+    @functools.wraps(method)
+    def function(context, *args, **kwargs):
+        if not isinstance(context, Climate):
+            raise Exception(f"The context of {name}() must be a Climate, not"
+                            f" {type(context).__name__}")
+        return method(context, *args, **kwargs)
+    return function
+
+#%% Surfaces
+
+garden = _function('garden')
+roof = _function('roof')
+flat_area = _function('flat_area')
+green_roof = _function('green_roof')
+storage_roof = _function('storage_roof')
+permeable_surface = _function('permeable_surface')
+porous_surface = _function('porous_surface')
+paver_stonegrid = _function('paver_stonegrid')
+gravel_cover = _function('gravel_cover')
+surface_table = _function('surface_table')
+
+#%% Measures
+
+drainage = _function('drainage')
+surf_infiltration = _function('surf_infiltration')
+infilt_swale = _function('infilt_swale')
+swale_trench = _function('swale_trench')
+swale_trench_system = _function('swale_trench_system')
+rainwater_usage = _function('rainwater_usage')
+pod_system = _function('pod_system')
+pod_systems = _function('pod_systems')
+route = _function('route')
+cascade = _function('cascade')
+
+__all__ = ['Climate', 'watbal', 'garden', 'roof', 'flat_area', 'green_roof',
+           'storage_roof', 'permeable_surface', 'porous_surface', 'paver_stonegrid',
+           'gravel_cover', 'surface_table', 'drainage', 'surf_infiltration',
+           'infilt_swale', 'swale_trench', 'swale_trench_system', 'rainwater_usage',
+           'pod_system', 'pod_systems', 'route', 'cascade']
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Water balance of polygon layers (GeoPackage, Shapefile, ...), e.g. parcels
+with an attribute for the type of surface.
+
+The layer is read in chunks of features with pyogrio, the areas of the
+polygons are computed vectorized (in a projected CRS), the attributes are
+mapped to the parameters of the methods of Surface and every chunk is
+evaluated with surface_table(). The results (a, g, v, e and the volumes)
+are appended chunk by chunk to a new layer, so layers larger than memory
+can be processed. Only local files are read.
+
+Requires geopandas and pyogrio (optional dependencies).
+
+    totals = balance_layer(StudyArea(location='Berlin'), 'parcels.gpkg',
+                           'balance.gpkg', columns={'element': 'nutzung'},
+                           types={'Dach': 'roof', 'Garten': 'garden'})
+"""
+
+import os
+import pandas as pd
+import formulas
+from delta import totals
+
+try:
+    import geopandas    # required by pyogrio.read_dataframe
+    import pyogrio
+    HAVE_GEO = True
+except ImportError:
+    HAVE_GEO = False
+
+# columns of the results written to the layer
+outputs = ['a', 'g', 'v', 'e', 'Vp', 'Va', 'Vg', 'Vv', 'Ve']
+
+
+def _require_geo():
+    if not HAVE_GEO:
+        raise Exception("geo.py requires the optional dependencies geopandas"
+                        " and pyogrio (pip install geopandas pyogrio)")
+
+
+def _local(path):
+    ''' checks that path is an existing local file'''
+    if '://' in str(path) or str(path).startswith('/vsi'):
+        raise Exception(f"Only local files can be read: {path}")
+    if not os.path.exists(path):
+        raise Exception(f"File not found: {path}")
+
+
+def read_chunks(path, layer=None, chunk_size=50000, columns=None):
+    '''
+    Reads a layer of a local file in chunks of features
+
+    Parameters
+    ----------
+    path : string
+         local file (GeoPackage, Shapefile or any format of GDAL)
+
+    layer : string
+          name of the layer (default: the first layer)
+
+    chunk_size : int
+               number of features per chunk
+
+    columns : list of strings
+            attributes to read (default: all)
+
+    Returns
+    -------
+    chunks : generator of GeoDataFrames
+    '''
+    _require_geo()
+    _local(path)
+    features = pyogrio.read_info(path, layer=layer)['features']
+    for start in range(0, features, chunk_size):
+        yield pyogrio.read_dataframe(path, layer=layer, columns=columns,
+                                     skip_features=start, max_features=chunk_size)
+
+
+def areas(chunk):
+    '''
+    Areas of the polygons (m2). Layers in geographic coordinates are
+    projected to their UTM zone for the calculation.
+    '''
+    geometry = chunk.geometry
+    if geometry.crs is None:
+        raise Exception("The layer has no coordinate reference system")
+    if geometry.crs.is_geographic:
+        geometry = geometry.to_crs(geometry.estimate_utm_crs())
+    return geometry.area.to_numpy()
+
+
+def surfaces(chunk, columns=None, types=None):
+    '''
+    Table of surfaces (input of surface_table) of a chunk of polygons
+
+    Parameters
+    ----------
+    chunk : GeoDataFrame
+          polygons with their attributes
+
+    columns : dict
+            attribute of the layer for the column element and the parameters
+            of the methods (e.g. {'element': 'nutzung', 'sp': 'speicher'});
+            parameters that are not mapped take the standard values and an
+            attribute 'area' replaces the area of the polygons
+
+    types : dict
+          values of the attribute of the element and the names of the
+          methods (e.g. {'Dach': 'roof'}); values that are already names of
+          methods need no entry
+    '''
+    columns = {'element': 'element', **(columns or {})}
+    element = chunk[columns['element']]
+    if types:
+        element = element.map(lambda value: types.get(value, value))
+    table = pd.DataFrame({'element': element.to_numpy()}, index=chunk.index)
+    if 'area' in columns:
+        table['area'] = chunk[columns['area']].to_numpy(dtype=float)
+    else:
+        table['area'] = areas(chunk)
+    parameters = {name for kind in formulas.surfaces
+                  for name in formulas.registry[kind]['params']}
+    for name, attribute in columns.items():
+        if name in parameters:
+            table[name] = pd.to_numeric(chunk[attribute]).to_numpy(dtype=float)
+    return table
+
+
+def balance_layer(study_area, path, out_path, layer=None, out_layer='water_balance',
+                  columns=None, types=None, chunk_size=50000, driver=None):
+    '''
+    Calculates the water balance of every polygon of a layer and writes the
+    polygons with their results to a new layer
+
+    Parameters
+    ----------
+    study_area : StudyArea
+               climate (P, ETp) of the polygons
+
+    path, layer :
+                local file and layer of the polygons
+
+    out_path, out_layer :
+                        file and layer of the results. The layer is created
+                        and the chunks are appended to it.
+
+    columns, types :
+                   mapping of the attributes, see surfaces()
+
+    chunk_size : int
+               number of polygons read, evaluated and written at a time
+
+    driver : string
+           OGR driver of the output (default: from the file extension)
+
+    Notes
+    ------
+    The attributes of the input are kept; the columns Area, a, g, v, e,
+    Vp, Va, Vg, Vv and Ve are added (not rounded).
+
+    Returns
+    -------
+    totals : Series
+           totals of the area and volumes of the layer, see delta.system()
+           for the row System of watbal
+    '''
+    _require_geo()
+    chunks = []
+    first = True
+    for chunk in read_chunks(path, layer, chunk_size):
+        results = study_area.surface_table(surfaces(chunk, columns, types))
+        chunks.append(totals(results))
+        chunk = chunk.assign(Area=results['Area'].to_numpy(),
+                             **{column: results[column].to_numpy()
+                                for column in outputs})
+        pyogrio.write_dataframe(chunk, out_path, layer=out_layer, driver=driver,
+                                append=not first)
+        first = False
+    if not chunks:
+        raise Exception(f"The layer {layer or ''} of {path} has no features")
+    return sum(chunks[1:], chunks[0])
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Golden corpus of the regression equations and comparison harness for new
+evaluation engines (vectorized, compiled, cached, ...).
+
+The corpus (golden/corpus.npz) holds a fixed set of inputs of every element
+of the registry: all the combinations of the boundaries and midpoints of the
+ranges of validity (param_rages) of its parameters, of P and of ETp (a
+random sample of them for elements with many parameters), the standard
+values, the cases of the elements (e.g. joint ratios of permeable surfaces)
+and random points inside the ranges. For every input it stores a, g, v and
+e of the reference implementation, formulas.evaluate_scalar(), which the
+methods of dwa_a102.py use. The reference is not generated from the
+original methods of dwa_a102.py (they round a, g, v and e to 3 decimals):
+the corpus catches regressions of the registry and of the engines against
+evaluate_scalar(), not errors of the registry against the guideline.
+test_golden.py runs the comparison of every engine with pytest.
+
+    python golden.py            compares the engines with the corpus
+    python golden.py --exact    requires bitwise reproduction (atol=rtol=0)
+    python golden.py --build    rebuilds the corpus (only when the reference
+                                results are meant to change)
+"""
+
+import itertools
+import os
+import sys
+import numpy as np
+import pandas as pd
+import formulas
+from check_ranges import param_rages
+
+path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden', 'corpus.npz')
+
+# values of the parameters without range in param_rages (NaN: standard value)
+extra_values = {
+    ('garden', 'a'): [0.1, 0.2, 0.3],
+    ('garden', 'g'): [0.1, 0.2, 0.3],
+    ('garden', 'v'): [0.6],
+    ('permeable_surface', 'fa'): [3.5, 5, 5.5],
+    'fasf': [np.nan, 5, 30],
+    'fasm': [np.nan, 5, 30],
+    'vegetated': [0, 1],
+    'aw': [10, 500],
+    'A_1': [100, 5000],
+    'A_2': [0, 1000],
+    'A_3': [0, 1000],
+    'A_4': [0, 1000],
+    }
+
+#%% Corpus
+
+def values(element, name):
+    '''
+    Corpus values of a parameter: boundaries and midpoint of its range,
+    its standard value and the values of extra_values
+    '''
+    standard = formulas.registry[element]['params'][name]
+    key = formulas.range_key(element, name)
+    result = []
+    if key is not None:
+        low, high = param_rages[key][:2]
+        result += [low, (low + high)/2, high]
+    result += extra_values.get((element, name), extra_values.get(name, []))
+    if standard is not None:
+        result.append(standard)
+    if not result:
+        raise Exception(f"No corpus values of {name} of {element}")
+    return list(dict.fromkeys(result))
+
+
+def inputs(element, combinations=200, random=500, seed=0):
+    '''
+    Inputs of the corpus of an element
+
+    Returns
+    -------
+    inputs : array (n, 2 + parameters)
+           columns p, etp and the parameters in the order of the registry
+    '''
+    rng = np.random.default_rng([seed, list(formulas.registry).index(element)])
+    names = list(formulas.registry[element]['params'])
+    grids = [values(element, name) for name in names]
+    climates = list(itertools.product(
+        [param_rages['P'][0], sum(param_rages['P'][:2])/2, param_rages['P'][1]],
+        [param_rages['ETp'][0], sum(param_rages['ETp'][:2])/2, param_rages['ETp'][1]]))
+
+    # all the combinations of the boundaries, or a sample of them plus the
+    # variations of one parameter at a time
+    total = int(np.prod([len(grid) for grid in grids]))
+    if total <= combinations:
+        combos = list(itertools.product(*grids))
+    else:
+        base = [grid[-1] for grid in grids]
+        combos = {tuple(base[:i] + [value] + base[i + 1:])
+                  for i, grid in enumerate(grids) for value in grid}
+        combos |= {tuple(grid[rng.integers(len(grid))] for grid in grids)
+                   for _ in range(combinations)}
+        combos = sorted(combos, key=lambda combo: [np.nan_to_num(x, nan=-1) for x in combo])
+    rows = [[p, etp, *combo] for p, etp in climates for combo in combos]
+
+    # random points inside the ranges
+    for _ in range(random):
+        row = [rng.uniform(*param_rages['P'][:2]), rng.uniform(*param_rages['ETp'][:2])]
+        for name, grid in zip(names, grids):
+            key = formulas.range_key(element, name)
+            if key is None:
+                row.append(grid[rng.integers(len(grid))])
+            else:
+                row.append(rng.uniform(*param_rages[key][:2]))
+        rows.append(row)
+    return np.array(rows, dtype=float).reshape(len(rows), 2 + len(names))
+
+
+def reference(element, inputs):
+    ''' a, g, v and e (n, 4) of the reference implementation'''
+    names = list(formulas.registry[element]['params'])
+    return np.array([formulas.evaluate_scalar(element, row[0], row[1],
+                                              **dict(zip(names, row[2:])))
+                      for row in inputs], dtype=float).reshape(len(inputs), 4)
+
+
+def build(file=path, **kwargs):
+    ''' computes the corpus and writes it to file (compressed .npz)'''
+    arrays = {}
+    for element in formulas.registry:
+        x = inputs(element, **kwargs)
+        arrays[f"{element}.inputs"] = x
+        arrays[f"{element}.outputs"] = reference(element, x)
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    np.savez_compressed(file, **arrays)
+    return load(file)
+
+
+def load(file=path):
+    '''
+    Reads the corpus
+
+    Returns
+    -------
+    corpus : dict
+           element and a tuple (inputs, outputs)
+    '''
+    with np.load(file) as data:
+        return {element: (data[f"{element}.inputs"], data[f"{element}.outputs"])
+                for element in formulas.registry if f"{element}.inputs" in data}
+
+#%% Comparison
+
+def ulps(x, y):
+    ''' distance in units in the last place between arrays of float64'''
+    x = np.asarray(x, dtype=np.float64).view(np.int64)
+    y = np.asarray(y, dtype=np.float64).view(np.int64)
+    # map the floats onto a monotonic integer scale
+    x = np.where(x < 0, np.iinfo(np.int64).min - x, x)
+    y = np.where(y < 0, np.iinfo(np.int64).min - y, y)
+    return np.abs(x.astype(np.float64) - y.astype(np.float64))
+
+
+def compare(engine, corpus=None, atol=1e-12, rtol=1e-12):
+    '''
+    Compares an engine with the corpus
+
+    Parameters
+    ----------
+    engine : function
+           evaluation function with the arguments of formulas.evaluate(),
+           e.g. formulas.evaluate, kernels.evaluate or Cache.engine()
+
+    corpus : dict
+           corpus of load() (default: golden/corpus.npz)
+
+    atol, rtol : float
+               tolerances; atol=rtol=0 requires exact reproduction
+
+    Returns
+    -------
+    report : DataFrame
+           per element and component: largest absolute and relative
+           difference, largest distance in ulps, number of values beyond the
+           tolerances (including NaN mismatches)
+    '''
+    corpus = load() if corpus is None else corpus
+    rows = []
+    for element, (x, expected) in corpus.items():
+        names = list(formulas.registry[element]['params'])
+        params = {name: x[:, 2 + i] for i, name in enumerate(names)}
+        results = np.column_stack([np.broadcast_to(np.asarray(r, dtype=float), (len(x),))
+                                   for r in engine(element, x[:, 0], x[:, 1], **params)])
+        for i, component in enumerate(formulas.components):
+            y, z = expected[:, i], results[:, i]
+            finite = np.isfinite(y) & np.isfinite(z)
+            difference = np.abs(y - z)[finite]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                relative = (difference/np.abs(y[finite]))
+            relative = relative[np.isfinite(relative)]
+            mismatched = (np.isnan(y) != np.isnan(z)) | (np.isinf(y) & (y != z))
+            beyond = difference > atol + rtol*np.abs(y[finite])
+            rows.append({'element': element, 'component': component, 'n': len(x),
+                         'max_abs': difference.max(initial=0),
+                         'max_rel': relative.max(initial=0),
+                         'max_ulps': ulps(y[finite], z[finite]).max(initial=0),
+                         'failures': int(beyond.sum() + mismatched.sum())})
+    return pd.DataFrame(rows)
+
+
+def engines():
+    ''' engines of the package compared by main()'''
+    import kernels
+
+    def scalar(element, p, etp, **params):
+        results = [formulas.evaluate_scalar(element, p[i], etp[i],
+                                            **{name: value[i] for name, value in params.items()})
+                   for i in range(len(p))]
+        return np.array(results, dtype=float).reshape(len(p), 4).T
+
+    def groups(element, p, etp, **params):
+        return formulas.evaluate_groups(np.full(len(p), element), p, etp, params)
+
+    return {'formulas.evaluate_scalar': scalar, 'formulas.evaluate': formulas.evaluate,
+            'formulas.evaluate_groups': groups, 'kernels.evaluate': kernels.evaluate,
+            'kernels.run': kernels.run}
+
+
+def main(atol=1e-12, rtol=1e-12):
+    corpus = load()
+    print(f"Corpus {path}: {sum(len(x) for x, _ in corpus.values())} inputs of"
+          f" {len(corpus)} elements")
+    passed = True
+    for name, engine in engines().items():
+        report = compare(engine, corpus, atol, rtol)
+        failures = int(report['failures'].sum())
+        passed = passed and failures == 0
+        print(f"{name:<28} max abs {report['max_abs'].max():.1e}"
+              f"  max rel {report['max_rel'].max():.1e}"
+              f"  max ulps {report['max_ulps'].max():.0f}"
+              f"  failures {failures}")
+        if failures:
+            print(report[report['failures'] > 0].to_string(index=False))
+    return passed
+
+
+if __name__ == '__main__':
+    if '--build' in sys.argv:
+        corpus = build()
+        print(f"Built {path}: {sum(len(x) for x, _ in corpus.values())} inputs")
+    elif '--exact' in sys.argv:
+        sys.exit(0 if main(0, 0) else 1)
+    else:
+        sys.exit(0 if main() else 1)
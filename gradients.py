@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Analytic partial derivatives of the partitioning factors a, g, v and e by
+P, ETp and the parameters of every element of the registry.
+
+The derivatives are derived from the terms of the formulas (forward mode):
+every factor of a term has a closed-form derivative, derived variables
+(e.g. FAsm of kf) are chained, and cases, zero_if and the closure of the
+balance are applied as in formulas.evaluate(). Inputs broadcast as in the
+forward pass.
+
+    da = gradient('green_roof', p, etp, h=h)['a']     # {'p': ..., 'h': ...}
+    compare()                                        # against finite differences
+"""
+
+import numpy as np
+import pandas as pd
+import formulas
+
+
+def _derivative(kind, x, c):
+    ''' derivative of a single factor of a term by its variable'''
+    if kind == 'linear':
+        return np.ones_like(x)
+    if kind == 'log':
+        return 1/(x + c)
+    if kind == 'log10':
+        return 1/((x + c)*np.log(10))
+    if kind == 'exp':
+        return -c/x**2*np.exp(c/x)
+    if kind == 'reciprocal':
+        return -1/(x + c)**2
+    return c*x**(c - 1)
+
+
+def partials(formula, values):
+    '''
+    Partial derivatives of a formula by its variables
+
+    Returns
+    -------
+    partials : dict
+             variable (p, etp, parameter or derived variable) and array
+    '''
+    _, terms = formula
+    result = {}
+    for coefficient, *factors in terms:
+        evaluated = [formulas._factor(kind, values[name], *(c or [0]))
+                     for kind, name, *c in factors]
+        for k, (kind, name, *c) in enumerate(factors):
+            derivative = coefficient*_derivative(kind, values[name], *(c or [0]))
+            for j, factor in enumerate(evaluated):
+                if j != k:
+                    derivative = derivative*factor
+            result[name] = result.get(name, 0) + derivative
+    return result
+
+
+def _chain(partials, tangents):
+    ''' derivatives by the inputs of a formula with the given partials'''
+    result = {}
+    for name, partial in partials.items():
+        for input_, tangent in tangents[name].items():
+            result[input_] = result.get(input_, 0) + partial*tangent
+    return result
+
+
+def _where(condition, x, y, names):
+    ''' np.where over dicts of derivatives'''
+    return {name: np.where(condition, x.get(name, 0.0), y.get(name, 0.0))
+            for name in names}
+
+
+def gradient(element, p, etp, **params):
+    '''
+    Partial derivatives of the partitioning factors of an element
+
+    Parameters
+    ----------
+    element : string
+            name of the element in the registry (method of StudyArea)
+
+    p, etp, params :
+                   inputs as for formulas.evaluate()
+
+    Notes
+    ------
+    Derivatives are taken by the values used: missing parameters by their
+    standard values and derived parameters that are given (e.g. fasm) by
+    themselves, otherwise through the variables they are derived from.
+    Where a factor is clipped (e.g. g = max(1 - (a + v), 0) at 0) or a case
+    ends, the derivative is that of the active side; inputs not covered by
+    any case give NaN, as in evaluate().
+
+    Returns
+    -------
+    gradient : dict
+             component (a, g, v, e) and a dict of the inputs (p, etp and
+             the parameters) and the arrays of the partial derivatives
+    '''
+    spec = formulas.registry[element]
+    values = formulas.variables(element, p, etp, **params)
+    inputs = ['p', 'etp', *spec['params']]
+    shape = np.broadcast_shapes(*(np.shape(x) for x in values.values()))
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        tangents = {name: {name: 1.0} for name in inputs}
+        for name, formula, rule in spec.get('derived', ()):
+            derived = _chain(partials(formula, values), tangents)
+            if rule == 'standard' and params.get(name) is not None:
+                given = ~np.isnan(np.asarray(params[name], dtype=float))
+                derived = _where(given, {name: 1.0}, derived, inputs)
+            elif rule == 'min_p':
+                bound = values['p'] <= formulas._numpy_kernel(formula, values)
+                derived = _where(bound, {'p': 1.0}, derived, inputs)
+            tangents[name] = derived
+
+        def derivatives(formula):
+            return _chain(partials(formula, values), tangents)
+
+        results = {}
+        if 'cases' in spec:
+            for component in formulas.components:
+                results[component] = {name: np.nan for name in inputs}
+            for (name, low, high), case in spec['cases']:
+                where = (values[name] >= low) & (values[name] <= high)
+                for component in formulas.components:
+                    active = derivatives(case[component]) if component in case else {}
+                    results[component] = _where(where, active, results[component],
+                                                inputs)
+        else:
+            for component in formulas.components:
+                results[component] = (derivatives(spec[component])
+                                      if component in spec else {})
+
+        for component, name in spec.get('zero_if', {}).items():
+            results[component] = _where(values[name] == 0, {}, results[component],
+                                        inputs)
+
+        if 'closure' in spec:
+            component, clip = spec['closure']
+            closed = {name: -sum(results[other].get(name, 0.0)
+                                 for other in formulas.components if other != component)
+                      for name in inputs}
+            if clip:
+                value = 1 - sum(formulas.evaluate(element, p, etp, **params)[i]
+                                for i, other in enumerate(formulas.components)
+                                if other != component)
+                closed = _where(value > 0, closed, {}, inputs)
+            results[component] = closed
+
+    return {component: {name: np.broadcast_to(
+                            np.asarray(results[component].get(name, 0.0), dtype=float), shape)
+                        for name in inputs}
+            for component in formulas.components}
+
+
+def compare(corpus=None, step=1e-6, rtol=1e-5, atol=1e-8):
+    '''
+    Compares the analytic derivatives with central finite differences at
+    the inputs of the golden corpus (golden.py)
+
+    Parameters
+    ----------
+    corpus : dict
+           corpus of golden.load() (default: golden/corpus.npz)
+
+    step : float
+         relative step of the finite differences
+
+    rtol, atol : float
+               tolerances of the differences: relative to the largest
+               derivative of the component, and absolute (rounding errors
+               of the finite differences)
+
+    Notes
+    ------
+    Points at which the forward and backward differences disagree (kinks:
+    ends of cases, clipping, joint ratios) and inputs that are discrete
+    (vegetated) are skipped.
+
+    Returns
+    -------
+    report : DataFrame
+           per element, component and input: number of points compared and
+           skipped, largest absolute and relative difference and the
+           number of differences beyond the tolerances
+    '''
+    import golden
+
+    corpus = golden.load() if corpus is None else corpus
+    rows = []
+    for element, (x, _) in corpus.items():
+        names = list(formulas.registry[element]['params'])
+        inputs = ['p', 'etp', *names]
+        columns = {name: x[:, i] for i, name in enumerate(inputs)}
+
+        def evaluate(columns):
+            return np.stack(formulas.evaluate(element, columns['p'], columns['etp'],
+                                              **{name: columns[name] for name in names}))
+
+        analytic = gradient(element, columns['p'], columns['etp'],
+                            **{name: columns[name] for name in names})
+        base = evaluate(columns)
+        for i, name in enumerate(inputs):
+            if name == 'vegetated':
+                continue
+            h = step*np.maximum(np.abs(columns[name]), 1)
+            with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                up = evaluate({**columns, name: columns[name] + h})
+                down = evaluate({**columns, name: columns[name] - h})
+                forward, backward = (up - base)/h, (base - down)/h
+                central = (up - down)/(2*h)
+            for j, component in enumerate(formulas.components):
+                exact = analytic[component][name]
+                scale = max(np.nanmax(np.abs(exact), initial=0), 1e-12)
+                smooth = (np.isfinite(central[j]) & np.isfinite(exact)
+                          & (np.abs(forward[j] - backward[j]) <= 1e-3*scale + 1e-8))
+                difference = np.abs(exact - central[j])[smooth]
+                rows.append({'element': element, 'component': component, 'input': name,
+                             'points': int(smooth.sum()),
+                             'skipped': int((~smooth).sum()),
+                             'max_abs': difference.max(initial=0),
+                             'max_rel': difference.max(initial=0)/scale,
+                             'failures': int((difference > rtol*scale + atol).sum())})
+    return pd.DataFrame(rows)
@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""
+Fused kernels of the regression equations of the DWA-A102 guideline.
+
+The elements of the registry (formulas.py) have kernels that compute a, g,
+v and e row by row in a single loop, without the temporary arrays created by
+the NumPy evaluation; elements added to the registry without a kernel are
+evaluated with formula_kernel, formula by formula. With numba installed the kernels are compiled with
+@njit(parallel=True); without numba evaluate() falls back to
+formulas.evaluate(), and the kernels still run as (slow) plain Python, which
+is what equivalence() uses to compare both implementations anywhere.
+formula_kernel() is the generic compiled kernel used by formulas.py.
+"""
+
+import math
+import numpy as np
+import formulas
+
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+    _jit = njit(parallel=True, cache=True)
+except ImportError:
+    HAVE_NUMBA = False
+    prange = range
+
+    def _jit(function):
+        return function
+
+#%% Surfaces
+
+@_jit
+def garden(p, etp, a, g, v, out):
+    for i in prange(p.shape[0]):
+        out[0, i] = a[i]
+        out[1, i] = g[i]
+        out[2, i] = v[i]
+        out[3, i] = 0.0
+
+
+@_jit
+def roof(p, etp, sp, out):
+    for i in prange(p.shape[0]):
+        a = 0.9115 + 0.00007063*p[i] - 0.000007498*etp[i] - 0.2063*math.log(sp[i] + 1)
+        out[0, i] = a
+        out[1, i] = 0.0
+        out[2, i] = 1 - a
+        out[3, i] = 0.0
+
+
+@_jit
+def flat_area(p, etp, sp, out):
+    for i in prange(p.shape[0]):
+        a = 0.8658 + 0.0001659*p[i] - 0.00009945*etp[i] - 0.1542*math.log(sp[i] + 1)
+        out[0, i] = a
+        out[1, i] = 0.0
+        out[2, i] = 1 - a
+        out[3, i] = 0.0
+
+
+@_jit
+def green_roof(p, etp, h, kf, wkmax_wp, out):
+    for i in prange(p.shape[0]):
+        # ln(wkmax_wp*h) = ln(wkmax_wp) + ln(h), as in the registry
+        a = (-2.182 + 0.4293*math.log(p[i]) - 0.0001092*p[i] + (236.1/etp[i])
+             + 0.0001142*h[i] + 0.0002297*kf[i] + 0.01628*math.log(wkmax_wp[i])
+             - 0.1214*math.log(wkmax_wp[i]) - 0.1214*math.log(h[i]))
+        out[0, i] = a
+        out[1, i] = 0.0
+        out[2, i] = 1 - a
+        out[3, i] = 0.0
+
+
+@_jit
+def storage_roof(p, etp, sp, out):
+    for i in prange(p.shape[0]):
+        a = 0.9231 + 0.000254*p[i] - 0.0003226*etp[i] - 0.1472*math.log(sp[i] + 1)
+        out[0, i] = a
+        out[1, i] = 0.0
+        out[2, i] = 1 - a
+        out[3, i] = 0.0
+
+
+@_jit
+def permeable_surface(p, etp, fa, kf, sp, wkmax_wp, out):
+    for i in prange(p.shape[0]):
+        if fa[i] >= 2 and fa[i] <= 5:
+            a = (0.0800734*math.log(p[i]) - 0.0582828*fa[i] - 0.0501693*sp[i]
+                 - 0.385767*wkmax_wp[i] + (8.7040284/(11.9086896 + kf[i])))
+            v = (0.8529 - 0.1248*math.log(p[i]) + 0.00005057*etp[i]
+                 + 0.002372*fa[i] + 0.1583*math.log(1 + sp[i]))
+            e = 0.0
+        elif fa[i] >= 6 and fa[i] <= 10:
+            a = (0.05912*math.log(p[i]) - 0.02749*fa[i] - 0.03671*sp[i]
+                 - 0.30514*wkmax_wp[i] + (4.97687/(4.7975 + kf[i])))
+            v = (0.9012 - 0.1325*math.log(p[i]) + 0.00006661*etp[i]
+                 + 0.002302*fa[i] + 0.1489*math.log(1 + sp[i]))
+            e = 0.0
+        else:
+            a = v = e = np.nan
+        out[0, i] = a
+        out[1, i] = 1 - a - v - e
+        out[2, i] = v
+        out[3, i] = e
+
+
+@_jit
+def porous_surface(p, etp, sp, h, kf, out):
+    for i in prange(p.shape[0]):
+        a = (0.000001969*p[i] - 0.005116*math.log(sp[i]) - 0.0001051*h[i]
+             + 0.01753*math.exp(4.576/kf[i]))
+        v = (0.2111 - 0.2544*math.log(p[i]) + 0.2073*math.log(etp[i])
+             + 0.0006249*sp[i] + 0.123*math.log(h[i]) - 0.000002806*kf[i])
+        out[0, i] = a
+        out[1, i] = max(1 - (a + v), 0.0)
+        out[2, i] = v
+        out[3, i] = 0.0
+
+
+@_jit
+def paver_stonegrid(p, etp, fa, sp, wkmax_wp, out):
+    for i in prange(p.shape[0]):
+        a = (0.145704 - 0.059177*math.log(fa[i]) - 0.007354*sp[i]
+             - 0.050531*math.log(wkmax_wp[i]))
+        v = (1.106 - 0.1625*math.log(p[i]) + 0.0001282*etp[i]
+             + 0.1131*math.log(1 + sp[i]) + 0.2848*wkmax_wp[i])
+        out[0, i] = a
+        out[1, i] = max(1 - (a + v), 0.0)
+        out[2, i] = v
+        out[3, i] = 0.0
+
+
+@_jit
+def gravel_cover(p, etp, h, sp, kf, out):
+    for i in prange(p.shape[0]):
+        a = 0.00004517*p[i] - 0.03454*math.log(sp[i]) + (0.1958/(0.2873 + kf[i]))
+        v = (0.2111 - 0.2544*math.log(p[i]) + 0.2073*math.log(etp[i])
+             + 0.0006249*sp[i] + 0.123*math.log(h[i]) - 0.000002806*kf[i])
+        out[0, i] = a
+        out[1, i] = max(1 - (a + v), 0.0)
+        out[2, i] = v
+        out[3, i] = 0.0
+
+#%% Measures
+
+@_jit
+def drainage(p, etp, vegetated, out):
+    for i in prange(p.shape[0]):
+        out[0, i] = 1 - 0.3*vegetated[i]
+        out[1, i] = 0.1*vegetated[i]
+        out[2, i] = 0.2*vegetated[i]
+        out[3, i] = 0.0
+
+
+@_jit
+def surf_infiltration(p, etp, kf, fasf, out):
+    for i in prange(p.shape[0]):
+        fasf_i = fasf[i]
+        if math.isnan(fasf_i):
+            fasf_i = 94741*kf[i]**(-1.195)
+        a = 0.004264 + 0.001121*math.log(p[i]) - 0.002757*math.log(fasf_i)
+        v = (0.3999 - 0.09317*math.log(p[i]) + 0.00009746*etp[i]
+             + 0.07474*math.log(fasf_i))
+        out[0, i] = a
+        out[1, i] = max(1 - (a + v), 0.0)
+        out[2, i] = v
+        out[3, i] = 0.0
+
+
+@_jit
+def infilt_swale(p, etp, kf, fasm, out):
+    for i in prange(p.shape[0]):
+        fasm_i = fasm[i]
+        if math.isnan(fasm_i):
+            fasm_i = 42.323*kf[i]**(-0.314)
+        g = (0.8608 + 0.02385*math.log(p[i]) - 0.00005331*etp[i] - 0.002827*fasm_i
+             - 0.000002493*kf[i] + 0.0009514*math.log(kf[i]/fasm_i))
+        v = (0.000008562*etp[i] + (2.611/(p[i] - 64.35))*fasm_i**0.9425
+             - 0.000001211*kf[i])
+        out[0, i] = max(1 - (g + v), 0.0)
+        out[1, i] = g
+        out[2, i] = v
+        out[3, i] = 0.0
+
+
+@_jit
+def swale_trench(p, etp, kf, fasm, out):
+    for i in prange(p.shape[0]):
+        fasm_i = fasm[i]
+        if math.isnan(fasm_i):
+            fasm_i = 21.86*kf[i]**(-0.348)
+        a = (-0.03867 + 0.007684*math.log(p[i]) + 0.000003201*fasm_i
+             + 0.0002564*kf[i] - 0.0001187*fasm_i*kf[i]
+             + 0.004161*math.log(kf[i]/fasm_i))
+        v = (0.000008879*etp[i] + (2.528/(p[i] - 81.65))*fasm_i**0.9496
+             - 0.00007768*kf[i])
+        out[0, i] = a
+        out[1, i] = max(1 - (a + v), 0.0)
+        out[2, i] = v
+        out[3, i] = 0.0
+
+
+@_jit
+def swale_trench_system(p, etp, qdr, kf, fasm, out):
+    for i in prange(p.shape[0]):
+        fasm_i = fasm[i]
+        if math.isnan(fasm_i):
+            fasm_i = 11.79 - 3.14*math.log(qdr[i]) - 0.18594*kf[i]
+        a = (0.8112 + 0.0003473*p[i] - 0.00001845*etp[i] - 0.04793*fasm_i
+             + 0.0007481*qdr[i] - 0.4389*math.log(kf[i] + 1))
+        v = (0.1428 - 0.02661*math.log(p[i]) + 0.00005668*etp[i]
+             + 0.0288*math.log(fasm_i) - 0.0001825*qdr[i]
+             - 0.01823*math.log(kf[i] + 1))
+        out[0, i] = a
+        out[1, i] = max(1 - (a + v), 0.0)
+        out[2, i] = v
+        out[3, i] = 0.0
+
+
+@_jit
+def rainwater_usage(p, etp, vsp, vbr, fabw, qbw, out):
+    for i in prange(p.shape[0]):
+        vbw = fabw[i]*qbw[i]
+        vnmin = min(p[i], 365*vbr[i] + vbw)
+        if vbw == 0:
+            v = 0.0
+        else:
+            v = (- 0.0001927*p[i] + 0.0001831*etp[i] + 0.0006083*vbw
+                 - 0.0000003127*vbw**2 - 0.3092*math.exp(3.269/vsp[i])
+                 + (1.424/(2.782 + vbr[i])) + 0.0001885*vnmin)
+        if vbr[i] == 0:
+            e = 0.0
+        else:
+            e = (0.4451 - 0.0003529*p[i] - 0.00007728*etp[i]
+                 + 0.06821*math.log10(vsp[i]) - 0.0002507*vbw
+                 + 0.2349*math.log10(vbr[i]) + 0.0001738*vnmin)
+        out[0, i] = max(1 - (v + e), 0.0)
+        out[1, i] = 0.0
+        out[2, i] = v
+        out[3, i] = e
+
+
+@_jit
+def pod_system(p, etp, aw, A_1, a_1, A_2, a_2, A_3, a_3, A_4, a_4, out):
+    for i in prange(p.shape[0]):
+        v = ((etp[i]*aw[i])/(p[i]*(aw[i] + A_1[i]*a_1[i] + A_2[i]*a_2[i]
+                                   + A_3[i]*a_3[i] + A_4[i]*a_4[i])))
+        out[0, i] = 1 - v
+        out[1, i] = 0.0
+        out[2, i] = v
+        out[3, i] = 0.0
+
+#%% Generic kernel of the registry
+
+@_jit
+def formula_kernel(intercept, coefficients, kinds, index, constants, x, out):
+    '''
+    Evaluates a formula translated by formulas.compile_formula() for every
+    column of x (one row per variable)
+    '''
+    for i in prange(x.shape[1]):
+        result = intercept
+        for t in range(coefficients.shape[0]):
+            term = coefficients[t]
+            for f in range(kinds.shape[1]):
+                if index[t, f] < 0:
+                    continue
+                value = x[index[t, f], i]
+                c = constants[t, f]
+                kind = kinds[t, f]
+                if kind == 0:
+                    term *= value
+                elif kind == 1:
+                    term *= np.log(value + c)
+                elif kind == 2:
+                    term *= np.log10(value + c)
+                elif kind == 3:
+                    term *= np.exp(c/value)
+                elif kind == 4:
+                    term *= 1/(value + c)
+                else:
+                    term *= value**c
+            result += term
+        out[i] = result
+
+#%% Evaluation
+
+# hand-written kernels; elements of the registry without one (e.g. added
+# later) are evaluated formula by formula with formula_kernel
+kernels = {name: globals()[name] for name in
+           ['garden', 'roof', 'flat_area', 'green_roof', 'storage_roof',
+            'permeable_surface', 'porous_surface', 'paver_stonegrid', 'gravel_cover',
+            'drainage', 'surf_infiltration', 'infilt_swale', 'swale_trench',
+            'swale_trench_system', 'rainwater_usage', 'pod_system']}
+
+
+def _arguments(element, p, etp, params):
+    '''
+    Inputs of the kernel of an element: p, etp and the parameters in the
+    order of the registry, broadcast to one dimension. Missing values are
+    replaced by the standard values, except for the parameters with a
+    standard formula (FAsf, FAsm), which the kernels compute themselves.
+    '''
+    spec = formulas.registry[element]
+    computed = [name for name, _, rule in spec.get('derived', ()) if rule == 'standard']
+    unknown = set(params) - set(spec['params'])
+    if unknown:
+        raise Exception(f"Unknown parameters of {element}: {', '.join(sorted(unknown))}")
+    values = [p, etp]
+    for name, standard in spec['params'].items():
+        value = params.get(name)
+        if standard is None or name in computed:
+            values.append(np.nan if value is None else value)
+        else:
+            values.append(formulas._fill(value, standard))
+    values = np.broadcast_arrays(*(np.asarray(x, dtype=np.float64) for x in values))
+    shape = values[0].shape
+    return [np.ascontiguousarray(x).ravel() for x in values], shape
+
+
+def run(element, p, etp, **params):
+    '''
+    Runs the kernel of an element (compiled with numba, if installed) and
+    returns a, g, v and e with the broadcast shape of the inputs. Elements
+    without a hand-written kernel are evaluated with formulas.evaluate(),
+    which runs formula_kernel on every formula when numba is installed.
+    '''
+    if element not in kernels:
+        return formulas.evaluate(element, p, etp, **params)
+    arguments, shape = _arguments(element, p, etp, params)
+    out = np.empty((4, arguments[0].shape[0]))
+    kernels[element](*arguments, out)
+    return tuple(x.reshape(shape) for x in out)
+
+
+def evaluate(element, p, etp, **params):
+    '''
+    Evaluates the partitioning factors of an element with its fused kernel
+    when numba is installed, otherwise with formulas.evaluate(). Arguments
+    and results as in formulas.evaluate().
+    '''
+    if not HAVE_NUMBA:
+        return formulas.evaluate(element, p, etp, **params)
+    return run(element, p, etp, **params)
+
+
+def equivalence(n=1000, seed=0):
+    '''
+    Compares the kernels with formulas.evaluate() for random climates and
+    parameters within the ranges of validity (param_rages)
+
+    Returns
+    -------
+    results : dict
+            maximum absolute difference of a, g, v and e per element
+    '''
+    from check_ranges import param_rages
+
+    rng = np.random.default_rng(seed)
+    p = rng.uniform(*param_rages['P'][:2], n)
+    etp = rng.uniform(*param_rages['ETp'][:2], n)
+    params = {
+        'garden': {'a': rng.uniform(0, 0.5, n), 'g': rng.uniform(0, 0.5, n)},
+        'permeable_surface': {'fa': rng.choice([2, 3.5, 5, 5.5, 6, 8, 10], n),
+                              'kf': rng.uniform(6, 100, n),
+                              'sp': rng.uniform(0.1, 2, n),
+                              'wkmax_wp': rng.uniform(0.1, 0.2, n)},
+        'drainage': {'vegetated': rng.integers(0, 2, n)},
+        'surf_infiltration': {'fasf': np.where(rng.random(n) < 0.5, np.nan,
+                                               rng.uniform(5, 30, n))},
+        'infilt_swale': {'fasm': np.where(rng.random(n) < 0.5, np.nan,
+                                          rng.uniform(5, 30, n))},
+        'rainwater_usage': {'vbr': rng.choice([0, 0.5, 2, 5], n),
+                            'fabw': rng.choice([0, 1, 2, 5], n)},
+        'pod_system': {'aw': rng.uniform(10, 500, n),
+                       'A_1': rng.uniform(100, 5000, n),
+                       'A_2': rng.uniform(0, 5000, n)},
+        }
+    results = {}
+    for element, spec in formulas.registry.items():
+        values = dict(params.get(element, {}))
+        for name, key in spec.get('checks', {}).items():
+            if name not in values and key in param_rages and name not in ('p', 'etp'):
+                values[name] = rng.uniform(*param_rages[key][:2], n)
+        reference = formulas.evaluate(element, p, etp, **values)
+        fused = run(element, p, etp, **values)
+        results[element] = max(float(np.nanmax(np.abs(x - y), initial=0))
+                               for x, y in zip(reference, fused))
+        if any((np.isnan(x) != np.isnan(y)).any() for x, y in zip(reference, fused)):
+            results[element] = np.inf
+    return results
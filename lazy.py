@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy imports of heavy dependencies (pandas, NumPy).
+
+lazy_import() returns a stand-in for a module that imports it on the first
+access to one of its attributes, so importing dwa_a102 for scalar
+calculations does not pay for the import of pandas and NumPy. Nothing is put
+into sys.modules before the module is imported for real, and the first
+import is guarded by a lock, so threads that share a context can all use it
+at once.
+"""
+
+import importlib
+import importlib.util
+import sys
+import threading
+
+
+class LazyModule:
+    ''' module that is imported on the first access to one of its attributes'''
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+                module = self._module
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_import(name):
+    ''' the module if it is already imported, otherwise a LazyModule'''
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name) is None:
+        raise ImportError(f"No module named {name!r}")
+    return LazyModule(name)
+
+
+def loaded(name):
+    ''' True if a module has been imported'''
+    return name in sys.modules
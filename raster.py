@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Water balance of land-cover rasters.
+
+Every land-cover class is mapped to a method of Surface and its parameters,
+e.g. {1: ('roof', {}), 2: ('green_roof', {'h': 100}), 3: ('garden', {})}.
+The partitioning factors of each class are evaluated once and applied to
+the grid tile by tile (blocks of rows) through lookup tables. Grids are read
+and written as memory-mapped .npy files, so grids of 10^9 cells are
+processed without loading them into memory.
+
+    grids, summary = balance_grid(StudyArea(location='Berlin'), 'landcover.npy',
+                                  classes, cell_area=100, out='balance')
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import formulas
+
+# output grids and their partitioning factor
+grids = {'runoff': 'a', 'recharge': 'g', 'evaporation': 'v', 'usage': 'e'}
+
+
+def class_factors(study_area, classes):
+    '''
+    Partitioning factors of the land-cover classes
+
+    Parameters
+    ----------
+    study_area : StudyArea
+               climate (P, ETp)
+
+    classes : dict
+            class code (int) and a tuple (name of the method of Surface,
+            dict of parameters)
+
+    Returns
+    -------
+    factors : DataFrame
+            Element, a, g, v and e, indexed by class code
+    '''
+    rows = {}
+    for code, (element, params) in classes.items():
+        if element not in formulas.surfaces:
+            raise Exception(f"Unknown surface of class {code}: {element}")
+        formulas.check(element, study_area.p, study_area.etp, **params)
+        a, g, v, e = formulas.evaluate_scalar(element, study_area.p, study_area.etp,
+                                              **params)
+        if np.isnan(a):
+            raise Exception(f"No regression equation of {element} covers the"
+                            f" parameters of class {code}")
+        rows[code] = {'Element': formulas.registry[element]['label'],
+                      'a': a, 'g': g, 'v': v, 'e': e}
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+def _open(grid):
+    ''' memory-mapped grid of a .npy file, or the given array'''
+    if isinstance(grid, str):
+        return np.load(grid, mmap_mode='r')
+    return grid
+
+
+def _tiles(shape, tile_cells):
+    '''
+    slices of the blocks of rows of a grid with about tile_cells cells
+    (cells of a 1-D grid)
+    '''
+    rows = max(1, tile_cells//max(1, int(np.prod(shape[1:]))))
+    for start in range(0, shape[0], rows):
+        yield slice(start, min(start + rows, shape[0]))
+
+
+def _fill(grid, outputs, tables, mapped, nodata, tile_cells):
+    ''' fills the output grids tile by tile and counts the cells per class'''
+    size = len(mapped)
+    counts = np.zeros(size, dtype=np.int64)
+    for rows in _tiles(grid.shape, tile_cells):
+        tile = np.asarray(grid[rows])
+        missing = None if nodata is None else tile == nodata
+        values = tile if missing is None else tile[~missing]
+        if values.size and (values.min() < 0 or values.max() >= size):
+            invalid = np.unique(values[(values < 0) | (values >= size)])
+            raise Exception(f"Classes without surface: {', '.join(map(str, invalid[:10]))}")
+        tile_counts = np.bincount(values.ravel(), minlength=size)
+        if (tile_counts[~mapped] > 0).any():
+            invalid = np.flatnonzero((tile_counts > 0) & ~mapped)
+            raise Exception(f"Classes without surface: {', '.join(map(str, invalid[:10]))}")
+        counts += tile_counts
+        if missing is not None:
+            tile = np.where(missing, 0, tile)
+        for name, table in tables.items():
+            outputs[name][rows] = table[tile]
+            if missing is not None:
+                outputs[name][rows][missing] = np.nan
+    return counts
+
+
+def balance_grid(study_area, grid, classes, cell_area, out=None, nodata=None,
+                 tile_cells=2**22, dtype=np.float32):
+    '''
+    Calculates runoff, groundwater recharge, evapotranspiration and usage
+    grids of a land-cover grid
+
+    Parameters
+    ----------
+    study_area : StudyArea
+               climate (P, ETp) of the grid
+
+    grid : string or array
+         land-cover classes (integers), a .npy file (memory-mapped) or an
+         array (e.g. np.memmap of a raw file)
+
+    classes : dict
+            class code and (method of Surface, parameters), see
+            class_factors()
+
+    cell_area : float
+              area of a cell (m2)
+
+    out : string
+        prefix of the output files (out_runoff.npy, ...), written as
+        memory-mapped .npy files (to temporary files that replace them when
+        the grid is complete). Without out the grids are kept in memory.
+
+    nodata : int
+           class code of cells without data (e.g. -9999), NaN in the outputs
+           and not counted in the summary
+
+    tile_cells : int
+               cells of the grid processed at a time (whole rows of 2-D
+               grids)
+
+    Notes
+    ------
+    The output grids are the components of the water balance in mm/a
+    (P*a, P*g, P*v and P*e); the volume of a cell is its value times
+    cell_area/1000. Cells of classes that are neither in classes nor
+    nodata raise an Exception.
+
+    Returns
+    -------
+    grids : dict
+          runoff, recharge, evaporation and usage grids
+
+    summary : DataFrame
+            one row per class (index: class code) and a row System, with the
+            columns of watbal: Element, Area, a, g, v, e, Vp, Va, Vg, Vv, Ve
+    '''
+    grid = _open(grid)
+    if not np.issubdtype(grid.dtype, np.integer):
+        raise Exception(f"Land-cover grids must be integers, not {grid.dtype}")
+    negative = [code for code in classes if code < 0]
+    if negative:
+        raise Exception(f"Class codes must not be negative: {', '.join(map(str, negative))}")
+    factors = class_factors(study_area, classes)
+
+    # lookup tables of the depths (mm/a) by class code; nodata (which may be
+    # negative, e.g. -9999) is masked before the lookup and is not in them
+    size = max(classes) + 1
+    mapped = np.zeros(size, dtype=bool)
+    mapped[list(classes)] = True
+    tables = {}
+    for name, component in grids.items():
+        table = np.full(size, np.nan, dtype=dtype)
+        table[factors.index.to_numpy()] = study_area.p*factors[component].to_numpy()
+        tables[name] = table
+
+    outputs = {}
+    for name in grids:
+        if out is None:
+            outputs[name] = np.empty(grid.shape, dtype=dtype)
+        else:
+            outputs[name] = np.lib.format.open_memmap(f"{out}_{name}.npy.tmp", mode='w+',
+                                                      dtype=dtype, shape=grid.shape)
+    try:
+        counts = _fill(grid, outputs, tables, mapped, nodata, tile_cells)
+    except BaseException:
+        if out is not None:
+            outputs.clear()
+            for name in grids:
+                os.remove(f"{out}_{name}.npy.tmp")
+        raise
+    if out is not None:
+        # complete grids replace the outputs (atomically, as in chunked.py)
+        for name in grids:
+            outputs[name].flush()
+            del outputs[name]
+            os.replace(f"{out}_{name}.npy.tmp", f"{out}_{name}.npy")
+            outputs[name] = np.load(f"{out}_{name}.npy", mmap_mode='r+')
+
+    # watbal of the classes
+    summary = factors.copy()
+    summary.insert(1, 'Area', counts[factors.index.to_numpy()]*float(cell_area))
+    summary['Vp'] = summary['Area']*study_area.p/1000
+    for volume, component in (('Va', 'a'), ('Vg', 'g'), ('Vv', 'v'), ('Ve', 'e')):
+        summary[volume] = summary['Vp']*summary[component]
+    total = summary[['Area', 'Vp', 'Va', 'Vg', 'Vv', 'Ve']].sum()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        system = {'Element': 'System', 'Area': total['Area'],
+                  'a': total['Va']/total['Vp'], 'g': total['Vg']/total['Vp'],
+                  'v': total['Vv']/total['Vp'], 'e': total['Ve']/total['Vp'],
+                  'Vp': total['Vp'], 'Va': total['Va'], 'Vg': total['Vg'],
+                  'Vv': total['Vv'], 'Ve': total['Ve']}
+    summary.loc['System'] = system
+    return outputs, summary
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Evaluation of a fixed design of surfaces and measures under many climates,
+e.g. the members of an ensemble of climate projections.
+"""
+
+import numpy as np
+import pandas as pd
+import formulas
+from check_ranges import validRange, validRanges
+
+columns = ['Element', 'Area', 'Au', 'P', 'Etp', 'a', 'g', 'v', 'e',
+           'Vp', 'Va', 'Vg', 'Vv', 'Ve']
+
+
+def _params(element):
+    ''' parameters of an element of a design, as used by the registry'''
+    kind = element['element']
+    params = {name: value for name, value in element.items()
+              if name in formulas.registry[kind]['params']}
+    if kind == 'drainage' and 'drainage_type' in element:
+        params['vegetated'] = int(formulas.drainage_type(element['drainage_type']))
+    return params
+
+
+def _check_design(design):
+    ''' validates the parameters of every element of a design'''
+    for i, element in enumerate(design):
+        kind = element['element']
+        if kind not in formulas.registry:
+            raise Exception(f"Unknown element type: {kind}")
+        if kind in formulas.surfaces and 'area' not in element:
+            raise Exception(f"Surface {i} ({kind}) requires an area")
+        for inflow in element.get('inflow', ()):
+            if not 0 <= inflow < i:
+                raise Exception(f"Element {i} ({kind}) can only receive runoff"
+                                f" from a previous element, not from {inflow}")
+        params = _params(element)
+        for name, standard in formulas.defaults(kind).items():
+            if standard is None and not formulas._derived(kind, name) and (
+                    params.get(name) is None or np.isnan(params[name])):
+                raise Exception(f"Parameter {name} is required for {kind}"
+                                f" (element {i})")
+        formulas.check(kind, **params)
+
+
+def _coefficients(design, p, etp, cache=None):
+    '''
+    Evaluates a, g, v and e of all the elements of a design. Elements of the
+    same type are evaluated in one call: their parameters form a column
+    (k, 1) and the climate a row (1, n), so the parameter terms of each
+    regression are computed once per element and only the climate terms
+    once per climate. With a cache (cache.Cache) only the results that are
+    not cached are evaluated.
+    '''
+    evaluate = cache.engine() if cache is not None else formulas.evaluate
+    coefficients = np.empty((4, len(design), len(p)))
+    groups = {}
+    for i, element in enumerate(design):
+        groups.setdefault(element['element'], []).append(i)
+
+    for kind, index in groups.items():
+        elements = [_params(design[i]) for i in index]
+        params = {}
+        for name in formulas.registry[kind]['params']:
+            values = [element.get(name) for element in elements]
+            if all(value is None for value in values):
+                continue
+            params[name] = np.array([[np.nan if value is None else value]
+                                     for value in values], dtype=float)
+        coefficients[:, index] = evaluate(kind, p[None, :], etp[None, :], **params)
+    return coefficients
+
+
+def evaluate_scenarios(climates, design, scenario='scenario', year='year',
+                       p='P', etp='ETp', cache=None):
+    '''
+    Evaluates a fixed design of surfaces and measures for every row of a
+    table of climates (e.g. scenario and year of climate projections)
+
+    Parameters
+    ----------
+    climates : DataFrame
+             one row per climate, with the columns given by scenario, year,
+             p (precipitation, mm/a) and etp (potential evapotranspiration,
+             mm/a)
+
+    design : list of dict
+           one dict per element. The key 'element' gives the name of the
+           method of StudyArea (e.g. 'roof', 'infilt_swale'), the other keys
+           its parameters (for drainages the key 'drainage_type' or
+           'vegetated'). Surfaces require the key 'area' (m2). Measures take
+           the key 'inflow', a list with the positions in the design of the
+           elements that drain into them. The optional key 'name' replaces
+           the label of the element in the results.
+
+    cache : Cache
+          optional cache of results (cache.py), e.g. for nightly runs in
+          which most climates and elements did not change
+
+    Notes
+    ------
+    Every element keeps its parameters for all climates, only the climate
+    dependent terms of the regressions are evaluated per row. Results are
+    not rounded. The runoff volume Va of an element that drains into a
+    measure is passed to the measure and set to 0, as in the methods of
+    Measure.
+
+    Returns
+    -------
+    results : DataFrame
+            one row per element and climate, plus a row 'System' with the
+            water balance of the design (see watbal) for every climate
+    '''
+    _check_design(design)
+    p_ = climates[p].to_numpy(dtype=float)
+    etp_ = climates[etp].to_numpy(dtype=float)
+    validRanges(p_, 'P')
+    validRanges(etp_, 'ETp')
+
+    n, k = len(climates), len(design)
+    a, g, v, e = _coefficients(design, p_, etp_, cache)
+    area = np.zeros((k, n))
+    au = np.zeros((k, n))
+    volumes = np.zeros((5, k, n))
+    routed = {}
+    for i, element in enumerate(design):
+        inflows = element.get('inflow', ())
+        if element['element'] in formulas.surfaces:
+            area[i] = element['area']
+            au[i] = area[i]*a[i]
+            va = 0
+        else:
+            for j in inflows:
+                if j in routed:
+                    raise Exception(f"Element {j} already drains into element"
+                                    f" {routed[j]}")
+                routed[j] = i
+            au[i] = au[list(inflows)].sum(axis=0)
+            va = volumes[1, list(inflows)].sum(axis=0)
+            area[i] = au[i]*formulas.area_share(element['element'], p_, etp_,
+                                                **_params(element))
+        vp = area[i]*p_/1000
+        volumes[:, i] = vp, (vp + va)*a[i], (vp + va)*g[i], (vp + va)*v[i], (vp + va)*e[i]
+    # Runoff volume are passed to measures, Va = 0
+    volumes[1, list(routed)] = 0
+
+    vp, va, vg, vv, ve = volumes.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        system = {'Area': area.sum(axis=0), 'Au': np.full(n, np.nan),
+                  'P': p_, 'Etp': etp_, 'a': va/vp, 'g': vg/vp, 'v': vv/vp,
+                  'e': ve/vp, 'Vp': vp, 'Va': va, 'Vg': vg, 'Vv': vv, 'Ve': ve}
+    elements = dict(zip(columns[1:], (area, au, np.broadcast_to(p_, (k, n)),
+                                      np.broadcast_to(etp_, (k, n)), a, g, v, e,
+                                      *volumes)))
+
+    names = [element.get('name', formulas.registry[element['element']]['label'])
+             for element in design] + ['System']
+    # rows ordered by climate, then by element (as in watbal)
+    results = pd.DataFrame({column: np.vstack([elements[column],
+                                               system[column]]).T.ravel()
+                            for column in columns[1:]})
+    results.insert(0, 'Element', np.tile(names, n))
+    results.insert(0, year, np.repeat(climates[year].to_numpy(), k + 1))
+    results.insert(0, scenario, np.repeat(climates[scenario].to_numpy(), k + 1))
+    return results
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Global sensitivity analysis of the partitioning factors to P, ETp and the
+parameters of an element over their ranges of validity (param_rages).
+
+    sobol('green_roof', n=2**16)     first-order and total Sobol indices
+    morris('green_roof', r=1000)     elementary effects (Morris screening)
+
+The factors are sampled uniformly within their ranges (or the bounds given)
+and evaluated vectorized, chunk by chunk, with kernels.evaluate(), so 10^5
+to 10^7 model runs need no more memory than one chunk. The partial sums of
+the estimators are accumulated over the chunks; chunks can be evaluated in
+parallel with multiprocessing (processes=...).
+
+Sobol indices use the Saltelli (2010) estimator of the first-order index and
+the Jansen estimator of the total index on the matrices A, B and AB_i. The
+base samples are scrambled Sobol' sequences when scipy is installed,
+otherwise pseudo-random numbers (numpy), one independent stream per chunk.
+"""
+
+import multiprocessing
+import warnings
+import numpy as np
+import pandas as pd
+import formulas
+from check_ranges import param_rages
+
+try:
+    from scipy.stats import qmc
+    HAVE_SCIPY = True
+except ImportError:
+    HAVE_SCIPY = False
+
+
+def factors(element, bounds=None, fixed=None):
+    '''
+    Factors of the analysis of an element and their bounds
+
+    Parameters
+    ----------
+    element : string
+            name of the method of Surface or Measure
+
+    bounds : dict
+           bounds (low, high) of inputs ('p', 'etp' or parameters), replacing
+           their ranges of validity; parameters without range must be given
+           here or in fixed. Parameters with a standard formula (e.g. fasm)
+           are computed from the other inputs unless given here.
+
+    fixed : dict
+          inputs held at a value (not analysed)
+
+    Returns
+    -------
+    factors : dict
+            input and its bounds (low, high)
+    '''
+    if element not in formulas.registry:
+        raise Exception(f"Unknown element: {element}")
+    bounds, fixed = bounds or {}, fixed or {}
+    unknown = set(bounds) - {'p', 'etp', *formulas.registry[element]['params']}
+    if unknown:
+        raise Exception(f"Unknown inputs of {element}: {', '.join(sorted(unknown))}")
+    result = {}
+    for name in ['p', 'etp', *formulas.registry[element]['params']]:
+        if name in fixed:
+            continue
+        if name in bounds:
+            low, high = bounds[name]
+        elif formulas._derived(element, name):
+            # computed from other inputs (e.g. fasm from kf)
+            continue
+        else:
+            key = formulas.range_key(element, name)
+            if key is None:
+                if formulas.registry[element]['params'].get(name) is None:
+                    raise Exception(f"{name} of {element} has no range: give its"
+                                    f" bounds or a fixed value")
+                continue
+            low, high = param_rages[key][:2]
+        if not low < high:
+            raise Exception(f"Invalid bounds of {name}: ({low}, {high})")
+        result[name] = (float(low), float(high))
+    if not result:
+        raise Exception(f"No factors of {element} to analyse")
+    return result
+
+
+def _evaluate(element, names, bounds, unit, fixed):
+    ''' a, g, v and e (4, n) of samples in the unit hypercube'''
+    import kernels
+
+    low, high = bounds[:, 0], bounds[:, 1]
+    x = low + unit*(high - low)
+    inputs = {**fixed, **{name: x[:, i] for i, name in enumerate(names)}}
+    p, etp = inputs.pop('p'), inputs.pop('etp')
+    n = len(unit)
+    results = np.stack([np.broadcast_to(np.asarray(r, dtype=float), (n,))
+                        for r in kernels.evaluate(element, p, etp, **inputs)])
+    undefined = np.isnan(results).any(axis=0)
+    if undefined.any():
+        row = x[np.argmax(undefined)]
+        raise Exception(f"{undefined.sum()} samples of {element} are not covered by a"
+                        f" regression equation, e.g. "
+                        + ', '.join(f"{name}={value:g}" for name, value in zip(names, row))
+                        + "; narrow the bounds or fix the inputs")
+    return results
+
+
+def _map(function, tasks, processes):
+    ''' results of function for every task, in parallel if processes > 1'''
+    if processes is None or processes <= 1:
+        return map(function, tasks)
+    with multiprocessing.Pool(processes) as pool:
+        return list(pool.imap(function, tasks))
+
+#%% Sobol indices
+
+def _base(seed, start, rows, dimension, chunk):
+    ''' rows of the base samples [A | B] (rows, 2*dimension) from start'''
+    if HAVE_SCIPY:
+        engine = qmc.Sobol(2*dimension, scramble=True, seed=seed)
+        engine.fast_forward(start)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)     # balance of 2**m points
+            return engine.random(rows)
+    return np.random.default_rng([seed, chunk]).random((rows, 2*dimension))
+
+
+def _sobol_chunk(task):
+    ''' partial sums of the estimators of a chunk of base samples'''
+    element, names, bounds, fixed, centre, seed, start, rows, chunk = task
+    d = len(names)
+    base = _base(seed, start, rows, d, chunk)
+    a, b = base[:, :d], base[:, d:]
+    fa = _evaluate(element, names, bounds, a, fixed) - centre
+    fb = _evaluate(element, names, bounds, b, fixed) - centre
+    first, total = np.empty((4, d)), np.empty((4, d))
+    for i in range(d):
+        ab = a.copy()
+        ab[:, i] = b[:, i]
+        fab = _evaluate(element, names, bounds, ab, fixed) - centre
+        first[:, i] = (fb*(fab - fa)).sum(axis=1)
+        total[:, i] = ((fa - fab)**2).sum(axis=1)
+    outputs = np.concatenate([fa, fb], axis=1)
+    return {'n': rows, 'sum': outputs.sum(axis=1), 'squares': (outputs**2).sum(axis=1),
+            'first': first, 'total': total}
+
+
+def sobol(element, n=2**14, bounds=None, fixed=None, chunk_size=2**12, processes=None,
+          seed=0):
+    '''
+    First-order and total Sobol indices of the partitioning factors
+
+    Parameters
+    ----------
+    element : string
+            name of the method of Surface or Measure
+
+    n : int
+      number of base samples; the model is evaluated n*(factors + 2) times
+      (a power of 2 with scipy)
+
+    bounds, fixed :
+                  bounds of the factors and fixed inputs, see factors()
+
+    chunk_size : int
+               base samples evaluated at a time
+
+    processes : int
+              number of worker processes (default: evaluated in this process)
+
+    seed : int
+         seed of the samples
+
+    Notes
+    ------
+    The variance of every output is estimated from A and B. Indices of
+    outputs without variance (e.g. e of surfaces) are NaN. The estimators
+    converge with n; the first-order index of an unimportant factor can
+    come out slightly negative.
+
+    Returns
+    -------
+    indices : DataFrame
+            component (a, g, v, e), factor, S1 (first-order) and ST (total)
+    '''
+    bounds_ = factors(element, bounds, fixed)
+    names = list(bounds_)
+    limits = np.array([bounds_[name] for name in names])
+    fixed = dict(fixed or {})
+    # outputs are centred on their value at the midpoint of the bounds
+    # (a constant: no bias), which avoids the cancellation of the estimators
+    # for outputs with a large mean
+    centre = _evaluate(element, names, limits, np.full((1, len(names)), 0.5), fixed)
+    tasks = [(element, names, limits, fixed, centre, seed, start,
+              min(chunk_size, n - start), i)
+             for i, start in enumerate(range(0, n, chunk_size))]
+
+    total_n, sums, squares = 0, np.zeros(4), np.zeros(4)
+    first, total = np.zeros((4, len(names))), np.zeros((4, len(names)))
+    for partial in _map(_sobol_chunk, tasks, processes):
+        total_n += partial['n']
+        sums += partial['sum']
+        squares += partial['squares']
+        first += partial['first']
+        total += partial['total']
+
+    mean = sums/(2*total_n)
+    variance = squares/(2*total_n) - mean**2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = np.where(variance > 1e-15, variance, np.nan)
+        s1 = first/total_n/variance[:, None]
+        st = total/(2*total_n)/variance[:, None]
+    rows = [{'component': component, 'factor': name, 'S1': s1[j, i], 'ST': st[j, i]}
+            for j, component in enumerate(formulas.components)
+            for i, name in enumerate(names)]
+    return pd.DataFrame(rows)
+
+#%% Morris screening
+
+def _trajectories(rng, r, d, levels):
+    ''' r trajectories (r, d + 1, d) of the Morris design and their steps'''
+    delta = levels/(2*(levels - 1))
+    start = rng.integers(0, levels, (r, d))/(levels - 1)
+    order = np.argsort(rng.random((r, d)), axis=1)
+    points = np.empty((r, d + 1, d))
+    points[:, 0] = start
+    steps = np.empty((r, d))
+    rows = np.arange(r)
+    for k in range(d):
+        x = points[:, k].copy()
+        factor = order[:, k]
+        # step up if it stays within the grid, otherwise down
+        step = np.where(x[rows, factor] + delta <= 1 + 1e-12, delta, -delta)
+        x[rows, factor] += step
+        points[:, k + 1] = x
+        steps[rows, factor] = step
+    return points, order, steps
+
+
+def _morris_chunk(task):
+    ''' elementary effects (4, rows, d) of a chunk of trajectories'''
+    element, names, bounds, fixed, seed, rows, levels, chunk = task
+    d = len(names)
+    rng = np.random.default_rng([seed, chunk])
+    points, order, steps = _trajectories(rng, rows, d, levels)
+    results = _evaluate(element, names, bounds, points.reshape(-1, d), fixed)
+    results = results.reshape(4, rows, d + 1)
+    effects = np.empty((4, rows, d))
+    index = np.arange(rows)
+    for k in range(d):
+        effects[:, index, order[:, k]] = ((results[:, :, k + 1] - results[:, :, k])
+                                          / steps[index, order[:, k]])
+    return effects
+
+
+def morris(element, r=1000, levels=4, bounds=None, fixed=None, chunk_size=10000,
+           processes=None, seed=0):
+    '''
+    Morris screening (elementary effects) of the partitioning factors
+
+    Parameters
+    ----------
+    element : string
+            name of the method of Surface or Measure
+
+    r : int
+      number of trajectories; the model is evaluated r*(factors + 1) times
+
+    levels : int
+           number of levels of the grid of every factor (even)
+
+    bounds, fixed :
+                  bounds of the factors and fixed inputs, see factors()
+
+    chunk_size : int
+               trajectories evaluated at a time
+
+    processes : int
+              number of worker processes (default: evaluated in this process)
+
+    seed : int
+         seed of the trajectories
+
+    Notes
+    ------
+    The effects are scaled to the unit range of every factor, i.e. they are
+    the change of the output for a change of the factor over its whole range.
+
+    Returns
+    -------
+    effects : DataFrame
+            component (a, g, v, e), factor, mu (mean effect), mu_star (mean
+            absolute effect) and sigma (standard deviation of the effects)
+    '''
+    bounds_ = factors(element, bounds, fixed)
+    names = list(bounds_)
+    limits = np.array([bounds_[name] for name in names])
+    fixed = dict(fixed or {})
+    tasks = [(element, names, limits, fixed, seed, min(chunk_size, r - start), levels, i)
+             for i, start in enumerate(range(0, r, chunk_size))]
+    effects = np.concatenate(list(_map(_morris_chunk, tasks, processes)), axis=1)
+    mu, mu_star = effects.mean(axis=1), np.abs(effects).mean(axis=1)
+    sigma = effects.std(axis=1, ddof=1) if r > 1 else np.full(mu.shape, np.nan)
+    rows = [{'component': component, 'factor': name, 'mu': mu[j, i],
+             'mu_star': mu_star[j, i], 'sigma': sigma[j, i]}
+            for j, component in enumerate(formulas.components)
+            for i, name in enumerate(names)]
+    return pd.DataFrame(rows)
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Local HTTP server (asyncio, standard library only) for the evaluation of
+surfaces, measures and water balances, e.g. for GIS clients.
+
+Endpoints (POST, JSON body and response):
+
+  /surface   {"element": "roof", "area": 100, "p": 800, "etp": 500, "sp": 0.3}
+  /measure   {"element": "infilt_swale", "kf": 42, "p": 800, "etp": 500,
+              "surfaces": [<results of /surface or /measure>, ...]}
+  /watbal    {"results": [<results of /surface or /measure>, ...]}
+
+Results are lists of dicts, as the methods of StudyArea with records=True,
+but not rounded. Concurrent requests of surfaces and measures are collected
+in micro-batches (up to batch_size requests, waiting at most latency seconds
+for the batch to fill) and evaluated with one vectorized call of
+formulas.evaluate_groups() per batch.
+
+Usage: python server.py [--host 127.0.0.1] [--port 8102] [--batch-size 256]
+                        [--latency 0.002]
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import numpy as np
+import formulas
+import kernels
+from check_ranges import validRange
+from dwa_a102 import watbal
+
+reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed'}
+
+#%% Requests
+
+def _validate(kind, request):
+    '''
+    Checks a request of a surface or measure as the methods of StudyArea do
+    and returns the element, p, etp and its parameters
+    '''
+    element = request.get('element')
+    if element not in formulas.registry or formulas.registry[element]['kind'] != kind:
+        raise Exception(f"Unknown {kind}: {element}")
+    p = request.get('p', 800)
+    etp = request.get('etp', 500)
+    values = {'p': p, 'etp': etp, **{name: request.get(name)
+                                     for name in formulas.registry[element]['params']}}
+    for name, value in values.items():
+        if value is not None and (isinstance(value, bool)
+                                  or not isinstance(value, (int, float))):
+            raise Exception(f"Parameter {name} of {element} must be a number, not"
+                            f" {json.dumps(value)}")
+    validRange(p, 'P')
+    validRange(etp, 'ETp')
+    params = {name: request[name] for name in formulas.registry[element]['params']
+              if request.get(name) is not None}
+    if element == 'drainage' and 'drainage_type' in request:
+        params['vegetated'] = int(formulas.drainage_type(request['drainage_type']))
+    for name, standard in formulas.registry[element]['params'].items():
+        if standard is None and name not in params and not formulas._derived(element, name):
+            raise Exception(f"Parameter {name} is required for {element}")
+    formulas.check(element, p, etp, **params)
+    area = request.get('area')
+    if kind == 'surface' and (isinstance(area, bool) or not isinstance(area, (int, float))):
+        raise Exception(f"Surface {element} requires an area")
+    return element, p, etp, params
+
+
+def evaluate_batch(items):
+    '''
+    Evaluates a batch of (element, p, etp, params) with one grouped call
+
+    Returns
+    -------
+    a, g, v, e, share : arrays
+                      partitioning factors and area of the measures as a
+                      fraction of Au (see formulas.area_share), one per item
+    '''
+    elements = np.array([element for element, *_ in items])
+    p = np.array([item[1] for item in items], dtype=float)
+    etp = np.array([item[2] for item in items], dtype=float)
+    names = {name for *_, params in items for name in params}
+    params = {name: np.array([item[3].get(name, np.nan) for item in items],
+                             dtype=float) for name in names}
+    a, g, v, e = formulas.evaluate_groups(elements, p, etp, params,
+                                          engine=kernels.evaluate)
+    share = formulas.area_shares(elements, p, etp, params)
+    return a, g, v, e, share
+
+
+def _row(element, area, au, p, etp, factors, vp, inflow):
+    ''' results of a surface or measure as a dict (see StudyArea)'''
+    a, g, v, e = factors
+    return {'Element' : formulas.registry[element]['label'], 'Area' : area,
+            'Au' : au, 'P' : p, 'Etp' : etp, 'a' : a, 'g' : g, 'v' : v, 'e' : e,
+            'Vp' : vp, 'Va' : inflow*a, 'Vg' : inflow*g, 'Vv' : inflow*v,
+            'Ve' : inflow*e}
+
+
+def surface_results(request, item, factors, share):
+    ''' results of a request of /surface'''
+    element, p, etp, _ = item
+    area = float(request['area'])
+    vp = area*p/1000
+    return [_row(element, area, area*factors[0], p, etp, factors, vp, vp)]
+
+
+def measure_results(request, item, factors, share):
+    ''' results of a request of /measure, joined to those of its surfaces'''
+    element, p, etp, _ = item
+    surfaces = request.get('surfaces', [])
+    au = sum(float(rows[-1]['Au']) for rows in surfaces)
+    va = sum(float(rows[-1]['Va']) for rows in surfaces)
+    area = au*share
+    vp = area*p/1000
+    # Runoff volume are passed to measure, Va = 0
+    previous_results = [dict(row, Va=0) for rows in surfaces for row in rows]
+    return previous_results + [_row(element, area, au, p, etp, factors, vp, vp + va)]
+
+#%% Micro-batching
+
+class Batcher(object):
+    '''
+    Collects concurrent evaluations into batches of up to batch_size items.
+    A batch is evaluated when it is full or latency seconds after its first
+    item arrived.
+    '''
+    def __init__(self, batch_size=256, latency=0.002):
+        self.batch_size = batch_size
+        self.latency = latency
+        self.queue = asyncio.Queue()
+        self.batches = 0
+        self.items = 0
+
+    async def evaluate(self, item):
+        ''' a, g, v, e and share of one item, evaluated in the next batch'''
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    async def _collect(self):
+        ''' next batch of (item, future)'''
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.latency
+        while len(batch) < self.batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        '''
+        Evaluates the batches until cancelled, in a worker thread so that
+        the event loop keeps serving connections. If a batch fails, its
+        items are evaluated one by one, so only the failing items get the
+        error.
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                results = await loop.run_in_executor(None, evaluate_batch,
+                                                     [item for item, _ in batch])
+            except Exception:
+                for item, future in batch:
+                    await self._evaluate_one(loop, item, future)
+                continue
+            for i, (_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result(tuple(float(x[i]) for x in results))
+
+    @staticmethod
+    async def _evaluate_one(loop, item, future):
+        ''' evaluates a single item of a failed batch'''
+        if future.done():
+            return
+        try:
+            results = await loop.run_in_executor(None, evaluate_batch, [item])
+        except Exception as error:
+            future.set_exception(error)
+        else:
+            future.set_result(tuple(float(x[0]) for x in results))
+
+#%% HTTP server
+
+class Server(object):
+    '''
+    HTTP/1.1 server (keep-alive) of the endpoints /surface, /measure and
+    /watbal, see the docstring of the module
+    '''
+    def __init__(self, batch_size=256, latency=0.002):
+        self.batcher = Batcher(batch_size, latency)
+        self.server = None
+        self._task = None
+
+    async def start(self, host='127.0.0.1', port=8102):
+        ''' starts the batcher and listens on host:port (port 0: any free port)'''
+        self._task = asyncio.create_task(self.batcher.run())
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self._task.cancel()
+
+    async def dispatch(self, method, path, body):
+        ''' status and JSON response of a request'''
+        if path not in ('/surface', '/measure', '/watbal'):
+            return 404, {'error': f"Unknown endpoint: {path}"}
+        if method != 'POST':
+            return 405, {'error': f"Use POST for {path}"}
+        try:
+            request = json.loads(body or b'{}')
+            if path == '/watbal':
+                return 200, watbal(*[list(rows) for rows in request['results']])
+            kind = path[1:]
+            item = _validate(kind, request)
+            *factors, share = await self.batcher.evaluate(item)
+            if math.isnan(factors[0]):
+                raise Exception(f"No regression equation of {item[0]} covers the"
+                                f" given parameters")
+            results = surface_results if kind == 'surface' else measure_results
+            return 200, results(request, item, factors, share)
+        except Exception as error:
+            return 400, {'error': str(error)}
+
+    @staticmethod
+    async def _respond(writer, status, response, close):
+        ''' writes a JSON response'''
+        payload = json.dumps(response).encode()
+        head = (f"HTTP/1.1 {status} {reasons[status]}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(payload)}\r\n")
+        if close:
+            head += "Connection: close\r\n"
+        writer.write(head.encode('latin-1') + b"\r\n" + payload)
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                headers = {}
+                try:
+                    method, path, version = line.decode('latin-1').split()
+                    while True:
+                        header = await reader.readline()
+                        if header in (b'\r\n', b'\n', b''):
+                            break
+                        name, _, value = header.decode('latin-1').partition(':')
+                        headers[name.strip().lower()] = value.strip()
+                    length = int(headers.get('content-length', 0))
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    # the rest of the connection cannot be parsed
+                    await self._respond(writer, 400, {'error': "Malformed request:"
+                                                      f" {line.decode('latin-1').strip()}"},
+                                        close=True)
+                    break
+                body = await reader.readexactly(length)
+                status, response = await self.dispatch(method, path, body)
+                close = (headers.get('connection', '').lower() == 'close'
+                         or version == 'HTTP/1.0')
+                await self._respond(writer, status, response, close)
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host='127.0.0.1', port=8102, batch_size=256, latency=0.002):
+    ''' runs the server until cancelled'''
+    server = Server(batch_size, latency)
+    port = await server.start(host, port)
+    print(f"Serving on http://{host}:{port} (batch size {batch_size},"
+          f" latency {latency*1000:g} ms)")
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8102)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help='seconds to wait for a batch to fill')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.batch_size, args.latency))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Interpolation tables of the partitioning factors, for interactive tools
+that query an element many times with single points (e.g. on every move of
+a slider).
+
+The factors a, g, v and e of an element are precomputed on a regular grid
+over P, ETp and the parameters with ranges of validity (param_rages) and
+stored as float32 arrays. A query is answered by multilinear interpolation
+of the 2**d values of its cell, without validation or evaluation of the
+regression equations, at a known accuracy: the maximum error of the table
+is measured when it is built. The cost of a query is the same for every
+element; a single point takes about as long as formulas.evaluate_scalar()
+and much less than check() plus evaluate(). Batches are evaluated faster
+by kernels.evaluate().
+
+    table = Surrogate('green_roof')
+    a, g, v, e = table(p=650, etp=550, h=120, kf=70, wkmax_wp=0.5)
+    table.error        # {'a': 0.0056, 'g': 0.0, 'v': 0.0056, 'e': 0.0}
+"""
+
+import itertools
+import numpy as np
+import formulas
+from sensitivity import factors
+
+
+class Surrogate:
+    '''
+    Interpolation table of the partitioning factors of an element
+
+    Parameters
+    ----------
+    element : string
+            name of the method of Surface or Measure
+
+    points : int or dict
+           number of grid points per dimension, or per input (default: the
+           largest number that keeps the table within size cells)
+
+    bounds, fixed :
+                  bounds of the dimensions and inputs held at a value, as in
+                  sensitivity.factors()
+
+    size : int
+         maximum number of cells of the table when points is not given
+
+    samples : int
+            number of random cell centres and points at which the error of
+            the interpolation is measured
+
+    seed : int
+         seed of the error samples
+
+    Notes
+    ------
+    Inputs outside the bounds of the table raise an Exception. Regions not
+    covered by a regression equation (e.g. joint ratios between 5 and 6 %
+    of permeable surfaces) are NaN and so are interpolations near them.
+    The error is the largest absolute difference to the regression
+    equations found at the centres of the cells (where the interpolation
+    error of smooth functions peaks) and at random points; it is measured,
+    not guaranteed.
+    '''
+    def __init__(self, element, points=None, bounds=None, fixed=None, size=10**6,
+                 samples=100000, seed=0):
+        import kernels
+
+        self.element = element
+        self.fixed = dict(fixed or {})
+        bounds = factors(element, bounds, fixed)
+        self.names = list(bounds)
+        d = len(self.names)
+        if points is None:
+            points = max(2, int(size**(1/d) + 1e-9))
+        if not isinstance(points, dict):
+            points = {name: points for name in self.names}
+        shape = tuple(int(points.get(name, 2)) for name in self.names)
+        if min(shape) < 2:
+            raise Exception("Tables need at least 2 points per dimension")
+        self.low = np.array([bounds[name][0] for name in self.names])
+        self.high = np.array([bounds[name][1] for name in self.names])
+        self.shape = shape
+        # values on the grid, in chunks of rows of the first dimension
+        self.values = np.empty((4,) + shape, dtype=np.float32)
+        self._lists()
+        axes = [np.linspace(self.low[i], self.high[i], shape[i]) for i in range(d)]
+        for i, x in enumerate(axes[0]):
+            grid = np.meshgrid(*[[x]] + axes[1:], indexing='ij')
+            inputs = {**self.fixed, **{name: g.ravel() for name, g in zip(self.names, grid)}}
+            p, etp = inputs.pop('p'), inputs.pop('etp')
+            results = kernels.evaluate(element, p, etp, **inputs)
+            for j, r in enumerate(results):
+                self.values[j, i] = np.broadcast_to(np.asarray(r, dtype=float),
+                                                    (grid[0].size,)).reshape(shape[1:])
+        self.error = self._error(samples, seed)
+
+    def _lists(self):
+        ''' steps of the grid, and the bounds and strides as lists for scalar
+        queries'''
+        self.step = (self.high - self.low)/(np.array(self.shape) - 1)
+        self._low, self._high, self._step = (self.low.tolist(), self.high.tolist(),
+                                             self.step.tolist())
+        self._names = set(self.names)
+        d = len(self.shape)
+        self._strides = [int(np.prod(self.shape[i + 1:])) for i in range(d)]
+        self._corners = np.array(list(itertools.product((0, 1), repeat=d))) @ self._strides
+        self._flat = self.values.reshape(4, -1)
+
+    def _error(self, samples, seed):
+        ''' maximum absolute error of the interpolation per component'''
+        import kernels
+
+        rng = np.random.default_rng(seed)
+        d = len(self.names)
+        cells = rng.integers(0, np.array(self.shape) - 1, (samples, d))
+        centres = self.low + (cells + 0.5)*self.step
+        random = self.low + rng.random((samples, d))*(self.high - self.low)
+        x = np.concatenate([centres, random])
+        inputs = {name: x[:, i] for i, name in enumerate(self.names)}
+        interpolated = self.interpolate(x)
+        params = {**self.fixed, **inputs}
+        p, etp = params.pop('p'), params.pop('etp')
+        exact = [np.broadcast_to(np.asarray(r, dtype=float), (len(x),))
+                 for r in kernels.evaluate(self.element, p, etp, **params)]
+        error = {}
+        for j, component in enumerate(formulas.components):
+            difference = np.abs(interpolated[j] - exact[j])
+            error[component] = float(np.nanmax(difference, initial=0))
+        return error
+
+    def interpolate(self, x, chunk_size=65536):
+        '''
+        Multilinear interpolation at points x (n, dimensions), in the order
+        of names, in chunks of chunk_size points
+
+        Returns
+        -------
+        values : array (4, n)
+               a, g, v and e
+        '''
+        x = np.atleast_2d(np.asarray(x, dtype=float))
+        if len(x) > chunk_size:
+            return np.concatenate([self.interpolate(x[start:start + chunk_size], chunk_size)
+                                   for start in range(0, len(x), chunk_size)], axis=1)
+        d = len(self.names)
+        position = (x - self.low)/self.step
+        index = np.clip(np.floor(position).astype(np.intp), 0, np.array(self.shape) - 2)
+        t = position - index
+        # weights of the 2**d corners of the cells, (n, 2**d)
+        weights = np.ones((len(x), 1))
+        for i in range(d):
+            weights = (weights[:, :, None]*np.stack([1 - t[:, i], t[:, i]], axis=1)[:, None, :]
+                       ).reshape(len(x), -1)
+        flat = (index @ np.array(self._strides))[:, None] + self._corners
+        return np.stack([np.einsum('nk,nk->n', values[flat], weights)
+                         for values in self._flat])
+
+    def _point(self, x):
+        ''' a, g, v and e of a single point (list of floats)'''
+        cell, weights = [slice(None)], []
+        for value, low, step, n in zip(x, self._low, self._step, self.shape):
+            position = (value - low)/step
+            j = min(max(int(position), 0), n - 2)
+            cell.append(slice(j, j + 2))
+            weights.append(position - j)
+        cube = self.values[tuple(cell)]
+        for t in reversed(weights):
+            cube = cube.dot((1 - t, t))
+        return tuple(cube.tolist())
+
+    def __call__(self, p=None, etp=None, **params):
+        '''
+        Partitioning factors a, g, v and e interpolated from the table
+
+        Parameters
+        ----------
+        p, etp, params :
+                       inputs of the element (scalars or arrays); the
+                       dimensions of the table are required, fixed inputs
+                       cannot be given (p and etp are omitted when fixed)
+
+        Returns
+        -------
+        a, g, v, e : float or array
+        '''
+        inputs = {name: value for name, value in {'p': p, 'etp': etp, **params}.items()
+                  if value is not None}
+        if inputs.keys() != self._names:
+            extra, missing = set(inputs) - self._names, self._names - set(inputs)
+            if extra:
+                raise Exception(f"Inputs fixed in the table of {self.element}:"
+                                f" {', '.join(sorted(extra))}")
+            raise Exception(f"Missing inputs of {self.element}: {', '.join(sorted(missing))}")
+        x = [inputs[name] for name in self.names]
+        if all(isinstance(value, (int, float)) for value in x):
+            for value, low, high, name in zip(x, self._low, self._high, self.names):
+                if not low <= value <= high:
+                    raise Exception(f"{name} outside the table of {self.element}"
+                                    f" ({low:g}, {high:g})")
+            return self._point(x)
+        columns = np.broadcast_arrays(*[np.asarray(inputs[name], dtype=float)
+                                        for name in self.names])
+        shape = columns[0].shape
+        x = np.stack([column.ravel() for column in columns], axis=1)
+        outside = (x < self.low) | (x > self.high)
+        if outside.any():
+            i = np.flatnonzero(outside.any(axis=0))[0]
+            raise Exception(f"{self.names[i]} outside the table of {self.element}"
+                            f" ({self.low[i]:g}, {self.high[i]:g})")
+        result = self.interpolate(x)
+        if shape == ():
+            return tuple(float(r[0]) for r in result)
+        return tuple(r.reshape(shape) for r in result)
+
+    def save(self, file):
+        ''' writes the table to file (.npz)'''
+        np.savez_compressed(file, element=self.element, names=np.array(self.names),
+                            low=self.low, high=self.high, values=self.values,
+                            fixed_names=np.array(list(self.fixed), dtype=str),
+                            fixed_values=np.array(list(self.fixed.values()), dtype=float),
+                            error=np.array([self.error[c] for c in formulas.components]))
+
+    @classmethod
+    def load(cls, file):
+        ''' table written by save()'''
+        table = cls.__new__(cls)
+        with np.load(file) as data:
+            table.element = str(data['element'])
+            table.names = [str(name) for name in data['names']]
+            table.low, table.high = data['low'], data['high']
+            table.values = data['values']
+            table.fixed = dict(zip([str(name) for name in data['fixed_names']],
+                                   data['fixed_values'].tolist()))
+            table.error = dict(zip(formulas.components, data['error'].tolist()))
+        table.shape = table.values.shape[1:]
+        table._lists()
+        return table
+
+
+def build(elements=None, **kwargs):
+    '''
+    Interpolation tables of several elements
+
+    Parameters
+    ----------
+    elements : list of strings
+             names of the elements (default: all the elements whose inputs
+             all have ranges of validity)
+
+    kwargs :
+           arguments of Surrogate
+
+    Returns
+    -------
+    tables : dict
+           element and its Surrogate
+    '''
+    if elements is None:
+        elements = []
+        for element in formulas.registry:
+            try:
+                factors(element, kwargs.get('bounds'), kwargs.get('fixed'))
+            except Exception:
+                continue
+            elements.append(element)
+    return {element: Surrogate(element, **kwargs) for element in elements}
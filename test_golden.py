@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""
+The evaluation engines of the package against the golden corpus (golden.py).
+"""
+
+import pytest
+import golden
+
+corpus = golden.load()
+
+
+@pytest.mark.parametrize('name', list(golden.engines()))
+def test_engine_reproduces_corpus(name):
+    report = golden.compare(golden.engines()[name], corpus)
+    failing = report[report['failures'] > 0]
+    assert report['failures'].sum() == 0, failing.to_string(index=False)
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""
+The analytic derivatives (gradients.py) against central finite differences
+at the inputs of the golden corpus (golden.py).
+"""
+
+import golden
+import gradients
+
+
+def test_gradients_match_finite_differences():
+    # every 4th input of every element
+    corpus = {element: (x[::4], y[::4]) for element, (x, y) in golden.load().items()}
+    report = gradients.compare(corpus)
+    failing = report[report['failures'] > 0]
+    assert report['points'].sum() > 0
+    assert report['failures'].sum() == 0, failing.to_string(index=False)
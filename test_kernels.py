@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""
+The fused kernels (kernels.py) against formulas.evaluate() for every element
+of the registry. Run with pytest; without numba the kernels run as plain
+Python.
+"""
+
+import numpy as np
+import formulas
+import kernels
+
+
+def test_every_element_has_an_equivalent_kernel():
+    differences = kernels.equivalence(n=500)
+    assert set(differences) == set(formulas.registry)
+    for element, difference in differences.items():
+        assert difference < 1e-9, f"{element}: {difference}"
+
+
+def test_element_without_kernel(monkeypatch):
+    spec = dict(formulas.registry['roof'], label='Test roof')
+    monkeypatch.setitem(formulas.registry, 'test_roof', spec)
+    p, etp = np.array([600.0, 800.0]), np.array([500.0, 600.0])
+    expected = formulas.evaluate('roof', p, etp, sp=0.3)
+    for result in (kernels.run('test_roof', p, etp, sp=0.3),
+                   kernels.evaluate('test_roof', p, etp, sp=0.3)):
+        for x, y in zip(result, expected):
+            np.testing.assert_array_equal(x, y)